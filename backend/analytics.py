@@ -0,0 +1,429 @@
+# backend/analytics.py
+"""
+構造化アクセスログのローカル分析ストア（任意機能）。
+
+log_utc_access のレコードを SQLite に貯め、分単位・時間単位のロールアップを
+インクリメンタルに更新する。ログを外部に出さなくても、モデル別の tokens/sec・
+入力サイズ分布・エラー率の推移を /utc/v0/stats から参照できる。
+
+- UTC_ANALYTICS_DB を指定したときだけ有効になる（未指定なら submit は何もしない）
+- リクエスト処理側はキューに積むだけで、書き込みはバックグラウンドスレッドがまとめて行う
+- キューが溢れたレコードは捨てて件数だけ数える（リクエストを待たせない）
+- WAL モードで開くため、マルチワーカー構成でも同じファイルに書き込める
+"""
+from __future__ import annotations
+
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+ANALYTICS_DB_PATH: str = os.getenv("UTC_ANALYTICS_DB", "")
+ANALYTICS_BATCH_SIZE: int = int(os.getenv("UTC_ANALYTICS_BATCH_SIZE", "256"))
+ANALYTICS_FLUSH_INTERVAL_S: float = float(os.getenv("UTC_ANALYTICS_FLUSH_INTERVAL_S", "1.0"))
+ANALYTICS_QUEUE_MAX: int = int(os.getenv("UTC_ANALYTICS_QUEUE_MAX", "10000"))
+# 生レコードの保持期間。ロールアップは期間に関係なく残る
+ANALYTICS_RAW_RETENTION_S: float = float(os.getenv("UTC_ANALYTICS_RAW_RETENTION_H", "24")) * 3600
+
+# 接続・スキーマ作成に失敗したときの再試行間隔（秒、失敗が続くと倍にして上限まで伸ばす）
+_RETRY_BACKOFF_S = 0.5
+_RETRY_BACKOFF_MAX_S = 30.0
+
+# close() が書き込みスレッドの終了を待つ上限（秒）。終了時に DB が使えなくてもプロセスを止めない
+_CLOSE_TIMEOUT_S = 5.0
+
+# ロールアップの粒度（秒）
+BUCKETS: Dict[str, int] = {"minute": 60, "hour": 3600}
+
+# 入力サイズ分布の上限（バイト）。最後の列はそれより大きいもの
+SIZE_BOUNDS: Tuple[int, ...] = (1024, 4096, 16384, 65536, 262144)
+_SIZE_COLUMNS: Tuple[str, ...] = tuple(f"size_le_{b // 1024}k" for b in SIZE_BOUNDS) + (
+    f"size_gt_{SIZE_BOUNDS[-1] // 1024}k",
+)
+
+# 生レコードとして保存するフィールド（本文などの PII は含まない）
+_RAW_FIELDS: Tuple[str, ...] = (
+    "ts",
+    "endpoint",
+    "model",
+    "status",
+    "http_status",
+    "error_code",
+    "char_count",
+    "input_size_bytes",
+    "token_count",
+    "processing_time_ms",
+)
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS requests (
+    ts REAL NOT NULL,
+    endpoint TEXT,
+    model TEXT,
+    status TEXT,
+    http_status INTEGER,
+    error_code TEXT,
+    char_count INTEGER,
+    input_size_bytes INTEGER,
+    token_count INTEGER,
+    processing_time_ms REAL
+);
+CREATE INDEX IF NOT EXISTS requests_ts ON requests (ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    bucket_s INTEGER NOT NULL,
+    bucket_start INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    tokens INTEGER NOT NULL,
+    chars INTEGER NOT NULL,
+    input_bytes INTEGER NOT NULL,
+    processing_ms_sum REAL NOT NULL,
+    processing_ms_max REAL NOT NULL,
+    {", ".join(f"{column} INTEGER NOT NULL" for column in _SIZE_COLUMNS)},
+    PRIMARY KEY (bucket_s, bucket_start, model, endpoint)
+);
+"""
+
+_ROLLUP_COLUMNS: Tuple[str, ...] = (
+    "requests",
+    "errors",
+    "tokens",
+    "chars",
+    "input_bytes",
+    "processing_ms_sum",
+    "processing_ms_max",
+) + _SIZE_COLUMNS
+
+_ROLLUP_UPSERT = (
+    "INSERT INTO rollups (bucket_s, bucket_start, model, endpoint, "
+    + ", ".join(_ROLLUP_COLUMNS)
+    + ") VALUES ("
+    + ", ".join("?" * (4 + len(_ROLLUP_COLUMNS)))
+    + ") ON CONFLICT (bucket_s, bucket_start, model, endpoint) DO UPDATE SET "
+    + ", ".join(
+        f"{column} = MAX({column}, excluded.{column})"
+        if column == "processing_ms_max"
+        else f"{column} = {column} + excluded.{column}"
+        for column in _ROLLUP_COLUMNS
+    )
+)
+
+
+def _size_index(size: Optional[int]) -> Optional[int]:
+    if size is None:
+        return None
+    for index, bound in enumerate(SIZE_BOUNDS):
+        if size <= bound:
+            return index
+    return len(SIZE_BOUNDS)
+
+
+def _aggregate(rows: Iterable[Tuple[Any, ...]]) -> Dict[Tuple[int, int, str, str], List[float]]:
+    """1 バッチ分の生レコードを (粒度, バケット開始, モデル, エンドポイント) ごとに集計する。"""
+    rollups: Dict[Tuple[int, int, str, str], List[float]] = {}
+    for ts, endpoint, model, status, _, _, chars, size, tokens, processing_ms in rows:
+        size_index = _size_index(size)
+        for bucket_s in BUCKETS.values():
+            key = (bucket_s, int(ts) // bucket_s * bucket_s, model or "", endpoint or "")
+            agg = rollups.get(key)
+            if agg is None:
+                agg = [0] * len(_ROLLUP_COLUMNS)
+                rollups[key] = agg
+            agg[0] += 1
+            agg[1] += status != "ok"
+            agg[2] += tokens or 0
+            agg[3] += chars or 0
+            agg[4] += size or 0
+            agg[5] += processing_ms or 0.0
+            agg[6] = max(agg[6], processing_ms or 0.0)
+            if size_index is not None:
+                agg[7 + size_index] += 1
+    return rollups
+
+
+class AnalyticsSink:
+    """
+    アクセスログレコードを SQLite にバッチ書き込みするシンク。
+
+    書き込みスレッドは最初の submit で起動する。fork 後の子プロセスでは
+    スレッドが引き継がれないため、プロセス ID が変わっていたらキューごと作り直す。
+
+    接続・スキーマ作成・古いレコードの削除に失敗してもスレッドは止めず、
+    バックオフしながら再試行する（その間に溢れたレコードは dropped に数える）。
+    """
+
+    def __init__(
+        self,
+        path: str = ANALYTICS_DB_PATH,
+        *,
+        batch_size: int = ANALYTICS_BATCH_SIZE,
+        flush_interval_s: float = ANALYTICS_FLUSH_INTERVAL_S,
+        queue_max: int = ANALYTICS_QUEUE_MAX,
+        raw_retention_s: float = ANALYTICS_RAW_RETENTION_S,
+    ) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.queue_max = queue_max
+        self.raw_retention_s = raw_retention_s
+        self.dropped = 0
+        self.written = 0
+        self.write_errors = 0
+        self.connect_errors = 0
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._queue: "queue.Queue[Optional[Tuple[Any, ...]]]" = queue.Queue(queue_max)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- 書き込み ---------------------------------------------------------------
+
+    def submit(self, record: Dict[str, Any]) -> None:
+        """レコードをキューに積む（リクエスト処理側から呼ばれる。ブロックしない）。"""
+        if not self.enabled:
+            return
+        self._ensure_started()
+        row = (time.time(), *(record.get(field) for field in _RAW_FIELDS[1:]))
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self) -> None:
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            if self._pid is not None:
+                # fork 後の子プロセス：親のキューとスレッドは使えない
+                self._queue = queue.Queue(self.queue_max)
+                self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, name="utc-analytics-writer", daemon=True
+            )
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            conn = self._open_with_retry()
+            if conn is None:
+                # 接続できないまま止められた：残りは捨てて flush() を待たせない
+                self._discard_queued()
+                return
+            try:
+                self._write_loop(conn)
+            finally:
+                conn.close()
+        except Exception as exc:
+            # 想定外の失敗。スレッドが止まったことは stats() の analytics_writer_alive で分かる
+            self.last_error = f"{type(exc).__name__}: {exc}"
+            self._discard_queued()
+
+    def _open_with_retry(self) -> Optional[sqlite3.Connection]:
+        """接続とスキーマ作成が成功するまでバックオフしながら再試行する。止められたら None。"""
+        delay = _RETRY_BACKOFF_S
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                conn.executescript(_SCHEMA)
+                return conn
+            except sqlite3.Error as exc:
+                if conn is not None:
+                    conn.close()
+                self.connect_errors += 1
+                self.last_error = f"{type(exc).__name__}: {exc}"
+            if self._stop.wait(delay):
+                return None
+            delay = min(delay * 2, _RETRY_BACKOFF_MAX_S)
+
+    def _write_loop(self, conn: sqlite3.Connection) -> None:
+        last_prune = 0.0
+        while True:
+            batch, stop = self._next_batch()
+            if batch:
+                self._write(conn, batch)
+            if time.monotonic() - last_prune > 60.0:
+                self._prune(conn)
+                last_prune = time.monotonic()
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            # close() の番兵を積めなかった場合（キューが満杯）は、空になった時点で止める
+            if stop or (self._stop.is_set() and self._queue.empty()):
+                return
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        try:
+            conn.execute(
+                "DELETE FROM requests WHERE ts < ?", (time.time() - self.raw_retention_s,)
+            )
+        except sqlite3.Error as exc:
+            # database is locked など。次の周期で再試行する
+            self.write_errors += 1
+            self.last_error = f"{type(exc).__name__}: {exc}"
+
+    def _discard_queued(self) -> None:
+        while True:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if row is not None:
+                self.dropped += 1
+            self._queue.task_done()
+
+    def _next_batch(self) -> Tuple[List[Tuple[Any, ...]], bool]:
+        """最大 batch_size 件、または flush_interval_s 経過までレコードを集める。"""
+        batch: List[Tuple[Any, ...]] = []
+        deadline = time.monotonic() + self.flush_interval_s
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    row = self._queue.get(timeout=timeout)
+                else:
+                    row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is None:
+                return batch, True
+            batch.append(row)
+        return batch, False
+
+    def _write(self, conn: sqlite3.Connection, batch: List[Tuple[Any, ...]]) -> None:
+        rollups = _aggregate(batch)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                f"INSERT INTO requests ({', '.join(_RAW_FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(_RAW_FIELDS))})",
+                batch,
+            )
+            conn.executemany(
+                _ROLLUP_UPSERT, [(*key, *values) for key, values in rollups.items()]
+            )
+            conn.execute("COMMIT")
+            self.written += len(batch)
+        except sqlite3.Error as exc:
+            # 分析ストアの失敗で書き込みスレッドを止めない
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.write_errors += 1
+            self.last_error = f"{type(exc).__name__}: {exc}"
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """キューに積まれたレコードがすべて書き込まれるまで待つ（書き込みスレッドが止まっていれば戻る）。"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks and thread.is_alive():
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            time.sleep(0.01)
+
+    def close(self, timeout: float = _CLOSE_TIMEOUT_S) -> None:
+        """残りを書き込んでから書き込みスレッドを止める。timeout 秒を超えたら待たずに戻る。"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass  # 書き込みスレッドは _stop を見てキューが空になった時点で止まる
+        self._thread.join(timeout)
+        self._thread = None
+
+    # --- 参照 ---------------------------------------------------------------------
+
+    def query(
+        self,
+        *,
+        bucket: str = "minute",
+        since: Optional[float] = None,
+        model: Optional[str] = None,
+        endpoint: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """ロールアップをバケット開始時刻の昇順で返す（tokens/sec・エラー率などの派生値付き）。"""
+        bucket_s = BUCKETS[bucket]
+        sql = (
+            f"SELECT bucket_start, model, endpoint, {', '.join(_ROLLUP_COLUMNS)} "
+            "FROM rollups WHERE bucket_s = ?"
+        )
+        params: List[Any] = [bucket_s]
+        if since is not None:
+            sql += " AND bucket_start >= ?"
+            params.append(int(since) // bucket_s * bucket_s)
+        if model is not None:
+            sql += " AND model = ?"
+            params.append(model)
+        if endpoint is not None:
+            sql += " AND endpoint = ?"
+            params.append(endpoint)
+        sql += " ORDER BY bucket_start, model, endpoint"
+
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+        results = []
+        for bucket_start, row_model, row_endpoint, *values in rows:
+            agg = dict(zip(_ROLLUP_COLUMNS, values))
+            requests = agg["requests"]
+            processing_s = agg["processing_ms_sum"] / 1000.0
+            results.append(
+                {
+                    "bucket_start": bucket_start,
+                    "model": row_model or None,
+                    "endpoint": row_endpoint or None,
+                    "requests": requests,
+                    "errors": agg["errors"],
+                    "error_rate": agg["errors"] / requests if requests else 0.0,
+                    "tokens": agg["tokens"],
+                    "chars": agg["chars"],
+                    "input_bytes": agg["input_bytes"],
+                    "tokens_per_sec": agg["tokens"] / processing_s if processing_s else None,
+                    "avg_processing_ms": agg["processing_ms_sum"] / requests if requests else None,
+                    "max_processing_ms": agg["processing_ms_max"],
+                    "size_distribution": {column[5:]: agg[column] for column in _SIZE_COLUMNS},
+                }
+            )
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "analytics_written": self.written,
+            "analytics_dropped": self.dropped,
+            "analytics_write_errors": self.write_errors,
+            "analytics_connect_errors": self.connect_errors,
+            "analytics_queued": self._queue.qsize(),
+            # 書き込みスレッドが未起動なら None、起動後に止まっていれば False
+            "analytics_writer_alive": None if self._thread is None else self._thread.is_alive(),
+            "analytics_last_error": self.last_error,
+        }
+
+
+# プロセス共通のシンク（UTC_ANALYTICS_DB 未指定なら無効）
+analytics_sink = AnalyticsSink()
+atexit.register(analytics_sink.close)
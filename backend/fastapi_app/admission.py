@@ -0,0 +1,339 @@
+# backend/fastapi_app/admission.py
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .handlers import build_error_response, log_error_access
+from .limits import request_body_limit
+
+# === 設定値（環境変数で上書き可能） ==========================================
+
+ADMISSION_ENABLED = os.getenv("UTC_ADMISSION_ENABLED", "1") not in ("0", "false", "False")
+
+# この値以下の Content-Length は small レーン、それを超えると large レーン
+SMALL_REQUEST_MAX_BYTES = int(os.getenv("UTC_ADMISSION_SMALL_MAX_BYTES", str(16 * 1024)))
+
+# 重み 1 単位あたりのバイト数（large レーンの重み計算に利用）
+WEIGHT_UNIT_BYTES = int(os.getenv("UTC_ADMISSION_WEIGHT_UNIT_BYTES", str(64 * 1024)))
+
+# レーンごとの同時実行容量（重みの合計）
+SMALL_LANE_CAPACITY = int(os.getenv("UTC_ADMISSION_SMALL_CAPACITY", "64"))
+LARGE_LANE_CAPACITY = int(os.getenv("UTC_ADMISSION_LARGE_CAPACITY", "16"))
+
+# キュー待ちの許容時間（これを超えそうなリクエストは即座に 503 を返す）
+QUEUE_WAIT_BUDGET_MS = float(os.getenv("UTC_ADMISSION_QUEUE_BUDGET_MS", "250"))
+
+# 503 応答時の Retry-After（秒）
+RETRY_AFTER_SECONDS = int(os.getenv("UTC_ADMISSION_RETRY_AFTER_S", "1"))
+
+# Content-Encoding 付きの本文は展開前の長さしか分からないため、展開後をこの倍率で見込む
+# （テキストの gzip はおおむね 3〜4 倍に縮む）。圧縮後の長さそのものは下限として使える
+COMPRESSED_SIZE_RATIO = int(os.getenv("UTC_ADMISSION_COMPRESSED_RATIO", "4"))
+
+# 流量制御の対象とするメソッド（/health などの GET は対象外）
+ADMITTED_METHODS = ("POST", "PUT", "PATCH")
+
+# サービス時間 EWMA の平滑化係数
+_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """キュー待ち予算を超えるため受け付けを拒否したことを表す。"""
+
+    def __init__(self, lane: str, reason: str) -> None:
+        self.lane = lane
+        self.reason = reason
+        super().__init__(f"{lane}: {reason}")
+
+
+class _Lane:
+    """
+    重み付きセマフォ 1 本分。
+    - in_use: 実行中リクエストの重み合計
+    - 待ち行列は FIFO（大きいリクエストが小さいリクエストに追い越され続けないようにする）
+    """
+
+    def __init__(self, name: str, capacity: int) -> None:
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.in_use = 0
+        self.in_flight = 0
+        self.queued_weight = 0
+        self._waiters: Deque[Tuple[int, "asyncio.Future[None]"]] = deque()
+        # 重み 1 単位あたりの平均保持時間（秒）。初回計測までは None
+        self.ewma_hold_s_per_unit: Optional[float] = None
+
+    def _fits(self, weight: int) -> bool:
+        return self.in_use + weight <= self.capacity
+
+    def predicted_wait_s(self, weight: int) -> float:
+        """待ち行列の先頭にいる重み + 自身の重み分の容量が空くまでの予測時間。"""
+        if not self._waiters and self._fits(weight):
+            return 0.0
+        if self.ewma_hold_s_per_unit is None:
+            return 0.0
+        backlog = self.queued_weight + weight + self.in_use - self.capacity
+        return max(0.0, backlog) * self.ewma_hold_s_per_unit
+
+    async def acquire(self, weight: int, budget_s: float) -> None:
+        if not self._waiters and self._fits(weight):
+            self._grant(weight)
+            return
+
+        if self.predicted_wait_s(weight) > budget_s:
+            raise AdmissionRejected(self.name, "predicted queue wait exceeds budget")
+
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        entry = (weight, future)
+        self._waiters.append(entry)
+        self.queued_weight += weight
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=budget_s)
+        except asyncio.TimeoutError:
+            if future.done():
+                # タイムアウトと同時に許可された場合は許可を優先する
+                return
+            self._remove_waiter(entry)
+            raise AdmissionRejected(self.name, "queue wait budget exceeded")
+        except BaseException:
+            if future.done():
+                self.release(weight, None)
+            else:
+                self._remove_waiter(entry)
+            raise
+
+    def _remove_waiter(self, entry: Tuple[int, "asyncio.Future[None]"]) -> None:
+        try:
+            self._waiters.remove(entry)
+        except ValueError:
+            return
+        self.queued_weight -= entry[0]
+        entry[1].cancel()
+        # 先頭が抜けたことで後続が入れる可能性がある
+        self._wake()
+
+    def _grant(self, weight: int) -> None:
+        self.in_use += weight
+        self.in_flight += 1
+
+    def _wake(self) -> None:
+        while self._waiters and self._fits(self._waiters[0][0]):
+            weight, future = self._waiters.popleft()
+            self.queued_weight -= weight
+            if future.done():
+                continue
+            self._grant(weight)
+            future.set_result(None)
+
+    def release(self, weight: int, held_s: Optional[float]) -> None:
+        self.in_use -= weight
+        self.in_flight -= 1
+        if held_s is not None:
+            sample = held_s / weight
+            if self.ewma_hold_s_per_unit is None:
+                self.ewma_hold_s_per_unit = sample
+            else:
+                self.ewma_hold_s_per_unit += _EWMA_ALPHA * (sample - self.ewma_hold_s_per_unit)
+        self._wake()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "lane": self.name,
+            "in_use": self.in_use,
+            "in_flight": self.in_flight,
+            "capacity": self.capacity,
+            "queued_weight": self.queued_weight,
+        }
+
+
+class AdmissionTicket:
+    """admit() が返す許可証。release() でレーンの容量を返却する。"""
+
+    def __init__(self, lane: _Lane, weight: int, queue_wait_ms: float) -> None:
+        self.lane = lane
+        self.weight = weight
+        self.queue_wait_ms = queue_wait_ms
+        self._acquired_at = time.perf_counter()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self.lane.release(self.weight, time.perf_counter() - self._acquired_at)
+
+    def log_fields(self) -> Dict[str, Any]:
+        """構造化アクセスログの extra に載せるレーン占有状況。"""
+        return {
+            "admission_lane": self.lane.name,
+            "admission_weight": self.weight,
+            "lane_in_use": self.lane.in_use,
+            "lane_capacity": self.lane.capacity,
+            "lane_queued_weight": self.lane.queued_weight,
+            "queue_wait_ms": self.queue_wait_ms,
+        }
+
+
+class AdmissionController:
+    """
+    入力サイズ（Content-Length）に応じた重み付き同時実行制御。
+    小さいリクエストと大きいリクエストを別レーンに分け、
+    最大サイズの入力が集中しても小さいリクエストのテールレイテンシを守る。
+    """
+
+    def __init__(
+        self,
+        *,
+        small_max_bytes: int = SMALL_REQUEST_MAX_BYTES,
+        weight_unit_bytes: int = WEIGHT_UNIT_BYTES,
+        small_capacity: int = SMALL_LANE_CAPACITY,
+        large_capacity: int = LARGE_LANE_CAPACITY,
+        queue_budget_ms: float = QUEUE_WAIT_BUDGET_MS,
+    ) -> None:
+        self.small_max_bytes = small_max_bytes
+        self.weight_unit_bytes = max(1, weight_unit_bytes)
+        self.small = _Lane("small", small_capacity)
+        self.large = _Lane("large", large_capacity)
+        self.queue_budget_s = queue_budget_ms / 1000.0
+
+    def classify(self, content_length: Optional[int]) -> Tuple[_Lane, int]:
+        """
+        本文の長さからレーンと重みを決める。
+        長さが分からない場合は最悪ケースとして large レーンの最大重みを使う
+        （AdmissionMiddleware は chunked の本文を読み込んでから長さを渡すため、通常は起きない）。
+        """
+        if content_length is not None and content_length <= self.small_max_bytes:
+            return self.small, 1
+
+        lane = self.large
+        if content_length is None:
+            return lane, lane.capacity
+        weight = math.ceil(content_length / self.weight_unit_bytes)
+        return lane, max(1, min(weight, lane.capacity))
+
+    async def admit(self, content_length: Optional[int]) -> AdmissionTicket:
+        lane, weight = self.classify(content_length)
+        started = time.perf_counter()
+        await lane.acquire(weight, self.queue_budget_s)
+        queue_wait_ms = (time.perf_counter() - started) * 1000.0
+        return AdmissionTicket(lane, weight, queue_wait_ms)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {"small": self.small.snapshot(), "large": self.large.snapshot()}
+
+
+def parse_content_length(value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    try:
+        length = int(value)
+    except ValueError:
+        return None
+    return length if length >= 0 else None
+
+
+# プロセス共通のコントローラ（ワーカープロセスごとに 1 つ）
+admission_controller = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """
+    重み付き同時実行制御の ASGI middleware。RequestDecompressionMiddleware より外側に置き、
+    本文の展開・パースより前にレーンを確保する（展開してから制限したのでは、圧縮された大きな入力が素通りする）。
+
+    - 重みは Content-Length から決める。Content-Encoding 付きなら COMPRESSED_SIZE_RATIO 倍で見込む
+    - Content-Length の無い（chunked）本文は上限まで読み込み、実際の長さで重みを決める
+      （読み込み中はレーンを占有しない。上限を超えたら 413）
+    - キュー待ち予算を超えるリクエストは 503 + Retry-After で返す
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not ADMISSION_ENABLED or scope["type"] != "http" or scope["method"] not in ADMITTED_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        content_length = parse_content_length(headers.get("content-length"))
+        if content_length is None:
+            limit = request_body_limit(QueryParams(scope.get("query_string", b"")))
+            body = await _read_body(receive, limit)
+            if body is None:
+                response = build_error_response("PAYLOAD_TOO_LARGE")
+                log_error_access(
+                    scope, "PAYLOAD_TOO_LARGE", response.status_code, "chunked body exceeds the limit"
+                )
+                await response(scope, receive, send)
+                return
+            content_length = len(body)
+            receive = _replay(body, receive)
+
+        size = content_length
+        if headers.get("content-encoding", "").strip().lower() not in ("", "identity"):
+            size *= max(1, COMPRESSED_SIZE_RATIO)
+
+        try:
+            ticket = await admission_controller.admit(size)
+        except AdmissionRejected as exc:
+            log_error_access(
+                scope,
+                "SERVICE_OVERLOADED",
+                503,
+                exc.reason,
+                input_size_bytes=content_length,
+                extra={"admission_lane": exc.lane},
+            )
+            response = build_error_response(
+                "SERVICE_OVERLOADED",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+            )
+            await response(scope, receive, send)
+            return
+
+        # request.state.admission（アクセスログの extra に使う）
+        scope.setdefault("state", {})["admission"] = ticket
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            ticket.release()
+
+
+async def _read_body(receive: Receive, limit: int) -> Optional[bytes]:
+    """本文を最後まで読む。合計が limit を超えた時点で None を返す。"""
+    parts: List[bytes] = []
+    total = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        total += len(chunk)
+        if total > limit:
+            return None
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+def _replay(body: bytes, receive: Receive) -> Receive:
+    sent = False
+
+    async def replay() -> Message:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay
@@ -0,0 +1,225 @@
+# backend/fastapi_app/compression.py
+"""
+圧縮されたリクエスト本文（Content-Encoding: gzip / zstd）の展開。
+
+- 受信したチャンクごとに展開し、展開後のサイズを逐次チェックする（展開爆弾対策）。
+  上限は limits.request_body_limit() と同じ（accuracy=estimate のときだけ大きい）
+- 展開後の本文を Content-Length 付きで後段に渡す。
+  admission（AdmissionMiddleware）はこの middleware より外側にあり、展開前の長さで重みを決める
+- zstd は任意依存（Python 3.14+ の compression.zstd、無ければ zstandard）。
+  どちらも無い環境では zstd を 415 で拒否する
+"""
+from __future__ import annotations
+
+import os
+import zlib
+from typing import Callable, List, Optional
+
+from starlette.datastructures import Headers, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .handlers import build_error_response, log_error_access
+from .limits import request_body_limit
+
+try:  # Python 3.14+
+    from compression import zstd as _zstd_stdlib
+except ImportError:  # pragma: no cover - 環境依存
+    _zstd_stdlib = None
+
+try:
+    import zstandard as _zstandard
+except ImportError:  # pragma: no cover - 環境依存
+    _zstandard = None
+
+ZSTD_AVAILABLE = _zstd_stdlib is not None or _zstandard is not None
+
+# レスポンスを gzip 圧縮する最小サイズ（小さいレスポンスは圧縮しても得にならない）
+GZIP_MIN_RESPONSE_BYTES = int(os.getenv("UTC_GZIP_MIN_RESPONSE_BYTES", "4096"))
+
+# zstandard の decompressobj は出力サイズを制限できないため、入力を細かく区切って渡す。
+# zstd の最大展開率（RLE ブロック: 4 バイト → 128KB）でも 1 回の出力は約 2MB に収まる
+_ZSTANDARD_FEED_BYTES = 64
+
+
+class _DecompressionError(Exception):
+    pass
+
+
+class _Decoder:
+    """チャンク単位の展開器。decompress() は max_length を超えて展開しない（超えた分は次回に回す）。"""
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        raise NotImplementedError
+
+    @property
+    def eof(self) -> bool:
+        raise NotImplementedError
+
+
+class _GzipDecoder(_Decoder):
+    def __init__(self) -> None:
+        # wbits=16+MAX_WBITS: gzip ヘッダ付き
+        self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        data = self._obj.unconsumed_tail + data
+        try:
+            return self._obj.decompress(data, max_length)
+        except zlib.error as exc:
+            raise _DecompressionError(str(exc)) from exc
+
+    @property
+    def eof(self) -> bool:
+        return self._obj.eof
+
+
+class _ZstdStdlibDecoder(_Decoder):
+    def __init__(self) -> None:
+        self._obj = _zstd_stdlib.ZstdDecompressor()
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        if self._obj.eof:
+            return b""
+        try:
+            return self._obj.decompress(data, max_length)
+        except _zstd_stdlib.ZstdError as exc:
+            raise _DecompressionError(str(exc)) from exc
+
+    @property
+    def eof(self) -> bool:
+        return self._obj.eof
+
+
+class _ZstandardDecoder(_Decoder):
+    def __init__(self) -> None:
+        self._obj = _zstandard.ZstdDecompressor().decompressobj()
+        self._pending = b""
+        self._eof = False
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        self._pending += data
+        out: List[bytes] = []
+        size = 0
+        try:
+            while self._pending and size <= max_length and not self._eof:
+                piece, self._pending = (
+                    self._pending[:_ZSTANDARD_FEED_BYTES],
+                    self._pending[_ZSTANDARD_FEED_BYTES:],
+                )
+                chunk = self._obj.decompress(piece)
+                out.append(chunk)
+                size += len(chunk)
+                self._eof = bool(self._obj.eof)
+        except _zstandard.ZstdError as exc:
+            raise _DecompressionError(str(exc)) from exc
+        return b"".join(out)
+
+    @property
+    def eof(self) -> bool:
+        return self._eof
+
+
+def _decoder_for(encoding: str) -> Optional[Callable[[], _Decoder]]:
+    if encoding in ("gzip", "x-gzip"):
+        return _GzipDecoder
+    if encoding == "zstd":
+        if _zstd_stdlib is not None:
+            return _ZstdStdlibDecoder
+        if _zstandard is not None:
+            return _ZstandardDecoder
+    return None
+
+
+class RequestDecompressionMiddleware:
+    """Content-Encoding 付きのリクエスト本文を展開してから後段に渡す ASGI middleware。"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = headers.get("content-encoding", "").strip().lower()
+        if encoding in ("", "identity"):
+            await self.app(scope, receive, send)
+            return
+
+        factory = _decoder_for(encoding)
+        if factory is None:
+            await self._reject(scope, receive, send, "UNSUPPORTED_ENCODING", f"Content-Encoding: {encoding}")
+            return
+
+        limit = request_body_limit(QueryParams(scope.get("query_string", b"")))
+        try:
+            body = await self._read_decompressed(receive, factory(), limit)
+        except _DecompressionError as exc:
+            await self._reject(scope, receive, send, "INVALID_ENCODING", str(exc))
+            return
+        if body is None:
+            await self._reject(scope, receive, send, "PAYLOAD_TOO_LARGE", "decompressed body exceeds the limit")
+            return
+
+        raw_headers = [
+            (name, value)
+            for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ]
+        raw_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        scope = dict(scope, headers=raw_headers)
+
+        sent = False
+
+        async def replay() -> Message:
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay, send)
+
+    @staticmethod
+    async def _reject(scope: Scope, receive: Receive, send: Send, code_str: str, message: str) -> None:
+        response = build_error_response(code_str, message)
+        log_error_access(scope, code_str, response.status_code, message)
+        await response(scope, receive, send)
+
+    @staticmethod
+    async def _read_decompressed(receive: Receive, decoder: _Decoder, limit: int) -> Optional[bytes]:
+        """
+        チャンクを受け取るたびに展開する。展開後の合計が limit を超えた時点で None を返す。
+        圧縮後のサイズも limit を上限とする（正常な圧縮データが展開後より大きくなることはない）。
+        """
+        parts: List[bytes] = []
+        total = 0
+        received = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise _DecompressionError("client disconnected")
+            chunk = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            received += len(chunk)
+            if received > limit:
+                return None
+
+            data = chunk
+            while True:
+                out = decoder.decompress(data, limit - total + 1)
+                data = b""
+                total += len(out)
+                if total > limit:
+                    return None
+                if out:
+                    parts.append(out)
+                # max_length で打ち切られた場合は残りを続けて展開する
+                if not out or decoder.eof:
+                    break
+
+        if not decoder.eof:
+            raise _DecompressionError("truncated compressed body")
+        return b"".join(parts)
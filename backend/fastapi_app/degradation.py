@@ -0,0 +1,133 @@
+# backend/fastapi_app/degradation.py
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, FrozenSet, Mapping, Optional, Tuple
+
+from core.token_counter import STAGE_LANGUAGE_DETECTION, STAGE_VERBOSE_META
+
+from .profiling import PROFILE_HEADER
+
+# === 設定値（環境変数で上書き可能） ==========================================
+
+DEGRADATION_ENABLED = os.getenv("UTC_DEGRADE_ENABLED", "1") not in ("0", "false", "False")
+
+# 負荷率 1.0 とみなす同時実行数と直近レイテンシ（EWMA）
+INFLIGHT_HIGH = int(os.getenv("UTC_DEGRADE_INFLIGHT_HIGH", "32"))
+LATENCY_HIGH_MS = float(os.getenv("UTC_DEGRADE_LATENCY_HIGH_MS", "200"))
+
+# レベルを上げる負荷率のしきい値（レベル 1, 2, 3）
+LEVEL_THRESHOLDS: Tuple[float, ...] = (0.5, 0.75, 1.0)
+
+# レベルを下げるときは しきい値 - HYSTERESIS を下回るまで待つ（境界でのばたつき防止）
+HYSTERESIS = 0.1
+
+# レイテンシ EWMA の平滑化係数
+_EWMA_ALPHA = 0.2
+
+# 成功時のログ出力（API 層で省略する段階）
+STAGE_SUCCESS_LOGGING = "success_logging"
+
+# レイテンシを負荷の指標に使うエンドポイント（ほかのルートは同時実行数にだけ数える）
+LATENCY_SAMPLED_PATH = "/utc/v0/token-count"
+
+# レベルごとに省略する段階（負荷が上がるほど累積で増える）
+LEVEL_SKIPPED_STAGES: Tuple[FrozenSet[str], ...] = (
+    frozenset(),
+    frozenset({STAGE_SUCCESS_LOGGING}),
+    frozenset({STAGE_SUCCESS_LOGGING, STAGE_LANGUAGE_DETECTION}),
+    frozenset({STAGE_SUCCESS_LOGGING, STAGE_LANGUAGE_DETECTION, STAGE_VERBOSE_META}),
+)
+
+
+class DegradationController:
+    """
+    負荷に応じて任意処理（成功ログ・言語判定・詳細な meta）を段階的に省略する。
+
+    - 負荷率 = max(同時実行数 / inflight_high, レイテンシ EWMA / latency_high_ms)
+    - レイテンシは他のリクエストと重なっていたときだけ記録し、負荷率にも
+      同時実行数が 2 以上のときだけ含める。単独で遅いリクエスト（コールドスタート、
+      1 コンテナ 1 リクエストの Lambda など）は混雑ではないため
+    - 負荷率が LEVEL_THRESHOLDS を超えるごとにレベルが 1 つ上がる
+    - 下げるときはヒステリシスを持たせる
+    - 同時実行数とレイテンシは timing middleware（main.py）が記録する
+    """
+
+    def __init__(
+        self,
+        *,
+        inflight_high: int = INFLIGHT_HIGH,
+        latency_high_ms: float = LATENCY_HIGH_MS,
+        enabled: bool = DEGRADATION_ENABLED,
+    ) -> None:
+        self.inflight_high = max(1, inflight_high)
+        self.latency_high_ms = latency_high_ms
+        self.enabled = enabled
+        self.in_flight = 0
+        self.ewma_latency_ms: Optional[float] = None
+        self.level = 0
+
+    def pressure(self) -> float:
+        latency_ratio = (
+            self.ewma_latency_ms / self.latency_high_ms
+            if self.in_flight > 1 and self.ewma_latency_ms is not None and self.latency_high_ms > 0
+            else 0.0
+        )
+        return max(self.in_flight / self.inflight_high, latency_ratio)
+
+    def _update_level(self) -> None:
+        pressure = self.pressure()
+        level = self.level
+        while level < len(LEVEL_THRESHOLDS) and pressure >= LEVEL_THRESHOLDS[level]:
+            level += 1
+        while level > 0 and pressure < LEVEL_THRESHOLDS[level - 1] - HYSTERESIS:
+            level -= 1
+        self.level = level
+
+    def enter(self) -> FrozenSet[str]:
+        """リクエスト開始を記録し、このリクエストで省略する段階を返す。"""
+        self.in_flight += 1
+        if not self.enabled:
+            return LEVEL_SKIPPED_STAGES[0]
+        self._update_level()
+        return LEVEL_SKIPPED_STAGES[self.level]
+
+    def exit(self, latency_ms: float, *, sample: bool = True) -> None:
+        """
+        リクエスト終了を記録する。sample=False（意図的に遅いリクエスト）や、
+        他に処理中のリクエストが無かった場合はレイテンシを EWMA に入れない。
+        """
+        contended = self.in_flight > 1
+        self.in_flight -= 1
+        if sample and contended:
+            if self.ewma_latency_ms is None:
+                self.ewma_latency_ms = latency_ms
+            else:
+                self.ewma_latency_ms += _EWMA_ALPHA * (latency_ms - self.ewma_latency_ms)
+        if self.enabled:
+            self._update_level()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "degradation_level": self.level,
+            "degradation_pressure": round(self.pressure(), 3),
+            "in_flight": self.in_flight,
+            "ewma_latency_ms": self.ewma_latency_ms,
+        }
+
+
+def samples_latency(path: str, query_params: Mapping[str, str], headers: Mapping[str, str]) -> bool:
+    """
+    このリクエストのレイテンシを負荷の指標に使うか。
+    トークン数計算以外のルートと、推定モード・プロファイル要求のような
+    意図的に遅いリクエストは除く。
+    """
+    return (
+        path == LATENCY_SAMPLED_PATH
+        and query_params.get("accuracy", "exact") == "exact"
+        and PROFILE_HEADER not in headers
+    )
+
+
+# プロセス共通のコントローラ（ワーカープロセスごとに 1 つ）
+degradation_controller = DegradationController()
@@ -1,12 +1,22 @@
 from datetime import datetime, timezone
+from typing import Any, Dict, Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
+from starlette.routing import Match
+from starlette.types import Scope
 
+from backend.observability import log_logging_failure, log_utc_access
 from core.token_counter import UtcError
 
 API_VERSION = "0.1.0"
 
+# どのルートにも一致しないリクエストのアクセスログ上の endpoint。
+# 生のパスを使うと、存在しないパスやセッション ID ごとに分析ストアの集計行が増え続ける
+UNMATCHED_ENDPOINT = "other"
+
 
 # エラーコード（文字列表現） → 日本語メッセージ
 ERROR_MESSAGES = {
@@ -14,6 +24,18 @@ ERROR_MESSAGES = {
     "EMPTY_TEXT": "入力テキストが空です。",
     "UNSUPPORTED_MODEL": "未対応のモデルです。",
     "PAYLOAD_TOO_LARGE": "入力サイズが大きすぎます。",
+    "SERVICE_OVERLOADED": "混雑のため処理できません。",
+    "TOKENIZER_UNAVAILABLE": "トークナイザを読み込めません。",
+    "INVALID_EDIT": "編集範囲が不正です。",
+    "SESSION_NOT_FOUND": "セッションが見つかりません。",
+    "ANALYTICS_DISABLED": "分析ストアが無効です。",
+    "UNAUTHORIZED": "認証に失敗しました。",
+    "PROFILE_NOT_FOUND": "プロファイルが見つかりません。",
+    "UNSUPPORTED_ENCODING": "未対応の Content-Encoding です。",
+    "INVALID_ENCODING": "圧縮データを展開できません。",
+    "INVALID_SPAN": "範囲指定が不正です。",
+    "UNSUPPORTED_OPTION": "指定のオプションの組み合わせは利用できません。",
+    "RESPONSE_TOO_LARGE": "レスポンスが大きすぎます。",
 }
 
 # エラーコード（文字列表現） → 英語ヒント
@@ -22,6 +44,21 @@ ERROR_HINTS = {
     "EMPTY_TEXT": "Provide non-empty text (not only whitespace).",
     "UNSUPPORTED_MODEL": "Use a supported model name for this API.",
     "PAYLOAD_TOO_LARGE": "Reduce the input size or split the request.",
+    "SERVICE_OVERLOADED": "Retry after the number of seconds in the Retry-After header.",
+    "TOKENIZER_UNAVAILABLE": "The tokenizer file for this model could not be loaded on the server.",
+    "INVALID_EDIT": "Check that offset and delete are within the current document.",
+    "SESSION_NOT_FOUND": "The session expired or was evicted. Create a new session with the full text.",
+    "ANALYTICS_DISABLED": "Set UTC_ANALYTICS_DB to enable the local analytics store.",
+    "UNAUTHORIZED": "Send the admin token in the X-UTC-Admin-Token header (UTC_ADMIN_TOKEN must be set).",
+    "PROFILE_NOT_FOUND": "The profile was evicted by slower requests. List current profiles first.",
+    "UNSUPPORTED_ENCODING": "Use Content-Encoding gzip or zstd (zstd requires server-side support).",
+    "INVALID_ENCODING": "The request body is not a complete stream in the declared Content-Encoding.",
+    "INVALID_SPAN": "Each span must satisfy 0 <= start <= end <= char_count.",
+    "UNSUPPORTED_OPTION": (
+        "spans and return_offsets need accuracy=exact and a tokenizer that reports offsets "
+        "(not SentencePiece); accuracy must be exact or estimate."
+    ),
+    "RESPONSE_TOO_LARGE": "Use the streaming endpoint, or request offsets for a smaller text.",
 }
 
 # エラーコード（文字列表現） → HTTPステータス
@@ -30,6 +67,18 @@ ERROR_HTTP_STATUS = {
     "EMPTY_TEXT": 422,
     "UNSUPPORTED_MODEL": 400,
     "PAYLOAD_TOO_LARGE": 413,
+    "SERVICE_OVERLOADED": 503,
+    "TOKENIZER_UNAVAILABLE": 503,
+    "INVALID_EDIT": 400,
+    "SESSION_NOT_FOUND": 404,
+    "ANALYTICS_DISABLED": 404,
+    "UNAUTHORIZED": 401,
+    "PROFILE_NOT_FOUND": 404,
+    "UNSUPPORTED_ENCODING": 415,
+    "INVALID_ENCODING": 400,
+    "INVALID_SPAN": 400,
+    "UNSUPPORTED_OPTION": 400,
+    "RESPONSE_TOO_LARGE": 413,
 }
 
 
@@ -37,26 +86,105 @@ def _now_utc_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def build_error_response(
+    code_str: str,
+    default_message: str | None = None,
+    headers: Dict[str, str] | None = None,
+) -> JSONResponse:
+    """APIron Error Spec 形式のエラーレスポンスを組み立てる。"""
+    status = ERROR_HTTP_STATUS.get(code_str, 500)
+    message = ERROR_MESSAGES.get(code_str, default_message or code_str)
+    hint = ERROR_HINTS.get(code_str, "Check your request and try again.")
+
+    body = {
+        "error": {
+            "code": code_str,    # そのまま "EMPTY_TEXT" 等を返す
+            "message": message,  # 日本語メッセージ
+            "hint": hint,        # 英語ヒント
+        },
+        "meta": {
+            "version": API_VERSION,
+            "utc_timestamp": _now_utc_iso(),
+        },
+    }
+    return JSONResponse(status_code=status, content=body, headers=headers)
+
+
 def register_exception_handlers(app: FastAPI) -> None:
     @app.exception_handler(UtcError)
-    async def utc_error_handler(_, exc: UtcError) -> JSONResponse:
+    async def utc_error_handler(request: Request, exc: UtcError) -> JSONResponse:
         # UtcError 側では code は既に "EMPTY_TEXT" などの文字列になっている想定
-        code_str = str(exc.code)
-
-        status = ERROR_HTTP_STATUS.get(code_str, 500)
-        message = ERROR_MESSAGES.get(code_str, str(exc))
-        hint = ERROR_HINTS.get(code_str, "Check your request and try again.")
-
-        body = {
-            "error": {
-                "code": code_str,    # そのまま "EMPTY_TEXT" 等を返す
-                "message": message,  # 日本語メッセージ
-                "hint": hint,        # 英語ヒント
-            },
-            "meta": {
-                "version": API_VERSION,
-                "utc_timestamp": _now_utc_iso(),
-            },
-        }
-        return JSONResponse(status_code=status, content=body)
+        response = build_error_response(str(exc.code), str(exc))
+        # ハンドラは middleware の内側で動くため lambda_context はまだ無く、
+        # モデル名はルートが request.state.utc_model に残した値を使う
+        log_error_access(
+            request.scope,
+            str(exc.code),
+            response.status_code,
+            str(exc),
+            model=getattr(request.state, "utc_model", None),
+        )
+        return response
+
+    @app.exception_handler(RequestValidationError)
+    async def validation_error_handler(request: Request, exc: RequestValidationError) -> JSONResponse:
+        # レスポンスは FastAPI 既定の 422 のまま。エラー率の集計に入るようログだけ足す
+        log_error_access(request.scope, "VALIDATION_ERROR", 422, f"{len(exc.errors())} validation error(s)")
+        return await request_validation_exception_handler(request, exc)
+
+
+def endpoint_template(scope: Scope) -> str:
+    """
+    アクセスログ・分析ストアに記録する endpoint（"/utc/v0/token-count/sessions/{session_id}" のようなルートのパス）。
+    ルーティング前の middleware から呼ばれた場合はアプリのルートと照合し、一致しなければ UNMATCHED_ENDPOINT。
+    """
+    route = scope.get("route")
+    if route is None:
+        routes = getattr(getattr(scope.get("app"), "router", None), "routes", ())
+        for candidate in routes:
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = candidate
+                break
+            if match == Match.PARTIAL and route is None:
+                # パスは一致しメソッドだけ違う（405）
+                route = candidate
+    return getattr(route, "path", None) or UNMATCHED_ENDPOINT
+
 
+def log_error_access(
+    scope: Scope,
+    code_str: str,
+    http_status: int,
+    message: str,
+    *,
+    model: Optional[str] = None,
+    input_size_bytes: Optional[int] = None,
+    extra: Optional[Dict[str, Any]] = None,
+) -> None:
+    """
+    ルートに届く前後で返したエラー 1 件の構造化アクセスログ（エラー率の集計に使う）。
+    ログ出力の失敗でレスポンスを壊さない。
+    """
+    try:
+        log_utc_access(
+            request_id=None,
+            source=None,
+            endpoint=endpoint_template(scope),
+            status="error",
+            http_status=http_status,
+            lambda_duration_ms=None,
+            cold_start=None,
+            model=model,
+            char_count=None,
+            input_size_bytes=input_size_bytes,
+            token_count=None,
+            token_density=None,
+            input_language=None,
+            processing_time_ms=None,
+            error_code=code_str,
+            error_message=message,
+            extra=extra,
+        )
+    except Exception as log_exc:
+        log_logging_failure(log_exc)
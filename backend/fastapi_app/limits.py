@@ -0,0 +1,39 @@
+# backend/fastapi_app/limits.py
+from __future__ import annotations
+
+import os
+from typing import Mapping
+
+from core.estimate import ESTIMATE_MAX_BYTES
+from core.token_counter import MAX_CHAR_COUNT
+
+# リクエスト本文（JSON）の上限バイト数。
+# 上限ちょうどのテキストでも JSON エスケープで膨らむため、core の MAX_BYTES より大きく取る:
+#   サロゲートペアが必要な文字は "\ud83d\ude00" の 12 バイトになり得るので 1 文字あたり最大 12 バイト
+#   + model 名などの JSON の骨格分
+MAX_REQUEST_BODY_BYTES = int(
+    os.getenv("UTC_MAX_REQUEST_BODY_BYTES", str(MAX_CHAR_COUNT * 12 + 64 * 1024))
+)
+
+# accuracy=estimate のリクエスト本文の上限。
+# 推定モードは UTF-8 で ESTIMATE_MAX_BYTES まで受け付ける。JSON エスケープ（ensure_ascii）では
+# 非 ASCII 文字は UTF-8 の最大 3 倍（4 バイト文字 → "\ud83d\ude00" の 12 バイト）になるが、
+# 制御文字は 1 バイト → "\u0001" の 6 バイトで、厳密な最悪値は 6 倍になる。
+# 6 倍で取ると上限が 200MB 近くになりパース前に読み込む量が大きすぎるため、意図的に 3 倍としている。
+# 制御文字の多いテキストは、上限内でもエスケープ後にこの値を超えて 413 になり得る
+# （UTF-8 のまま送れば JSON 本文はほぼテキストと同じ長さに収まる）
+ESTIMATE_MAX_REQUEST_BODY_BYTES = int(
+    os.getenv("UTC_ESTIMATE_MAX_REQUEST_BODY_BYTES", str(ESTIMATE_MAX_BYTES * 3 + 64 * 1024))
+)
+
+
+def request_body_limit(query_params: Mapping[str, str]) -> int:
+    """クエリに accuracy=estimate があれば推定モードの上限、それ以外は通常の上限。"""
+    if query_params.get("accuracy") == "estimate":
+        return ESTIMATE_MAX_REQUEST_BODY_BYTES
+    return MAX_REQUEST_BODY_BYTES
+
+
+def body_exceeds_limit(content_length: int | None, limit: int = MAX_REQUEST_BODY_BYTES) -> bool:
+    """Content-Length が分かっていて上限を超えている場合のみ True（不明な場合は core 側で検証する）。"""
+    return content_length is not None and content_length > limit
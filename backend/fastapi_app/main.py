@@ -5,9 +5,14 @@ import time
 from typing import Callable
 
 from fastapi import FastAPI, Request, Response
+from starlette.middleware.gzip import GZipMiddleware
 
+from .admission import AdmissionMiddleware, parse_content_length
+from .compression import GZIP_MIN_RESPONSE_BYTES, RequestDecompressionMiddleware
+from .degradation import degradation_controller, samples_latency
+from .limits import body_exceeds_limit, request_body_limit
 from .router import router
-from .handlers import register_exception_handlers
+from .handlers import build_error_response, log_error_access, register_exception_handlers
 
 app = FastAPI(
     title="Universal Token Counter API",
@@ -24,6 +29,9 @@ async def add_timing_and_context(
 
     start = time.perf_counter()
 
+    # 同時実行数・直近レイテンシに応じて、このリクエストで省略する任意処理を決める
+    request.state.skip_stages = degradation_controller.enter()
+
     # Mangum が載せた event
     aws_event = request.scope.get("aws.event")
     lambda_ctx = None
@@ -47,6 +55,10 @@ async def add_timing_and_context(
     finally:
         end = time.perf_counter()
         processing_ms = (end - start) * 1000.0
+        degradation_controller.exit(
+            processing_ms,
+            sample=samples_latency(request.url.path, request.query_params, request.headers),
+        )
 
         if lambda_ctx is not None:
             if lambda_ctx.get("lambda_duration_ms") is None:
@@ -58,6 +70,40 @@ async def add_timing_and_context(
     return response
 
 
+# middleware は後に登録したものほど外側で動く。外側から順に
+#   reject_oversized_body → AdmissionMiddleware → RequestDecompressionMiddleware → GZipMiddleware → add_timing_and_context
+# admission は展開より外側に置き、圧縮された大きな本文も展開前にレーンの重みで制限する。
+# 大きいレスポンス（オフセット列など）は Accept-Encoding: gzip のクライアントに圧縮して返す
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_RESPONSE_BYTES)
+app.add_middleware(RequestDecompressionMiddleware)
+app.add_middleware(AdmissionMiddleware)
+
+
+@app.middleware("http")
+async def reject_oversized_body(
+    request: Request,
+    call_next: Callable[[Request], Response],
+) -> Response:
+    """
+    Content-Length が上限を超えるリクエストは、本文を読み込んで
+    TokenCountRequest にパースする前に 413 で返す（admission の容量も消費しない）。
+    accuracy=estimate のときだけ大きい上限を使う。
+    圧縮された本文はここでは展開前の長さで検査し、展開後の長さは RequestDecompressionMiddleware が検査する。
+    """
+    content_length = parse_content_length(request.headers.get("content-length"))
+    if body_exceeds_limit(content_length, request_body_limit(request.query_params)):
+        response = build_error_response("PAYLOAD_TOO_LARGE")
+        log_error_access(
+            request.scope,
+            "PAYLOAD_TOO_LARGE",
+            response.status_code,
+            "Content-Length exceeds the request body limit",
+            input_size_bytes=content_length,
+        )
+        return response
+    return await call_next(request)
+
+
 # ルーター登録
 app.include_router(router, prefix="/utc/v0")
 
@@ -69,3 +115,10 @@ register_exception_handlers(app)
 async def health_check():
     return {"status": "ok"}
 
+
+
+if __name__ == "__main__":
+    # python -m backend.fastapi_app.main → マルチワーカーで起動（設定は server.py を参照）
+    from .server import main
+
+    raise SystemExit(main(app=app))
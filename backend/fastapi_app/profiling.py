@@ -0,0 +1,207 @@
+# backend/fastapi_app/profiling.py
+from __future__ import annotations
+
+import cProfile
+import heapq
+import io
+import itertools
+import marshal
+import os
+import pstats
+import secrets
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+# === 設定値（環境変数で上書き可能） ==========================================
+
+# 全リクエストをプロファイルする（通常は 0 のまま、ヘッダでリクエスト単位に有効化する）
+PROFILE_ENABLED = os.getenv("UTC_PROFILE_ENABLED", "0") in ("1", "true", "True")
+
+# 管理用トークン。未設定なら管理ルートとプロファイル要求ヘッダは無効
+ADMIN_TOKEN = os.getenv("UTC_ADMIN_TOKEN", "")
+
+# リクエスト単位でプロファイルを要求するヘッダ（値に ADMIN_TOKEN を指定する）
+PROFILE_HEADER = "x-utc-profile"
+
+# このレイテンシ（ミリ秒）以上のリクエストだけ保持する
+PROFILE_THRESHOLD_MS = float(os.getenv("UTC_PROFILE_THRESHOLD_MS", "100"))
+
+# 保持するプロファイルの数（遅いものから N 件）
+PROFILE_KEEP = int(os.getenv("UTC_PROFILE_KEEP", "20"))
+
+# 指定すると保持したプロファイルを pstats 形式（.prof）でこのディレクトリにも書き出す
+PROFILE_DIR = os.getenv("UTC_PROFILE_DIR", "")
+
+# テキストレポートに載せる関数の数
+REPORT_LIMIT = 40
+
+# Python 3.12 以降の cProfile は sys.monitoring 上で動き、計測中は全スレッドの呼び出しを記録する
+PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+
+
+def is_admin(headers: Mapping[str, str], header: str = "x-utc-admin-token") -> bool:
+    """ヘッダの値が ADMIN_TOKEN と一致するか（ADMIN_TOKEN 未設定なら常に False）。"""
+    value = headers.get(header)
+    if not ADMIN_TOKEN or value is None:
+        return False
+    # compare_digest は非 ASCII の str を受け付けない（TypeError）ため bytes で比較する。
+    # Starlette はヘッダを latin-1 で復号するので、latin-1 で戻すと受信したバイト列になる
+    try:
+        received = value.encode("latin-1")
+    except UnicodeEncodeError:
+        return False
+    return secrets.compare_digest(received, ADMIN_TOKEN.encode("utf-8"))
+
+
+def should_profile(headers: Mapping[str, str]) -> bool:
+    """このリクエストをプロファイルするか。無効時はヘッダを 1 回引くだけ。"""
+    if PROFILE_ENABLED:
+        return True
+    return PROFILE_HEADER in headers and is_admin(headers, PROFILE_HEADER)
+
+
+class ProfileStore:
+    """
+    遅いリクエストのプロファイルを最大 keep 件保持する（最小ヒープで最も速いものから捨てる）。
+
+    Python 3.11 までの cProfile は計測を始めたスレッドだけを記録する。
+    3.12 以降は sys.monitoring のプロファイラ枠（プロセスで 1 つ）を使い、
+    - 計測中は他のスレッド（同時に処理中の別リクエスト）の呼び出しも同じプロファイルに入る
+    - 別の Profile が有効な間に enable すると ValueError（Another profiling tool is already active）
+    このため同時に 1 つだけ計測し（_profiler_lock）、計測中に来た別リクエストと、
+    他のツール（coverage など）がプロファイラ枠を使っている間のリクエストはプロファイルせずに実行する。
+    3.12 以降のプロファイルは「そのリクエストの処理中にプロセスで動いたもの」として読む。
+    """
+
+    def __init__(
+        self,
+        *,
+        keep: int = PROFILE_KEEP,
+        threshold_ms: float = PROFILE_THRESHOLD_MS,
+        dump_dir: str = PROFILE_DIR,
+    ) -> None:
+        self.keep = max(1, keep)
+        self.threshold_ms = threshold_ms
+        self.dump_dir = dump_dir
+        self.captured = 0
+        self.skipped_busy = 0
+        self.skipped_tool_active = 0
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._profiler_lock = threading.Lock()
+
+    def run(self, fn: Callable[[], Any]) -> Tuple[Any, Optional[Dict[Any, Any]]]:
+        """fn を cProfile 付きで実行し、(戻り値, pstats の統計 dict) を返す。"""
+        if not self._profiler_lock.acquire(blocking=False):
+            self.skipped_busy += 1
+            return fn(), None
+        try:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # 3.12+: プロファイラ枠を他のツールが使っている。fn の例外と混ざらないよう enable だけを囲む
+                self.skipped_tool_active += 1
+                return fn(), None
+            try:
+                value = fn()
+            finally:
+                profiler.disable()
+                profiler.create_stats()
+            return value, profiler.stats
+        finally:
+            self._profiler_lock.release()
+
+    def offer(self, elapsed_ms: float, stats: Dict[Any, Any], info: Dict[str, Any]) -> Optional[str]:
+        """しきい値以上かつ上位 keep 件に入る場合に保持し、プロファイル ID を返す。"""
+        if elapsed_ms < self.threshold_ms:
+            return None
+
+        profile_id = secrets.token_hex(6)
+        entry = {
+            "profile_id": profile_id,
+            "elapsed_ms": elapsed_ms,
+            "captured_at": datetime.now(timezone.utc).isoformat(),
+            "all_threads": PROFILES_ALL_THREADS,
+            **info,
+            "_stats": stats,
+        }
+        with self._lock:
+            item = (elapsed_ms, next(self._seq), entry)
+            if len(self._heap) < self.keep:
+                heapq.heappush(self._heap, item)
+                evicted = None
+            elif elapsed_ms > self._heap[0][0]:
+                evicted = heapq.heapreplace(self._heap, item)[2]
+            else:
+                return None
+            self.captured += 1
+
+        if self.dump_dir:
+            self._dump(entry)
+            if evicted is not None:
+                self._remove_dump(evicted)
+        return profile_id
+
+    def _dump_path(self, entry: Dict[str, Any]) -> str:
+        return os.path.join(
+            self.dump_dir, f"{entry['profile_id']}-{entry['elapsed_ms']:.0f}ms.prof"
+        )
+
+    def _dump(self, entry: Dict[str, Any]) -> None:
+        os.makedirs(self.dump_dir, exist_ok=True)
+        # cProfile.Profile.dump_stats と同じ形式（pstats / snakeviz でそのまま開ける）
+        with open(self._dump_path(entry), "wb") as fp:
+            marshal.dump(entry["_stats"], fp)
+
+    def _remove_dump(self, entry: Dict[str, Any]) -> None:
+        try:
+            os.remove(self._dump_path(entry))
+        except OSError:
+            pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        """保持中のプロファイルの概要（遅い順）。"""
+        with self._lock:
+            entries = [entry for _, _, entry in sorted(self._heap, reverse=True)]
+        return [{k: v for k, v in entry.items() if k != "_stats"} for entry in entries]
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for _, _, entry in self._heap:
+                if entry["profile_id"] == profile_id:
+                    return entry
+        return None
+
+    def report(self, entry: Dict[str, Any], sort: str = "cumulative") -> str:
+        """pstats のテキストレポート（上位 REPORT_LIMIT 関数）。"""
+        stream = io.StringIO()
+        stats = pstats.Stats(_StatsSource(entry["_stats"]), stream=stream)
+        stats.sort_stats(sort).print_stats(REPORT_LIMIT)
+        return stream.getvalue()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "profiles_kept": len(self._heap),
+                "profiles_captured": self.captured,
+                "profiles_skipped_busy": self.skipped_busy,
+                "profiles_skipped_tool_active": self.skipped_tool_active,
+            }
+
+
+class _StatsSource:
+    """pstats.Stats に統計 dict を渡すための最小限のオブジェクト（create_stats 済みの Profile 相当）。"""
+
+    def __init__(self, stats: Dict[Any, Any]) -> None:
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+# プロセス共通のストア（ワーカープロセスごとに 1 つ）
+profile_store = ProfileStore()
@@ -1,12 +1,37 @@
 # backend/fastapi_app/router.py
 from __future__ import annotations
 
+import functools
+import marshal
+import time
+from datetime import datetime, timezone
 from typing import Any, Dict, Optional
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 
-from core.token_counter import count_tokens, UtcError
-from .schemas import TokenCountRequest, TokenCountSuccessResponse
+from backend.analytics import analytics_sink
+from core.incremental import IncrementalDocument, session_store
+
+from core.token_counter import (
+    count_tokens,
+    token_count_flight,
+    utf8_length,
+    UtcError,
+    UtcErrorCode,
+)
+from .degradation import STAGE_SUCCESS_LOGGING, degradation_controller
+from .handlers import build_error_response, endpoint_template
+from .profiling import is_admin, profile_store, should_profile
+from .schemas import (
+    SessionCreateRequest,
+    SessionEditRequest,
+    SessionResponse,
+    StatsResponse,
+    TokenCountRequest,
+    TokenCountSuccessResponse,
+)
 
 from backend.observability import (
     log_token_count_success,
@@ -19,14 +44,53 @@ from backend.observability import (
 router = APIRouter()
 
 
-@router.post("/token-count", response_model=TokenCountSuccessResponse)
+@router.post(
+    "/token-count",
+    response_model=TokenCountSuccessResponse,
+    response_model_exclude_none=True,
+)
 async def token_count(
     req: TokenCountRequest,
     request: Request,
+    response: Response,
+    accuracy: str = Query("exact", pattern="^(exact|estimate)$"),
 ) -> TokenCountSuccessResponse:
+    started_at = time.perf_counter()
+    # UtcError のアクセスログ（handlers.py）でモデル別に集計できるようにする
+    request.state.utc_model = req.model
+    # 負荷に応じて timing middleware が決めた、省略する任意処理
+    skip_stages = getattr(request.state, "skip_stages", frozenset())
     try:
         # コアロジック呼び出し（成功時は UTC v0.1 形式の dict が返る）
-        result = count_tokens(req.model, req.text)
+        # スレッドプールで実行し、同一入力の同時リクエストを single-flight で合流させる
+        call = functools.partial(
+            count_tokens,
+            req.model,
+            req.text,
+            spans=req.spans,
+            return_offsets=req.return_offsets,
+            accuracy=accuracy,
+            skip_stages=skip_stages,
+        )
+        if should_profile(request.headers):
+            # ワーカースレッド側で計測する（同時計測の扱いは ProfileStore を参照）
+            result, profile_stats = await run_in_threadpool(profile_store.run, call)
+            if profile_stats is not None:
+                profile_id = await run_in_threadpool(
+                    profile_store.offer,
+                    (time.perf_counter() - started_at) * 1000.0,
+                    profile_stats,
+                    {"endpoint": endpoint_template(request.scope), "model": req.model, "accuracy": accuracy},
+                )
+                if profile_id is not None:
+                    response.headers["X-UTC-Profile-Id"] = profile_id
+        else:
+            result = await run_in_threadpool(call)
+
+        skip_logging = STAGE_SUCCESS_LOGGING in skip_stages
+        if skip_logging:
+            meta = result["meta"]
+            meta["skipped_stages"] = [STAGE_SUCCESS_LOGGING, *meta.get("skipped_stages", [])]
 
         # result は以下のような dict を想定：
         # {
@@ -53,19 +117,22 @@ async def token_count(
             )
 
             # 従来のイベントログ（そのまま維持）
-            log_token_count_success(
-                model=result_block.get("model", req.model),
-                char_count=result_block.get("char_count", len(req.text)),
-                token_count=result_block.get("token_count", 0),
-                meta=meta_block,
-            )
-
-            # 新: UTC 構造化アクセスログ
+            if not skip_logging:
+                log_token_count_success(
+                    model=result_block.get("model", req.model),
+                    char_count=result_block.get("char_count", len(req.text)),
+                    token_count=_logged_token_count(result_block),
+                    meta=meta_block,
+                )
+
+            # 新: UTC 構造化アクセスログ（高負荷時もエラー率が偏らないよう分析ストアには記録する）
             _emit_utc_structured_log_success(
                 request=request,
                 req=req,
                 result_block=result_block,
                 meta_block=meta_block,
+                processing_time_ms=(time.perf_counter() - started_at) * 1000.0,
+                emit=not skip_logging,
             )
 
         except Exception as log_exc:
@@ -75,8 +142,7 @@ async def token_count(
         return result  # FastAPI が response_model に合わせてシリアライズ
 
     except UtcError as e:
-        # UtcError は専用ハンドラ（handlers.py）に任せる
-        # 将来的に構造化ログを追加する場合は、ハンドラ側で log_utc_access を呼ぶ実装に拡張
+        # UtcError は専用ハンドラ（handlers.py）に任せる（構造化ログもハンドラ側で出力する）
         raise e
 
     except Exception as exc:
@@ -88,6 +154,7 @@ async def token_count(
                 request=request,
                 req=req,
                 error=exc,
+                processing_time_ms=(time.perf_counter() - started_at) * 1000.0,
             )
         except Exception as log_exc:
             log_logging_failure(log_exc)
@@ -95,6 +162,130 @@ async def token_count(
         raise HTTPException(status_code=500, detail="Unhandled internal error.")
 
 
+# === 差分カウント（セッション） ===============================================
+
+def _session_response(
+    session_id: str,
+    document: IncrementalDocument,
+    *,
+    reencoded_chars: int,
+    started_at: float,
+) -> Dict[str, Any]:
+    return {
+        "session": {
+            "session_id": session_id,
+            "revision": document.revision,
+            "segment_count": document.segment_count,
+        },
+        "result": document.result(),
+        "meta": {
+            "reencoded_chars": reencoded_chars,
+            "processing_time_ms": (time.perf_counter() - started_at) * 1000.0,
+            "utc_timestamp": datetime.now(timezone.utc).isoformat(),
+            "version": "0.1.0",
+        },
+    }
+
+
+@router.post("/token-count/sessions", response_model=SessionResponse, status_code=201)
+async def create_token_count_session(req: SessionCreateRequest, request: Request) -> Dict[str, Any]:
+    """ドキュメント全文を登録し、以降は差分だけでトークン数を更新できるセッションを作る。"""
+    started_at = time.perf_counter()
+    request.state.utc_model = req.model
+    session_id, document = await run_in_threadpool(session_store.create, req.model, req.text)
+    _emit_session_log_success(
+        request, 201, started_at, document=document, reencoded_chars=document.char_count
+    )
+    return _session_response(
+        session_id, document, reencoded_chars=document.char_count, started_at=started_at
+    )
+
+
+@router.post("/token-count/sessions/{session_id}/edits", response_model=SessionResponse)
+async def edit_token_count_session(
+    session_id: str, req: SessionEditRequest, request: Request
+) -> Dict[str, Any]:
+    """(offset, delete, insert) の編集を順に適用し、更新後の厳密なトークン数を返す。"""
+    started_at = time.perf_counter()
+    edits = [(edit.offset, edit.delete, edit.insert) for edit in req.edits]
+    document, reencoded = await run_in_threadpool(session_store.edit, session_id, edits)
+    _emit_session_log_success(request, 200, started_at, document=document, reencoded_chars=reencoded)
+    return _session_response(
+        session_id, document, reencoded_chars=reencoded, started_at=started_at
+    )
+
+
+@router.delete("/token-count/sessions/{session_id}", status_code=204)
+async def delete_token_count_session(session_id: str, request: Request) -> Response:
+    started_at = time.perf_counter()
+    if not session_store.delete(session_id):
+        raise UtcError(UtcErrorCode.SESSION_NOT_FOUND, f"Unknown session: {session_id}")
+    _emit_session_log_success(request, 204, started_at)
+    return Response(status_code=204)
+
+
+# === 分析ストア ===============================================================
+
+@router.get("/stats", response_model=StatsResponse, response_model_exclude_none=True)
+async def get_stats(
+    bucket: str = Query("minute", pattern="^(minute|hour)$"),
+    window_s: int = Query(3600, ge=60, le=90 * 24 * 3600),
+    model: Optional[str] = None,
+    endpoint: Optional[str] = None,
+):
+    """分単位・時間単位のロールアップ（モデル別の tokens/sec・入力サイズ分布・エラー率）。"""
+    if not analytics_sink.enabled:
+        return build_error_response("ANALYTICS_DISABLED")
+    since = int(time.time()) - window_s
+    buckets = await run_in_threadpool(
+        functools.partial(
+            analytics_sink.query, bucket=bucket, since=since, model=model, endpoint=endpoint
+        )
+    )
+    return {
+        "buckets": buckets,
+        "meta": {
+            "bucket": bucket,
+            "since": since,
+            "utc_timestamp": datetime.now(timezone.utc).isoformat(),
+            "version": "0.1.0",
+        },
+    }
+
+
+# === プロファイル（管理用） =====================================================
+
+@router.get("/admin/profiles")
+async def list_profiles(request: Request):
+    """保持中の遅いリクエストのプロファイル一覧（遅い順）。"""
+    if not is_admin(request.headers):
+        return build_error_response("UNAUTHORIZED")
+    return {"profiles": profile_store.list(), "stats": profile_store.stats()}
+
+
+@router.get("/admin/profiles/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    request: Request,
+    sort: str = Query("cumulative", pattern="^(cumulative|tottime|calls)$"),
+    format: str = Query("text", pattern="^(text|pstats)$"),
+):
+    """pstats のテキストレポート、または format=pstats で .prof ファイルそのもの。"""
+    if not is_admin(request.headers):
+        return build_error_response("UNAUTHORIZED")
+    entry = profile_store.get(profile_id)
+    if entry is None:
+        return build_error_response("PROFILE_NOT_FOUND")
+    if format == "pstats":
+        return Response(
+            marshal.dumps(entry["_stats"]),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.prof"'},
+        )
+    report = await run_in_threadpool(profile_store.report, entry, sort)
+    return PlainTextResponse(report)
+
+
 def _extract_lambda_context(request: Request) -> Dict[str, Any]:
     """
     middleware で仕込んだ request.state.lambda_context から
@@ -117,8 +308,28 @@ def _extract_lambda_context(request: Request) -> Dict[str, Any]:
     }
 
 
-def _get_processing_time_ms(request: Request) -> Optional[float]:
-    return getattr(request.state, "processing_time_ms", None)
+def _access_log_extra(request: Request) -> Dict[str, Any]:
+    """
+    構造化アクセスログの extra。
+    - admission middleware が割り当てたレーンの占有状況
+    - single-flight による合流数などのカウンタ
+    - 縮退レベル
+    """
+    extra: Dict[str, Any] = {}
+    ticket = getattr(request.state, "admission", None)
+    if ticket is not None:
+        extra.update(ticket.log_fields())
+    extra.update(token_count_flight.stats())
+    extra["degradation_level"] = degradation_controller.level
+    return extra
+
+
+def _logged_token_count(result_block: Dict[str, Any]) -> int:
+    """ログに残すトークン数。推定モードでは token_count が無いため推定値を使う。"""
+    token_count = result_block.get("token_count")
+    if token_count is None:
+        token_count = result_block.get("token_count_estimate", 0)
+    return token_count
 
 
 def _emit_utc_structured_log_success(
@@ -127,19 +338,19 @@ def _emit_utc_structured_log_success(
     req: TokenCountRequest,
     result_block: Dict[str, Any],
     meta_block: Dict[str, Any],
+    processing_time_ms: float,
+    emit: bool = True,
 ) -> None:
     """
-    正常終了時の UTC 構造化アクセスログ出力。
+    正常終了時の UTC 構造化アクセスログ出力（emit=False は分析ストアへの記録のみ）。
+    processing_time_ms はルートで測った値（縮退時は meta に processing_time_ms が無いため、meta の値は使わない）。
     """
-    endpoint = str(request.url.path)
+    endpoint = endpoint_template(request.scope)
     ctx = _extract_lambda_context(request)
-    processing_time_ms = meta_block.get("processing_time_ms") or _get_processing_time_ms(
-        request
-    )
 
     model: Optional[str] = result_block.get("model", req.model)
     char_count: Optional[int] = result_block.get("char_count")
-    token_count: Optional[int] = result_block.get("token_count")
+    token_count: Optional[int] = _logged_token_count(result_block)
     token_per_char: Optional[float] = result_block.get("token_per_char")
 
     token_density: Optional[float] = meta_block.get("token_density") or token_per_char
@@ -163,28 +374,69 @@ def _emit_utc_structured_log_success(
         processing_time_ms=processing_time_ms,
         error_code=None,
         error_message=None,
-        extra=None,
+        extra={**_access_log_extra(request), "accuracy": meta_block.get("accuracy", "exact")},
+        emit=emit,
     )
 
 
+def _emit_session_log_success(
+    request: Request,
+    http_status: int,
+    started_at: float,
+    *,
+    document: Optional[IncrementalDocument] = None,
+    reencoded_chars: Optional[int] = None,
+) -> None:
+    """
+    セッション API の正常終了時の UTC 構造化アクセスログ（エラー率の分母になる）。
+    トークン数・文字数は更新後のドキュメント全体の値。
+    """
+    skip_stages = getattr(request.state, "skip_stages", frozenset())
+    ctx = _extract_lambda_context(request)
+    extra = _access_log_extra(request)
+    if reencoded_chars is not None:
+        extra["reencoded_chars"] = reencoded_chars
+    try:
+        log_utc_access(
+            request_id=ctx["request_id"],
+            source=ctx["source"],
+            endpoint=endpoint_template(request.scope),
+            status="ok",
+            http_status=http_status,
+            lambda_duration_ms=ctx["lambda_duration_ms"],
+            cold_start=ctx["cold_start"],
+            model=document.model if document is not None else None,
+            char_count=document.char_count if document is not None else None,
+            input_size_bytes=None,
+            token_count=document.token_count if document is not None else None,
+            token_density=None,
+            input_language=None,
+            processing_time_ms=(time.perf_counter() - started_at) * 1000.0,
+            extra=extra,
+            emit=STAGE_SUCCESS_LOGGING not in skip_stages,
+        )
+    except Exception as log_exc:
+        log_logging_failure(log_exc)
+
+
 def _emit_utc_structured_log_error(
     *,
     request: Request,
     req: TokenCountRequest,
     error: Exception,
+    processing_time_ms: float,
 ) -> None:
     """
     想定外エラー時の UTC 構造化アクセスログ出力。
     UtcError は専用ハンドラで処理する前提のため、ここでは扱わない。
     """
-    endpoint = str(request.url.path)
+    endpoint = endpoint_template(request.scope)
     ctx = _extract_lambda_context(request)
-    processing_time_ms = _get_processing_time_ms(request)
 
     # 可能な範囲で入力規模だけは入れておく
     input_size_bytes: Optional[int] = None
     try:
-        input_size_bytes = len(req.text.encode("utf-8"))
+        input_size_bytes = utf8_length(req.text)
     except Exception:
         input_size_bytes = None
 
@@ -205,6 +457,6 @@ def _emit_utc_structured_log_error(
         processing_time_ms=processing_time_ms,
         error_code="INTERNAL_ERROR",
         error_message=str(error),
-        extra=None,
+        extra=_access_log_extra(request),
     )
 
@@ -1,26 +1,97 @@
+from typing import Dict, List, Optional, Tuple
+
 from pydantic import BaseModel
 
 class TokenCountRequest(BaseModel):
     model: str
     text: str
+    spans: Optional[List[Tuple[int, int]]] = None
+    return_offsets: bool = False
 
 class TokenCountResult(BaseModel):
     model: str
     encoding: str
     char_count: int
-    token_count: int
+    token_count: Optional[int] = None
+    token_count_estimate: Optional[int] = None
     token_per_char: float
+    span_token_counts: Optional[List[int]] = None
+    token_offsets_delta: Optional[List[int]] = None
+
+class ConfidenceInterval(BaseModel):
+    low: int
+    high: int
+    level: float
 
 class TokenCountMeta(BaseModel):
-    input_language: str
+    # 高負荷時は省略されることがある（skipped_stages を参照）
+    input_language: Optional[str] = None
     input_size_bytes: int
-    token_density: float
+    token_density: Optional[float] = None
     model_family: str
-    processing_time_ms: float
-    utc_timestamp: str
+    processing_time_ms: Optional[float] = None
+    utc_timestamp: Optional[str] = None
     version: str
+    skipped_stages: Optional[List[str]] = None
+    accuracy: Optional[str] = None
+    confidence_interval: Optional[ConfidenceInterval] = None
+    sampled_chars: Optional[int] = None
 
 class TokenCountSuccessResponse(BaseModel):
     result: TokenCountResult
     meta: TokenCountMeta
 
+
+class TextEdit(BaseModel):
+    offset: int
+    delete: int = 0
+    insert: str = ""
+
+class SessionCreateRequest(BaseModel):
+    model: str
+    text: str
+
+class SessionEditRequest(BaseModel):
+    edits: List[TextEdit]
+
+class SessionInfo(BaseModel):
+    session_id: str
+    revision: int
+    segment_count: int
+
+class SessionMeta(BaseModel):
+    reencoded_chars: int
+    processing_time_ms: float
+    utc_timestamp: str
+    version: str
+
+class SessionResponse(BaseModel):
+    session: SessionInfo
+    result: TokenCountResult
+    meta: SessionMeta
+
+
+class StatsBucket(BaseModel):
+    bucket_start: int
+    model: Optional[str] = None
+    endpoint: Optional[str] = None
+    requests: int
+    errors: int
+    error_rate: float
+    tokens: int
+    chars: int
+    input_bytes: int
+    tokens_per_sec: Optional[float] = None
+    avg_processing_ms: Optional[float] = None
+    max_processing_ms: float
+    size_distribution: Dict[str, int]
+
+class StatsMeta(BaseModel):
+    bucket: str
+    since: int
+    utc_timestamp: str
+    version: str
+
+class StatsResponse(BaseModel):
+    buckets: List[StatsBucket]
+    meta: StatsMeta
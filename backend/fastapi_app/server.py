@@ -0,0 +1,239 @@
+# backend/fastapi_app/server.py
+"""
+本番用のマルチワーカー起動スクリプト（Lambda 以外の常駐デプロイ向け）。
+
+    python -m backend.fastapi_app.server --workers 4
+    python -m backend.fastapi_app.main            # 同じ（環境変数の設定値で起動）
+
+- 親プロセスでアプリと encoding を読み込み、gc.freeze() してから fork する。
+  BPE ランク表などの大きなオブジェクトはコピーオンライトでワーカー間に共有される
+- 親が listen したソケットを全ワーカーが引き継いで accept する
+- 各ワーカーは max_requests（+ ジッタ）件を処理すると終了し、親が新しいワーカーを起動する
+  （断片化などで増えたメモリを定期的に手放す）
+- SIGTERM / SIGINT でワーカーに SIGTERM を送り、処理中のリクエストを終えてから終了する
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+
+from backend.observability import logger
+
+# === 設定値（環境変数で上書き可能、CLI 引数が優先） ===========================
+
+HOST = os.getenv("UTC_HOST", "127.0.0.1")
+PORT = int(os.getenv("UTC_PORT", "8000"))
+# セッション（core.incremental.session_store）とプロファイル（profiling.profile_store）は
+# ワーカープロセスごとに持つため、複数ワーカーでは別のワーカーに届いたリクエストから見えない。
+# 共有ストアを用意するまでは 1 を既定にし、増やす場合はセッション API を使わない前提で設定する
+WORKERS = int(os.getenv("UTC_WORKERS", "1"))
+
+# ロードバランサのアイドルタイムアウト（ALB は 60 秒）より長くして、LB 側から切らせる
+KEEP_ALIVE_S = int(os.getenv("UTC_KEEP_ALIVE_S", "75"))
+
+# ワーカーを入れ替えるまでのリクエスト数（0 で無効）と、入れ替えが揃わないようにするジッタ
+MAX_REQUESTS = int(os.getenv("UTC_MAX_REQUESTS", "10000"))
+MAX_REQUESTS_JITTER = int(os.getenv("UTC_MAX_REQUESTS_JITTER", "1000"))
+
+BACKLOG = int(os.getenv("UTC_BACKLOG", "2048"))
+
+# 起動直後に異常終了したワーカーを再起動するまでの待ち時間（再起動ループの抑制）
+_CRASH_WINDOW_S = 1.0
+_CRASH_BACKOFF_S = 1.0
+
+
+def preload() -> List[str]:
+    """
+    SUPPORTED_MODELS の encoding とバックエンド、langdetect の言語プロファイルを読み込む。
+    読み込めたモデル名を返す。
+    """
+    from langdetect.detector_factory import init_factory
+
+    from core.token_counter import SUPPORTED_MODELS, tokenizer_registry
+
+    # 言語プロファイルは初回の判定で読み込まれ、1 秒近くかかる（各ワーカーの最初のリクエストが遅くなる）
+    try:
+        init_factory()
+    except Exception as exc:
+        logger.warning("preload failed for langdetect profiles: %s: %s", type(exc).__name__, exc)
+
+    loaded = []
+    for model in SUPPORTED_MODELS:
+        try:
+            tokenizer_registry.get(model).encoding
+        except Exception as exc:
+            # 読み込めない encoding はワーカーが初回リクエスト時に読み込む
+            logger.warning("preload failed for %s: %s: %s", model, type(exc).__name__, exc)
+            continue
+        loaded.append(model)
+    return loaded
+
+
+def _bind(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class PreforkServer:
+    """親プロセスがワーカーを fork し、終了したワーカーを補充する。"""
+
+    def __init__(
+        self,
+        app: Any,
+        *,
+        host: str = HOST,
+        port: int = PORT,
+        workers: int = WORKERS,
+        keep_alive_s: int = KEEP_ALIVE_S,
+        max_requests: int = MAX_REQUESTS,
+        max_requests_jitter: int = MAX_REQUESTS_JITTER,
+        backlog: int = BACKLOG,
+    ) -> None:
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.keep_alive_s = keep_alive_s
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.backlog = backlog
+        self._children: Dict[int, float] = {}
+        self._stopping = False
+        self._sock: Optional[socket.socket] = None
+
+    def _worker_config(self) -> uvicorn.Config:
+        limit = None
+        if self.max_requests > 0:
+            limit = self.max_requests + random.randint(0, max(0, self.max_requests_jitter))
+        return uvicorn.Config(
+            self.app,
+            timeout_keep_alive=self.keep_alive_s,
+            limit_max_requests=limit,
+            backlog=self.backlog,
+            access_log=False,  # アクセスログは observability の構造化ログに一本化する
+            lifespan="auto",
+        )
+
+    def _spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                random.seed()  # 親と同じ乱数列でジッタが揃わないようにする
+                uvicorn.Server(self._worker_config()).run(sockets=[self._sock])
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        self._children[pid] = time.monotonic()
+        if self._stopping:
+            # wait() から spawn までの間に SIGTERM が来ると、_stop はこの子を知らずに終わっている
+            os.kill(pid, signal.SIGTERM)
+
+    def _stop(self, signum: int, _frame: Any) -> None:
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> int:
+        self._sock = _bind(self.host, self.port, self.backlog)
+        logger.info(
+            "prefork server on %s:%d (workers=%d, keep_alive=%ds, max_requests=%d±%d)",
+            self.host,
+            self.port,
+            self.workers,
+            self.keep_alive_s,
+            self.max_requests,
+            self.max_requests_jitter,
+        )
+
+        # 親で確保したオブジェクトを GC の対象外にし、fork 後に参照カウント以外で
+        # ページが書き換わらないようにする
+        gc.collect()
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for _ in range(self.workers):
+            self._spawn()
+
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            started = self._children.pop(pid, None)
+            if self._stopping or started is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if code != 0 and time.monotonic() - started < _CRASH_WINDOW_S:
+                logger.error("worker %d exited with %d right after start; backing off", pid, code)
+                time.sleep(_CRASH_BACKOFF_S)
+                if self._stopping:
+                    continue
+            self._spawn()
+
+        self._sock.close()
+        return 0
+
+
+def main(argv: Optional[List[str]] = None, app: Any = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the UTC API with prefork workers.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--keep-alive", type=int, default=KEEP_ALIVE_S, help="seconds")
+    parser.add_argument("--max-requests", type=int, default=MAX_REQUESTS, help="0 disables recycling")
+    parser.add_argument("--max-requests-jitter", type=int, default=MAX_REQUESTS_JITTER)
+    parser.add_argument("--backlog", type=int, default=BACKLOG)
+    parser.add_argument("--no-preload", action="store_true", help="load encodings lazily in workers")
+    args = parser.parse_args(argv)
+
+    if app is None:
+        from .main import app
+
+    if not args.no_preload:
+        loaded = preload()
+        logger.info("preloaded encodings for %d models", len(loaded))
+
+    if not hasattr(os, "fork"):
+        # fork の無い環境では単一プロセスで起動する
+        uvicorn.run(app, host=args.host, port=args.port, timeout_keep_alive=args.keep_alive)
+        return 0
+
+    return PreforkServer(
+        app,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        keep_alive_s=args.keep_alive,
+        max_requests=args.max_requests,
+        max_requests_jitter=args.max_requests_jitter,
+        backlog=args.backlog,
+    ).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
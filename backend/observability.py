@@ -6,6 +6,8 @@ import logging
 import os
 from typing import Any, Dict, Optional
 
+from .analytics import analytics_sink
+
 # === ロガー初期化 ============================================================
 
 LOG_LEVEL = os.getenv("UTC_LOG_LEVEL", "INFO").upper()
@@ -179,9 +181,11 @@ def log_utc_access(
     error_code: Optional[str] = None,
     error_message: Optional[str] = None,
     extra: Optional[Dict[str, Any]] = None,
+    emit: bool = True,
 ) -> None:
     """
     UTC v0.1 アクセスログ 1 レコードを出力する。
+    emit=False（高負荷時）はログ出力だけ省き、分析ストアには記録する。
     """
     record = build_utc_log_record(
         request_id=request_id,
@@ -203,6 +207,13 @@ def log_utc_access(
         extra=extra,
     )
 
-    level = "INFO" if status == "ok" else "ERROR"
-    _log_json(level, record)
+    if emit:
+        level = "INFO" if status == "ok" else "ERROR"
+        _log_json(level, record)
+
+    # 分析ストア（有効時のみ）。キューに積むだけで書き込みは別スレッド
+    try:
+        analytics_sink.submit(record)
+    except Exception as exc:
+        log_logging_failure(exc)
 
@@ -7,7 +7,19 @@ from .token_counter import (
     UtcError,
     UtcErrorCode,
     count_tokens,
+    utf8_length,
+    validate_text_size,
+    token_count_flight,
+    tokenizer_registry,
 )
+from .backends import (
+    TokenizerBackend,
+    TokenizerRegistry,
+    TokenizerSpec,
+    TokenizerUnavailable,
+)
+from .offsets import delta_decode, delta_encode, span_token_counts
+from .singleflight import SingleFlight
 
 __all__ = [
     "SUPPORTED_MODELS",
@@ -16,5 +28,17 @@ __all__ = [
     "UtcError",
     "UtcErrorCode",
     "count_tokens",
+    "utf8_length",
+    "validate_text_size",
+    "token_count_flight",
+    "tokenizer_registry",
+    "delta_decode",
+    "delta_encode",
+    "span_token_counts",
+    "SingleFlight",
+    "TokenizerBackend",
+    "TokenizerRegistry",
+    "TokenizerSpec",
+    "TokenizerUnavailable",
 ]
 
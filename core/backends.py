@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import tiktoken
+
+from . import encoding_bundle
+from .singleflight import SingleFlight
+
+
+class TokenizerUnavailable(Exception):
+    """トークナイザの読み込みに失敗した（ファイルが無い・任意依存が未インストール等）。"""
+
+
+# UTF-8 の継続バイト（0x80-0xBF）。文字数を数えるときに取り除く
+_UTF8_CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+
+
+# === バックエンド =============================================================
+
+class TokenizerBackend:
+    """
+    トークナイザバックエンドの共通インターフェース。
+    - encode / encode_batch: トークン ID 列を返す
+    - count / count_batch: トークン数のみを返す（ID 列を保持しない用途向け）
+    """
+
+    kind = "base"
+
+    def __init__(self, encoding_name: str, family: str) -> None:
+        self.encoding_name = encoding_name
+        self.family = family
+
+    def encode(self, text: str) -> List[int]:
+        raise NotImplementedError
+
+    def encode_batch(self, texts: Sequence[str]) -> List[List[int]]:
+        return [self.encode(text) for text in texts]
+
+    def count(self, text: str) -> int:
+        return len(self.encode(text))
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        return [len(tokens) for tokens in self.encode_batch(texts)]
+
+    def encode_with_offsets(self, text: str) -> Tuple[List[int], "array[int]"]:
+        """
+        1 回の encode でトークン ID 列と、各トークンの開始文字位置（int32 配列）を返す。
+        オフセットを得られないバックエンドは NotImplementedError。
+        """
+        raise NotImplementedError(f"{self.kind} backend does not support token offsets")
+
+    def memory_bytes(self) -> int:
+        """LRU のメモリ予算計算に使う概算サイズ。0 は予算の対象外（常駐）を意味する。"""
+        return 0
+
+
+class TiktokenBackend(TokenizerBackend):
+    """
+    OpenAI 系（tiktoken）のバックエンド。
+    Encoding 本体はオフラインバンドル（無ければ tiktoken のレジストリ）が
+    プロセス内でキャッシュするため、ここでは保持しない。
+    """
+
+    kind = "tiktoken"
+
+    def __init__(self, encoding_name: str, family: str = "openai") -> None:
+        super().__init__(encoding_name, family)
+
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        return encoding_bundle.get_encoding(self.encoding_name)
+
+    def encode(self, text: str) -> List[int]:
+        return self.encoding.encode(text)
+
+    def encode_batch(self, texts: Sequence[str]) -> List[List[int]]:
+        return self.encoding.encode_batch(list(texts))
+
+    def encode_with_offsets(self, text: str) -> Tuple[List[int], "array[int]"]:
+        # tiktoken の decode_with_offsets と同じ規則（文字の途中から始まるトークンは
+        # その文字の位置）だが、テキストの再デコードはせず int32 配列に直接積む
+        encoding = self.encoding
+        tokens = encoding.encode(text)
+        offsets = array("i")
+        text_len = 0
+        for token_bytes in encoding.decode_tokens_bytes(tokens):
+            offsets.append(max(0, text_len - (0x80 <= token_bytes[0] < 0xC0)))
+            text_len += len(token_bytes.translate(None, _UTF8_CONTINUATION_BYTES))
+        return tokens, offsets
+
+
+class HuggingFaceBackend(TokenizerBackend):
+    """HuggingFace `tokenizer.json` をローカルファイルから読み込むバックエンド（要 `tokenizers`）。"""
+
+    kind = "huggingface"
+
+    def __init__(self, encoding_name: str, family: str, path: str) -> None:
+        super().__init__(encoding_name, family)
+        try:
+            from tokenizers import Tokenizer
+        except ImportError as exc:
+            raise TokenizerUnavailable("the 'tokenizers' package is not installed") from exc
+        try:
+            self._tokenizer = Tokenizer.from_file(path)
+        except Exception as exc:
+            raise TokenizerUnavailable(f"failed to load tokenizer file: {path}") from exc
+        self._size = _file_size(path)
+
+    def encode(self, text: str) -> List[int]:
+        return self._tokenizer.encode(text, add_special_tokens=False).ids
+
+    def encode_batch(self, texts: Sequence[str]) -> List[List[int]]:
+        encodings = self._tokenizer.encode_batch(list(texts), add_special_tokens=False)
+        return [enc.ids for enc in encodings]
+
+    def encode_with_offsets(self, text: str) -> Tuple[List[int], "array[int]"]:
+        encoded = self._tokenizer.encode(text, add_special_tokens=False)
+        return encoded.ids, array("i", (start for start, _ in encoded.offsets))
+
+    def memory_bytes(self) -> int:
+        # JSON をパースしたあとの語彙・マージ表はファイルサイズの数倍になる
+        return self._size * 3
+
+
+class SentencePieceBackend(TokenizerBackend):
+    """SentencePiece の `.model` をローカルファイルから読み込むバックエンド（要 `sentencepiece`）。"""
+
+    kind = "sentencepiece"
+
+    def __init__(self, encoding_name: str, family: str, path: str) -> None:
+        super().__init__(encoding_name, family)
+        try:
+            import sentencepiece
+        except ImportError as exc:
+            raise TokenizerUnavailable("the 'sentencepiece' package is not installed") from exc
+        try:
+            self._processor = sentencepiece.SentencePieceProcessor(model_file=path)
+        except Exception as exc:
+            raise TokenizerUnavailable(f"failed to load sentencepiece model: {path}") from exc
+        self._size = _file_size(path)
+
+    def encode(self, text: str) -> List[int]:
+        return self._processor.encode(text)
+
+    def encode_batch(self, texts: Sequence[str]) -> List[List[int]]:
+        return self._processor.encode(list(texts))
+
+    def memory_bytes(self) -> int:
+        return self._size * 2
+
+
+BACKEND_CLASSES: Dict[str, type] = {
+    TiktokenBackend.kind: TiktokenBackend,
+    HuggingFaceBackend.kind: HuggingFaceBackend,
+    SentencePieceBackend.kind: SentencePieceBackend,
+}
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+# === レジストリ ===============================================================
+
+class TokenizerSpec:
+    """モデル名 → バックエンドの対応 1 件分。"""
+
+    def __init__(
+        self,
+        model: str,
+        backend: str,
+        encoding: str,
+        family: str,
+        path: Optional[str] = None,
+    ) -> None:
+        if backend not in BACKEND_CLASSES:
+            raise ValueError(f"Unknown tokenizer backend: {backend}")
+        if backend != TiktokenBackend.kind and not path:
+            raise ValueError(f"Tokenizer backend '{backend}' requires a path")
+        self.model = model
+        self.backend = backend
+        self.encoding = encoding
+        self.family = family
+        self.path = path
+
+    @property
+    def key(self) -> str:
+        """トークナイザ実体の識別子。同じファイルを複数モデル名で共有する場合は同じ値になる。"""
+        return f"{self.backend}:{self.path or self.encoding}"
+
+    def load(self) -> TokenizerBackend:
+        if self.backend == TiktokenBackend.kind:
+            return TiktokenBackend(self.encoding, self.family)
+        return BACKEND_CLASSES[self.backend](self.encoding, self.family, self.path)
+
+
+class TokenizerRegistry:
+    """
+    モデル名からトークナイザバックエンドを引くレジストリ。
+
+    - バックエンドは初回利用時に読み込む（遅延ロード）
+    - 同じトークナイザの同時ロードは single-flight で 1 回にまとめる
+    - memory_bytes() の合計がメモリ予算を超えたら、最近使われていないものから解放する
+    """
+
+    def __init__(self, memory_budget_bytes: int) -> None:
+        self.memory_budget_bytes = memory_budget_bytes
+        self._specs: Dict[str, TokenizerSpec] = {}
+        self._loaded: "OrderedDict[str, TokenizerBackend]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loads = SingleFlight()
+        self.evictions = 0
+
+    def register(self, spec: TokenizerSpec) -> None:
+        with self._lock:
+            self._specs[spec.model] = spec
+            self._loaded.pop(spec.key, None)
+
+    def get_spec(self, model: str) -> Optional[TokenizerSpec]:
+        return self._specs.get(model)
+
+    def models(self) -> List[str]:
+        return list(self._specs)
+
+    def get(self, model: str) -> Optional[TokenizerBackend]:
+        """モデルのバックエンドを返す（未登録なら None）。読み込み失敗は TokenizerUnavailable。"""
+        spec = self._specs.get(model)
+        if spec is None:
+            return None
+
+        key = spec.key
+        with self._lock:
+            backend = self._loaded.get(key)
+            if backend is not None:
+                self._loaded.move_to_end(key)
+                return backend
+
+        backend, _ = self._loads.do(key, spec.load)
+
+        with self._lock:
+            self._loaded[key] = backend
+            self._loaded.move_to_end(key)
+            self._evict(keep=key)
+        return backend
+
+    def loaded_memory_bytes(self) -> int:
+        return sum(backend.memory_bytes() for backend in self._loaded.values())
+
+    def _evict(self, *, keep: str) -> None:
+        """メモリ予算を超えている間、LRU 順に解放する（直近に読み込んだものと常駐分は残す）。"""
+        total = self.loaded_memory_bytes()
+        for key in list(self._loaded):
+            if total <= self.memory_budget_bytes:
+                break
+            backend = self._loaded[key]
+            size = backend.memory_bytes()
+            if key == keep or size == 0:
+                continue
+            del self._loaded[key]
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "registered_models": len(self._specs),
+                "loaded_tokenizers": len(self._loaded),
+                "loaded_memory_bytes": self.loaded_memory_bytes(),
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "evictions": self.evictions,
+            }
+
+
+def load_registry_config(registry: TokenizerRegistry, path: str) -> None:
+    """
+    ローカルトークナイザの設定 JSON を読み込んで登録する。
+
+        {
+          "models": {
+            "llama-3-8b": {"backend": "huggingface", "path": "llama3/tokenizer.json", "family": "meta"},
+            "gemma-2b":   {"backend": "sentencepiece", "path": "gemma/tokenizer.model", "family": "google"}
+          }
+        }
+
+    相対パスは設定ファイルのディレクトリを基準に解決する。
+    """
+    with open(path, "r", encoding="utf-8") as fp:
+        config = json.load(fp)
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for model, entry in (config.get("models") or {}).items():
+        backend = entry.get("backend", TiktokenBackend.kind)
+        file_path = entry.get("path")
+        if file_path and not os.path.isabs(file_path):
+            file_path = os.path.join(base_dir, file_path)
+        encoding = entry.get("encoding") or (
+            f"{backend}:{os.path.basename(file_path)}" if file_path else model
+        )
+        registry.register(
+            TokenizerSpec(
+                model=model,
+                backend=backend,
+                encoding=encoding,
+                family=entry.get("family", "custom"),
+                path=file_path,
+            )
+        )
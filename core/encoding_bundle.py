@@ -0,0 +1,167 @@
+"""
+tiktoken encoding のオフラインバンドル。
+
+tiktoken は BPE ランク表を実行時にダウンロード・キャッシュするため、
+Lambda やエアギャップ環境ではコールドスタートと可用性の問題になる。
+ビルド時に SUPPORTED_MODELS の encoding を 1 encoding 1 ファイルの
+バイナリ形式（.utcbpe）へ書き出し、実行時はそこから読み込む。
+書き出しは scripts/build_encoding_bundles.py から行う。
+
+ファイル形式（リトルエンディアン）:
+    magic       8 bytes   b"UTCBPE1\\0"
+    header_len  uint32
+    header      JSON (name / pat_str / special_tokens / n_tokens)
+    padding     4 バイト境界まで 0 埋め
+    ranks       uint32 * n_tokens
+    offsets     uint32 * (n_tokens + 1)   blob 内の各トークンの開始位置
+    blob        トークンのバイト列を連結したもの
+
+読み込み時は base64 デコードもハッシュ検証も不要で、ネットワークにも依存しない。
+ファイルは 1 回の read で読み、トークンのバイト列はそこから直接切り出す。
+tiktoken.Encoding は（Rust 側も含めて）ランク表を自前のメモリに構築するため、
+ファイルを mmap してもワーカー間の共有にはならない。共有したい場合は、
+backend/fastapi_app/server.py のように fork 前の親プロセスで読み込んでおき、
+コピーオンライトで物理メモリを共有する。
+"""
+from __future__ import annotations
+
+import json
+import os
+import struct
+import sys
+import threading
+from array import array
+from typing import Dict, Iterable, Optional, Set
+
+import tiktoken
+
+BUNDLE_MAGIC = b"UTCBPE1\0"
+BUNDLE_SUFFIX = ".utcbpe"
+
+# バンドルの探索先。未指定時はプロジェクト直下（Lambda ZIP のルート）の encodings/
+DEFAULT_BUNDLE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "encodings"
+)
+BUNDLE_DIR = os.getenv("UTC_ENCODING_BUNDLE_DIR", DEFAULT_BUNDLE_DIR)
+
+_loaded: Dict[str, tiktoken.Encoding] = {}
+_missing: Set[str] = set()
+_lock = threading.Lock()
+
+
+def bundle_path(name: str, bundle_dir: Optional[str] = None) -> str:
+    return os.path.join(bundle_dir or BUNDLE_DIR, name + BUNDLE_SUFFIX)
+
+
+def write_bundle(encoding: tiktoken.Encoding, path: str) -> int:
+    """Encoding 1 つをバンドル形式で書き出し、書き込んだバイト数を返す。"""
+    items = sorted(encoding._mergeable_ranks.items(), key=lambda item: item[1])
+
+    ranks = array("I", (rank for _, rank in items))
+    offsets = array("I", [0])
+    for token_bytes, _ in items:
+        offsets.append(offsets[-1] + len(token_bytes))
+    blob = b"".join(token_bytes for token_bytes, _ in items)
+
+    header = json.dumps(
+        {
+            "name": encoding.name,
+            "pat_str": encoding._pat_str,
+            "special_tokens": encoding._special_tokens,
+            "n_tokens": len(items),
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+    padding = (-(len(BUNDLE_MAGIC) + 4 + len(header))) % 4
+
+    if sys.byteorder != "little":
+        ranks.byteswap()
+        offsets.byteswap()
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        fp.write(BUNDLE_MAGIC)
+        fp.write(struct.pack("<I", len(header)))
+        fp.write(header)
+        fp.write(b"\0" * padding)
+        fp.write(ranks.tobytes())
+        fp.write(offsets.tobytes())
+        fp.write(blob)
+        size = fp.tell()
+    os.replace(tmp_path, path)
+    return size
+
+
+def read_bundle(path: str) -> tiktoken.Encoding:
+    """バンドルファイルを読み込み、tiktoken.Encoding を構築する。"""
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if data[: len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+        raise ValueError(f"Not an encoding bundle: {path}")
+    view = memoryview(data)
+    pos = len(BUNDLE_MAGIC)
+    (header_len,) = struct.unpack_from("<I", data, pos)
+    pos += 4
+    header = json.loads(data[pos : pos + header_len].decode("utf-8"))
+    pos += header_len
+    pos += (-pos) % 4
+
+    n_tokens = header["n_tokens"]
+    ranks = array("I")
+    ranks.frombytes(view[pos : pos + 4 * n_tokens])
+    pos += 4 * n_tokens
+    offsets = array("I")
+    offsets.frombytes(view[pos : pos + 4 * (n_tokens + 1)])
+    pos += 4 * (n_tokens + 1)
+
+    if sys.byteorder != "little":
+        ranks.byteswap()
+        offsets.byteswap()
+
+    # base64 デコードを行わず、読み込んだバイト列をスライスするだけで辞書を組み立てる
+    # （blob 部分を別の bytes にコピーしないよう、ファイル先頭からの位置で切り出す）
+    bounds = [pos + offset for offset in offsets.tolist()]
+    token_bytes = map(data.__getitem__, map(slice, bounds[:-1], bounds[1:]))
+    mergeable_ranks = dict(zip(token_bytes, ranks.tolist()))
+
+    return tiktoken.Encoding(
+        header["name"],
+        pat_str=header["pat_str"],
+        mergeable_ranks=mergeable_ranks,
+        special_tokens=header["special_tokens"],
+    )
+
+
+def get_encoding(name: str) -> tiktoken.Encoding:
+    """
+    バンドルがあればそこから、無ければ tiktoken の通常経路（ダウンロード + キャッシュ）で読み込む。
+    バンドルから読んだ Encoding はプロセス内で 1 つだけ保持する。
+    バンドルが無いことも記録し、リクエストごとにファイルを探さないようにする。
+    """
+    encoding = _loaded.get(name)
+    if encoding is not None:
+        return encoding
+    if name in _missing:
+        return tiktoken.get_encoding(name)
+
+    path = bundle_path(name)
+    if not os.path.exists(path):
+        _missing.add(name)
+        return tiktoken.get_encoding(name)
+
+    with _lock:
+        encoding = _loaded.get(name)
+        if encoding is None:
+            encoding = read_bundle(path)
+            _loaded[name] = encoding
+    return encoding
+
+
+def build_bundles(names: Iterable[str], out_dir: str) -> Dict[str, int]:
+    """tiktoken で encoding を取得し、out_dir にバンドルを書き出す。"""
+    os.makedirs(out_dir, exist_ok=True)
+    sizes: Dict[str, int] = {}
+    for name in names:
+        encoding = tiktoken.get_encoding(name)
+        sizes[name] = write_bundle(encoding, bundle_path(name, out_dir))
+    return sizes
@@ -0,0 +1,118 @@
+"""
+巨大な入力向けのトークン数推定（accuracy="estimate"）。
+
+テキストを等分した層（stratum）ごとに 1 つずつ窓を取り、窓だけを encode して
+UTF-8 バイト長を補助変数とする比推定で全体のトークン数を外挿する。
+
+- 文字種（ASCII / CJK / 絵文字など）ごとに 1 文字あたりのバイト数が異なるため、
+  文字数ではなくバイト長に比例させると文字種の混在に強い
+- 窓の端は空白まで伸ばし、単語の途中で切ったことによるトークンの水増しを抑える
+- 信頼区間は比推定の分散の近似（残差の標本分散）から求める
+- 窓の合計が全体に対して十分小さくない場合は、推定せずに全文を encode する
+"""
+from __future__ import annotations
+
+import math
+import os
+from typing import Any, Dict, List, Tuple
+
+# 推定モードで受け付ける入力の上限（UTF-8 バイト数）
+ESTIMATE_MAX_BYTES: int = int(os.getenv("UTC_ESTIMATE_MAX_MB", "32")) * 1024 * 1024
+
+# 窓 1 つの文字数と窓の数（encode するのは最大で約 WINDOW_CHARS * WINDOW_COUNT 文字）
+ESTIMATE_WINDOW_CHARS: int = int(os.getenv("UTC_ESTIMATE_WINDOW_CHARS", "1024"))
+ESTIMATE_WINDOW_COUNT: int = int(os.getenv("UTC_ESTIMATE_WINDOW_COUNT", "64"))
+
+# 窓の合計がテキストのこの割合を超える場合は全文を encode する（推定の意味がない）
+EXACT_FALLBACK_FRACTION: float = 0.25
+
+# 窓の端を空白まで伸ばすときの最大文字数（空白の無い CJK などはそのまま切る）
+_SNAP_CHARS: int = 32
+
+# 95% 信頼区間の z 値
+_Z_95: float = 1.959963984540054
+
+
+def _snap_forward(text: str, pos: int) -> int:
+    """pos から最大 _SNAP_CHARS 文字先までで最初の空白の位置（無ければ pos）。"""
+    limit = min(len(text), pos + _SNAP_CHARS)
+    for i in range(pos, limit):
+        if text[i].isspace():
+            return i
+    return pos
+
+
+def sample_windows(
+    text: str,
+    window_chars: int = ESTIMATE_WINDOW_CHARS,
+    window_count: int = ESTIMATE_WINDOW_COUNT,
+) -> List[Tuple[int, int]]:
+    """テキストを window_count 等分し、各層の中央付近から 1 つずつ [start, end) の窓を取る。"""
+    n = len(text)
+    stratum = n / window_count
+    windows: List[Tuple[int, int]] = []
+    for h in range(window_count):
+        center = int((h + 0.5) * stratum)
+        start = _snap_forward(text, max(0, center - window_chars // 2))
+        end = _snap_forward(text, min(n, start + window_chars))
+        if end > start:
+            windows.append((start, end))
+    return windows
+
+
+def estimate_token_count(
+    backend: Any,
+    text: str,
+    total_bytes: int,
+    *,
+    window_chars: int = ESTIMATE_WINDOW_CHARS,
+    window_count: int = ESTIMATE_WINDOW_COUNT,
+) -> Dict[str, Any]:
+    """
+    トークン数の推定値と 95% 信頼区間。
+
+    戻り値:
+        estimate / ci_low / ci_high: トークン数
+        sampled_chars: encode した文字数
+        exact: 全文を encode した（推定していない）場合 True
+    """
+    if window_chars * window_count >= EXACT_FALLBACK_FRACTION * len(text):
+        count = backend.count(text)
+        return {
+            "estimate": count,
+            "ci_low": count,
+            "ci_high": count,
+            "sampled_chars": len(text),
+            "exact": True,
+        }
+
+    windows = sample_windows(text, window_chars, window_count)
+    samples = [text[start:end] for start, end in windows]
+    tokens = backend.count_batch(samples)
+    sample_bytes = [len(sample.encode("utf-8", "surrogatepass")) for sample in samples]
+
+    # 比推定: トークン数 / バイト数 の比を全体のバイト数に掛ける
+    n = len(samples)
+    ratio = sum(tokens) / sum(sample_bytes)
+    estimate = ratio * total_bytes
+
+    # Var(T) ≈ B^2 (1 - f) / (n * b̄^2) * s_e^2, e_i = t_i - R b_i
+    mean_bytes = sum(sample_bytes) / n
+    residual_var = (
+        sum((t - ratio * b) ** 2 for t, b in zip(tokens, sample_bytes)) / (n - 1)
+        if n > 1
+        else 0.0
+    )
+    sampling_fraction = sum(sample_bytes) / total_bytes
+    std_error = total_bytes * math.sqrt(
+        max(0.0, 1.0 - sampling_fraction) * residual_var / n
+    ) / mean_bytes
+    margin = _Z_95 * std_error
+
+    return {
+        "estimate": round(estimate),
+        "ci_low": max(sum(tokens), math.floor(estimate - margin)),
+        "ci_high": math.ceil(estimate + margin),
+        "sampled_chars": sum(len(sample) for sample in samples),
+        "exact": False,
+    }
@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import os
+import secrets
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import regex
+
+from .backends import TokenizerBackend, TokenizerUnavailable
+from .token_counter import (
+    UtcError,
+    UtcErrorCode,
+    _is_blank,
+    tokenizer_registry,
+    validate_text_size,
+)
+
+# セグメントの目安サイズ（文字数）。編集時はこの単位で再 encode する
+SEGMENT_TARGET_CHARS: int = 2048
+# 再同期で閉じるセグメントの最小サイズ（細かいセグメントが増え続けないようにする）
+SEGMENT_MIN_CHARS: int = SEGMENT_TARGET_CHARS // 4
+# 編集位置より手前に取る文脈。分割パターンの先読み（縮約形 's / 'll など）が届く距離より長くする
+BOUNDARY_CONTEXT_CHARS: int = 16
+
+_patterns: Dict[str, "regex.Pattern[str]"] = {}
+
+
+def _split_pattern(backend: TokenizerBackend) -> Optional["regex.Pattern[str]"]:
+    """tiktoken 系バックエンドの事前分割パターン（それ以外は None）。"""
+    encoding = getattr(backend, "encoding", None)
+    pat_str = getattr(encoding, "_pat_str", None)
+    if pat_str is None:
+        return None
+    pattern = _patterns.get(pat_str)
+    if pattern is None:
+        pattern = regex.compile(pat_str)
+        _patterns[pat_str] = pattern
+    return pattern
+
+
+def _is_stable_boundary(text: str, pos: int) -> bool:
+    """
+    事前分割の境界 pos の直前が空白以外なら、そこで切ったセグメントを単独で encode しても
+    全文を encode した場合と同じ分割になる。
+    末尾に依存する構文（`\\s++$` や `\\s+(?!\\S)`）は空白にしか掛からないため。
+    """
+    return 0 < pos < len(text) and not text[pos - 1].isspace()
+
+
+class IncrementalDocument:
+    """
+    差分編集を受け付けてトークン数を更新するドキュメント。
+
+    - テキストは encoding の事前分割パターンの境界でセグメントに分け、セグメントごとのトークン数を保持する
+    - 編集時は影響を受けるセグメント（+ 手前の文脈）だけを再分割・再 encode し、
+      旧セグメント境界と再び一致した時点で残りを再利用する
+    - BPE は事前分割の単位をまたがないため、合計は全文 encode と同じ厳密な値になる
+    - 事前分割パターンを持たないバックエンド（HuggingFace 等）は編集ごとに全文を数え直す
+    """
+
+    def __init__(self, model: str, text: str) -> None:
+        if not isinstance(model, str) or not isinstance(text, str):
+            raise UtcError(UtcErrorCode.INVALID_TYPE, "model and text must be strings")
+        if _is_blank(text):
+            raise UtcError(UtcErrorCode.EMPTY_TEXT, "text must not be empty")
+
+        spec = tokenizer_registry.get_spec(model)
+        if spec is None:
+            raise UtcError(UtcErrorCode.UNSUPPORTED_MODEL, f"Unsupported model: {model}")
+        validate_text_size(text)
+
+        try:
+            backend = tokenizer_registry.get(model)
+        except TokenizerUnavailable as exc:
+            raise UtcError(UtcErrorCode.TOKENIZER_UNAVAILABLE, str(exc)) from exc
+
+        self.model = model
+        self.encoding = spec.encoding
+        self.model_family = spec.family
+        self.revision = 0
+        self._backend = backend
+        self._pattern = _split_pattern(backend)
+        self._lock = threading.Lock()
+
+        self._text = text
+        segments, _ = self._resegment(text, 0, [])
+        self._lengths: List[int] = [len(segment) for segment in segments]
+        self._counts: List[int] = backend.count_batch(segments) if segments else []
+        self.token_count = sum(self._counts)
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @property
+    def char_count(self) -> int:
+        return len(self._text)
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._lengths)
+
+    def result(self) -> Dict[str, Any]:
+        """count_tokens の result ブロックと同じ形式の現在値。"""
+        char_count = self.char_count
+        return {
+            "model": self.model,
+            "encoding": self.encoding,
+            "char_count": char_count,
+            "token_count": self.token_count,
+            "token_per_char": self.token_count / char_count if char_count else 0.0,
+        }
+
+    def memory_bytes(self) -> int:
+        """セッション保持のメモリ予算に使う概算サイズ。"""
+        return sys.getsizeof(self._text) + 2 * 36 * len(self._lengths)
+
+    # --- 編集 -----------------------------------------------------------------
+
+    def apply_edits(self, edits: Iterable[Tuple[int, int, str]]) -> int:
+        """
+        (offset, delete, insert) の列を順に適用する。offset は直前の編集を適用した後の文字位置。
+        いずれかの編集が不正なら全体を適用しない。再 encode した文字数の合計を返す。
+        """
+        with self._lock:
+            # 途中の編集が不正だった場合はまとめて取り消す
+            snapshot = (self._text, list(self._lengths), list(self._counts), self.token_count)
+            reencoded = 0
+            try:
+                for offset, delete, insert in edits:
+                    reencoded += self._apply_edit(offset, delete, insert)
+            except BaseException:
+                self._text, self._lengths, self._counts, self.token_count = snapshot
+                raise
+            self.revision += 1
+            return reencoded
+
+    def _apply_edit(self, offset: int, delete: int, insert: str) -> int:
+        old_text = self._text
+        if not isinstance(insert, str):
+            raise UtcError(UtcErrorCode.INVALID_TYPE, "insert must be a string")
+        if offset < 0 or delete < 0 or offset + delete > len(old_text):
+            raise UtcError(
+                UtcErrorCode.INVALID_EDIT,
+                f"Edit out of range (offset={offset}, delete={delete}, length={len(old_text)})",
+            )
+
+        new_text = old_text[:offset] + insert + old_text[offset + delete :]
+        if new_text:
+            validate_text_size(new_text)
+
+        if self._pattern is None:
+            self._text = new_text
+            self._lengths = [len(new_text)] if new_text else []
+            self._counts = [self._backend.count(new_text)] if new_text else []
+            self.token_count = sum(self._counts)
+            return len(new_text)
+
+        delta = len(insert) - delete
+        starts = [0, *accumulate(self._lengths)][:-1]
+
+        # 編集位置から文脈分だけ手前にある境界から再分割する
+        left = max(0, bisect_right(starts, offset - BOUNDARY_CONTEXT_CHARS) - 1)
+
+        # 編集範囲より後ろの旧境界（新しい座標）。ここで分割が再び一致すれば以降を再利用できる
+        first_resync = max(bisect_left(starts, offset + delete), left + 1)
+        resync = [starts[i] + delta for i in range(first_resync, len(starts))]
+
+        segments, matched = self._resegment(new_text, starts[left] if starts else 0, resync)
+        counts = [self._backend.count(segment) for segment in segments]
+
+        stop = len(self._lengths) if matched is None else first_resync + matched
+        self._lengths[left:stop] = [len(segment) for segment in segments]
+        self._counts[left:stop] = counts
+        self._text = new_text
+        self.token_count = sum(self._counts)
+        return sum(len(segment) for segment in segments)
+
+    def _resegment(
+        self, text: str, start: int, resync: Sequence[int]
+    ) -> Tuple[List[str], Optional[int]]:
+        """
+        text[start:] を事前分割パターンの境界でセグメントに分ける。
+        resync（昇順）のいずれかの位置で安定した境界に到達したら、そこで打ち切って
+        (セグメント列, resync 内のインデックス) を返す。末尾まで到達した場合は None。
+        """
+        if self._pattern is None:
+            return ([text[start:]] if start < len(text) else []), None
+
+        segments: List[str] = []
+        seg_start = start
+        j = 0
+        for match in self._pattern.finditer(text, start):
+            end = match.end()
+            while j < len(resync) and resync[j] < end:
+                j += 1
+            if (
+                j < len(resync)
+                and resync[j] == end
+                and end - seg_start >= SEGMENT_MIN_CHARS
+                and _is_stable_boundary(text, end)
+            ):
+                segments.append(text[seg_start:end])
+                return segments, j
+            if end - seg_start >= SEGMENT_TARGET_CHARS and _is_stable_boundary(text, end):
+                segments.append(text[seg_start:end])
+                seg_start = end
+
+        if seg_start < len(text):
+            segments.append(text[seg_start:])
+        return segments, None
+
+
+# === セッション管理 ============================================================
+
+SESSION_IDLE_TTL_S: float = float(os.getenv("UTC_SESSION_IDLE_TTL_S", "600"))
+SESSION_MEMORY_BUDGET_BYTES: int = (
+    int(os.getenv("UTC_SESSION_MEMORY_BUDGET_MB", "256")) * 1024 * 1024
+)
+
+
+class IncrementalSessionStore:
+    """
+    セッション ID → IncrementalDocument の保持。
+
+    - 最終アクセスから idle_ttl_s を過ぎたセッションを破棄する
+    - 合計メモリが予算を超えたら、最終アクセスが古いものから破棄する
+    - プロセス内のストアのため、マルチワーカー構成ではセッションはワーカーごとに独立する
+    """
+
+    def __init__(
+        self,
+        *,
+        idle_ttl_s: float = SESSION_IDLE_TTL_S,
+        memory_budget_bytes: int = SESSION_MEMORY_BUDGET_BYTES,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.idle_ttl_s = idle_ttl_s
+        self.memory_budget_bytes = memory_budget_bytes
+        self._clock = clock
+        self._sessions: "OrderedDict[str, Tuple[IncrementalDocument, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def create(self, model: str, text: str) -> Tuple[str, IncrementalDocument]:
+        document = IncrementalDocument(model, text)
+        session_id = secrets.token_urlsafe(16)
+        with self._lock:
+            self._sessions[session_id] = (document, self._clock())
+            self._evict_locked(keep=session_id)
+        return session_id, document
+
+    def get(self, session_id: str) -> IncrementalDocument:
+        with self._lock:
+            self._evict_locked(keep=session_id)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                raise UtcError(UtcErrorCode.SESSION_NOT_FOUND, f"Unknown session: {session_id}")
+            self._sessions[session_id] = (entry[0], self._clock())
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def edit(
+        self, session_id: str, edits: Iterable[Tuple[int, int, str]]
+    ) -> Tuple[IncrementalDocument, int]:
+        """編集を適用し、(ドキュメント, 再 encode した文字数) を返す。"""
+        document = self.get(session_id)
+        reencoded = document.apply_edits(edits)
+        with self._lock:
+            # 編集でテキストが増えた場合に備えて予算を再確認する
+            self._evict_locked(keep=session_id)
+        return document, reencoded
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _evict_locked(self, *, keep: Optional[str] = None) -> None:
+        """
+        期限切れのセッションをすべて破棄し、その後で予算を超えた分を古い順に破棄する。
+        keep（アクセス中のセッション）は予算による破棄からだけ守る。期限切れなら keep でも破棄する。
+        """
+        now = self._clock()
+        for session_id, (_, last_access) in list(self._sessions.items()):
+            if now - last_access <= self.idle_ttl_s:
+                break  # OrderedDict は最終アクセス順
+            del self._sessions[session_id]
+            self.evictions += 1
+
+        total = sum(document.memory_bytes() for document, _ in self._sessions.values())
+        for session_id in list(self._sessions):
+            if total <= self.memory_budget_bytes:
+                break
+            if session_id == keep:
+                continue
+            document, _ = self._sessions.pop(session_id)
+            total -= document.memory_bytes()
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "memory_bytes": sum(doc.memory_bytes() for doc, _ in self._sessions.values()),
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "evictions": self.evictions,
+            }
+
+
+# プロセス共通のセッションストア
+session_store = IncrementalSessionStore()
@@ -0,0 +1,102 @@
+"""
+決定的でキャッシュ付きの言語判定。
+
+langdetect は内部で乱数を使うため、同じテキストでも呼び出しごと・ワーカーごとに
+結果が揺れることがある。ここでは
+
+- DetectorFactory.seed を固定して結果を決定的にする
+- 判定は正規化した先頭 LANGUAGE_PREFIX_CHARS 文字だけで行う（コストを入力長に依存させない）
+- その先頭部分の blake2b フィンガープリントをキーに、結果を LRU で保持する
+
+ことで、同じ・ほぼ同じ（先頭が同じ / 空白の違いだけ）入力の判定を省き、
+どのワーカーでも同じ結果を返す。
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict
+
+import langdetect
+from langdetect import DetectorFactory
+from langdetect.lang_detect_exception import LangDetectException
+
+# 乱数のシードを固定する（langdetect の Detector は生成時にこの値を読む）
+DetectorFactory.seed = 0
+
+# 判定に使う先頭の文字数（正規化後）
+LANGUAGE_PREFIX_CHARS: int = int(os.getenv("UTC_LANGUAGE_PREFIX_CHARS", "1024"))
+
+# キャッシュするフィンガープリントの数
+LANGUAGE_CACHE_SIZE: int = int(os.getenv("UTC_LANGUAGE_CACHE_SIZE", "4096"))
+
+UNKNOWN_LANGUAGE = "unknown"
+
+
+def normalize_prefix(text: str, limit: int = LANGUAGE_PREFIX_CHARS) -> str:
+    """空白の連続を 1 つにまとめ、前後の空白を除いた先頭 limit 文字。"""
+    # 空白をまとめると短くなるだけなので、元テキストは limit の 2 倍まで見れば足りることが多い
+    return " ".join(text[: limit * 2].split())[:limit]
+
+
+def fingerprint(prefix: str) -> bytes:
+    return hashlib.blake2b(prefix.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class LanguageDetector:
+    """フィンガープリント → 言語コードの LRU 付き判定器。"""
+
+    def __init__(self, maxsize: int = LANGUAGE_CACHE_SIZE) -> None:
+        self.maxsize = max(0, maxsize)
+        self._cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def detect(self, text: str) -> str:
+        prefix = normalize_prefix(text)
+        key = fingerprint(prefix)
+
+        with self._lock:
+            language = self._cache.get(key)
+            if language is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return language
+            self.misses += 1
+
+        try:
+            # モジュール属性経由で呼ぶ（テストで langdetect.detect を差し替えられるように）
+            language = langdetect.detect(prefix)
+        except LangDetectException:
+            # 数字だけなど特徴が無い入力。入力が同じなら結果も同じなのでキャッシュしてよい
+            language = UNKNOWN_LANGUAGE
+        except Exception:
+            # 想定外の失敗はキャッシュしない
+            return UNKNOWN_LANGUAGE
+
+        if self.maxsize:
+            with self._lock:
+                self._cache[key] = language
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        return language
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "language_cache_size": len(self._cache),
+                "language_cache_hits": self.hits,
+                "language_cache_misses": self.misses,
+            }
+
+
+# プロセス共通の判定器
+language_detector = LanguageDetector()
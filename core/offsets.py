@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left
+from typing import Iterable, List, Sequence, Tuple
+
+
+def delta_encode(offsets: Sequence[int]) -> List[int]:
+    """
+    昇順のオフセット列を差分列にする（先頭は 0 からの差分）。
+    隣接トークンの開始位置の差は小さいため、JSON にしたときのサイズが大きく減る。
+    """
+    deltas: List[int] = []
+    previous = 0
+    for offset in offsets:
+        deltas.append(offset - previous)
+        previous = offset
+    return deltas
+
+
+def delta_decode(deltas: Iterable[int]) -> "array[int]":
+    """delta_encode の逆変換。"""
+    offsets = array("i")
+    current = 0
+    for delta in deltas:
+        current += delta
+        offsets.append(current)
+    return offsets
+
+
+def span_token_counts(
+    offsets: "array[int]",
+    spans: Iterable[Tuple[int, int]],
+    char_count: int,
+) -> List[int]:
+    """
+    文字範囲 [start, end) ごとのトークン数。
+    トークンは開始位置が属する範囲に数える（範囲の境界をまたぐトークンは開始側に入る）。
+    範囲が不正な場合は ValueError。
+    """
+    counts: List[int] = []
+    for start, end in spans:
+        if not 0 <= start <= end <= char_count:
+            raise ValueError(f"Invalid span [{start}, {end}) for text of {char_count} chars")
+        counts.append(bisect_left(offsets, end) - bisect_left(offsets, start))
+    return counts
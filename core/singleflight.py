@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Call:
+    """実行中の 1 計算。先行スレッドが結果を格納し、後続スレッドは event で待つ。"""
+
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    同一キーの同時実行を 1 回の計算にまとめる（single-flight）。
+
+    - 実行中の計算があれば、その完了を待って同じ結果を返す
+    - 完了した結果は保持しない（キャッシュではない）ため、結果キャッシュの有無とは独立に使える
+    - キーは dict で比較されるため、ハッシュ衝突時も等価性で正しく区別される
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        fn() を実行して (結果, 共有されたかどうか) を返す。
+        同じ key の計算が実行中なら fn は呼ばず、その結果を待って共有する。
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.value, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        """メトリクス用のカウンタ（プロセス起動からの累計）。"""
+        return {
+            "singleflight_leaders": self.leaders,
+            "singleflight_coalesced": self.coalesced,
+            "singleflight_in_flight": self.in_flight(),
+        }
@@ -1,11 +1,23 @@
 from __future__ import annotations
 
+import os
 import time
 from datetime import datetime, timezone
-from typing import Any, Dict
+from typing import AbstractSet, Any, Dict, List, Optional, Sequence, Tuple
 
-import langdetect
-import tiktoken
+# language.py と同じモジュールオブジェクト（tc.langdetect.detect を差し替えると判定にも効く）
+import langdetect  # noqa: F401
+
+from .backends import (
+    TokenizerRegistry,
+    TokenizerSpec,
+    TokenizerUnavailable,
+    load_registry_config,
+)
+from .estimate import ESTIMATE_MAX_BYTES, estimate_token_count
+from .language import language_detector
+from .offsets import delta_encode, span_token_counts
+from .singleflight import SingleFlight
 
 # 対応モデルと encoding 名のマッピング（UTC v0.1仕様）
 SUPPORTED_MODELS: Dict[str, str] = {
@@ -21,6 +33,37 @@ SUPPORTED_MODELS: Dict[str, str] = {
 MAX_CHAR_COUNT: int = 100_000
 MAX_BYTES: int = 512 * 1024  # 512KB
 
+# accuracy の指定（estimate は巨大な入力をサンプリングで推定する）
+ACCURACY_MODES: Tuple[str, ...] = ("exact", "estimate")
+
+# 高負荷時に省略できる任意処理（skip_stages に指定する名前）
+STAGE_LANGUAGE_DETECTION = "language_detection"
+STAGE_VERBOSE_META = "verbose_meta"  # processing_time_ms / utc_timestamp / token_density
+
+# UTF-8 バイト長を数えるときに一度に encode する文字数（一時バッファの上限を決める）
+_UTF8_CHUNK_CHARS: int = 8 * 1024
+
+
+# ローカルトークナイザ（HuggingFace / SentencePiece）の LRU メモリ予算
+TOKENIZER_MEMORY_BUDGET_BYTES: int = (
+    int(os.getenv("UTC_TOKENIZER_MEMORY_BUDGET_MB", "512")) * 1024 * 1024
+)
+
+# モデル名 → トークナイザバックエンドのレジストリ
+# OpenAI 系は SUPPORTED_MODELS から、その他は UTC_TOKENIZER_CONFIG の JSON から登録する
+tokenizer_registry = TokenizerRegistry(TOKENIZER_MEMORY_BUDGET_BYTES)
+for _model, _encoding_name in SUPPORTED_MODELS.items():
+    tokenizer_registry.register(
+        TokenizerSpec(model=_model, backend="tiktoken", encoding=_encoding_name, family="openai")
+    )
+
+_TOKENIZER_CONFIG = os.getenv("UTC_TOKENIZER_CONFIG")
+if _TOKENIZER_CONFIG:
+    load_registry_config(tokenizer_registry, _TOKENIZER_CONFIG)
+
+# 同一 (トークナイザ, text) の同時リクエストで encode を 1 回にまとめる
+token_count_flight = SingleFlight()
+
 
 class UtcErrorCode:
     """UTC 内部で利用するエラーコード（API レイヤーで JSON にマッピングする前段）"""
@@ -29,6 +72,11 @@ class UtcErrorCode:
     EMPTY_TEXT = "EMPTY_TEXT"
     UNSUPPORTED_MODEL = "UNSUPPORTED_MODEL"
     PAYLOAD_TOO_LARGE = "PAYLOAD_TOO_LARGE"
+    TOKENIZER_UNAVAILABLE = "TOKENIZER_UNAVAILABLE"
+    INVALID_EDIT = "INVALID_EDIT"
+    SESSION_NOT_FOUND = "SESSION_NOT_FOUND"
+    INVALID_SPAN = "INVALID_SPAN"
+    UNSUPPORTED_OPTION = "UNSUPPORTED_OPTION"
 
 
 class UtcError(Exception):
@@ -40,21 +88,97 @@ class UtcError(Exception):
         super().__init__(self.detail)
 
 
+def utf8_length(text: str, limit: Optional[int] = None) -> int:
+    """
+    text を UTF-8 にした場合のバイト長を、全体のコピーを作らずに求める。
+
+    - ASCII のみの文字列は len() がそのままバイト長（CPython では O(1) で判定できる）
+    - それ以外はチャンク単位で encode して合計する（一時バッファは 1 チャンク分だけ）
+    - limit を超えた時点で打ち切り、その時点の値（> limit）を返す
+    - 孤立サロゲートは encode エラーにせず 3 バイトとして数える
+    """
+    if text.isascii():
+        return len(text)
+
+    total = 0
+    for start in range(0, len(text), _UTF8_CHUNK_CHARS):
+        chunk = text[start : start + _UTF8_CHUNK_CHARS]
+        total += len(chunk.encode("utf-8", "surrogatepass"))
+        if limit is not None and total > limit:
+            break
+    return total
+
+
+def _is_blank(text: str) -> bool:
+    """空文字・空白のみかどうか（strip() のようなコピーを作らない）。"""
+    return not text or text.isspace()
+
+
+def validate_text_size(
+    text: str,
+    *,
+    max_chars: int = MAX_CHAR_COUNT,
+    max_bytes: int = MAX_BYTES,
+) -> Tuple[int, int]:
+    """
+    文字数・バイト数の上限チェック。(char_count, input_size_bytes) を返す。
+    文字数で判定できる場合はバイト長を数える前に、バイト長も上限を超えた時点で打ち切って拒否する。
+    """
+    char_count = len(text)
+    if char_count > max_chars:
+        raise UtcError(
+            UtcErrorCode.PAYLOAD_TOO_LARGE,
+            f"Size exceeded (chars={char_count}, max_chars={max_chars})",
+        )
+
+    input_size_bytes = utf8_length(text, limit=max_bytes)
+    if input_size_bytes > max_bytes:
+        raise UtcError(
+            UtcErrorCode.PAYLOAD_TOO_LARGE,
+            f"Size exceeded (chars={char_count}, bytes>{max_bytes})",
+        )
+    return char_count, input_size_bytes
+
+
+def _count_with_offsets(backend: Any, text: str) -> Tuple[int, Any]:
+    """(トークン数, 開始文字位置の int32 配列)。トークン ID 列自体は保持しない。"""
+    tokens, offsets = backend.encode_with_offsets(text)
+    return len(tokens), offsets
+
+
 def _detect_language(text: str) -> str:
-    """langdetect を用いた言語判定。失敗した場合は 'unknown' を返す。"""
-    try:
-        return langdetect.detect(text)
-    except Exception:
-        return "unknown"
+    """
+    langdetect を用いた言語判定。失敗した場合は 'unknown' を返す。
+    シード固定・先頭部分のフィンガープリントでキャッシュする（core/language.py）。
+    """
+    return language_detector.detect(text)
 
 
-def count_tokens(model: str, text: str, *, version: str = "0.1.0") -> Dict[str, Any]:
+def count_tokens(
+    model: str,
+    text: str,
+    *,
+    version: str = "0.1.0",
+    spans: Optional[Sequence[Tuple[int, int]]] = None,
+    return_offsets: bool = False,
+    accuracy: str = "exact",
+    skip_stages: AbstractSet[str] = frozenset(),
+) -> Dict[str, Any]:
     """
     UTC のコア処理。
     - モデルとテキストを受け取り
     - トークン数と各種メタ情報を計算し
     - UTC v0.1 仕様の result + meta 形式で返す
 
+    オプション（どちらも 1 回の encode から求める）:
+    - spans: 文字範囲 [start, end) のリスト。result.span_token_counts に範囲ごとのトークン数を返す
+    - return_offsets: result.token_offsets_delta に各トークンの開始文字位置を差分列で返す
+    - accuracy="estimate": 窓をサンプリングして推定する（MAX_CHAR_COUNT を超える入力も受け付ける）。
+      result.token_count_estimate と meta.confidence_interval（95%）を返す。
+      サンプリングするまでもない長さなら全文を数え、meta.accuracy は "exact" になる
+    - skip_stages: 省略する任意処理（STAGE_LANGUAGE_DETECTION / STAGE_VERBOSE_META）。
+      省略した段階は meta.skipped_stages に列挙し、対応する meta の値は含めない
+
     エラー条件（バリデーション）は UtcError として送出される。
     """
     started_at = time.perf_counter()
@@ -64,37 +188,71 @@ def count_tokens(model: str, text: str, *, version: str = "0.1.0") -> Dict[str,
         raise UtcError(UtcErrorCode.INVALID_TYPE, "model and text must be strings")
 
     # 空文字・空白のみチェック
-    if text.strip() == "":
+    if _is_blank(text):
         raise UtcError(UtcErrorCode.EMPTY_TEXT, "text must not be empty")
 
+    if accuracy not in ACCURACY_MODES:
+        raise UtcError(UtcErrorCode.UNSUPPORTED_OPTION, f"Unknown accuracy: {accuracy}")
+    estimating = accuracy == "estimate"
+    if estimating and (spans is not None or return_offsets):
+        raise UtcError(
+            UtcErrorCode.UNSUPPORTED_OPTION,
+            "spans and return_offsets require accuracy=exact",
+        )
+
     # モデル対応チェック
-    encoding_name = SUPPORTED_MODELS.get(model)
-    if encoding_name is None:
+    spec = tokenizer_registry.get_spec(model)
+    if spec is None:
         raise UtcError(UtcErrorCode.UNSUPPORTED_MODEL, f"Unsupported model: {model}")
+    encoding_name = spec.encoding
 
-    # サイズチェック
-    char_count = len(text)
-    input_bytes = text.encode("utf-8")
-    input_size_bytes = len(input_bytes)
-
-    if char_count > MAX_CHAR_COUNT or input_size_bytes > MAX_BYTES:
-        raise UtcError(
-            UtcErrorCode.PAYLOAD_TOO_LARGE,
-            f"Size exceeded (chars={char_count}, bytes={input_size_bytes})",
+    # サイズチェック（UTF-8 のコピーを作らずにバイト長を求める）
+    if estimating:
+        # 文字数はバイト数を超えないため、バイト数の上限だけで足りる
+        char_count, input_size_bytes = validate_text_size(
+            text, max_chars=ESTIMATE_MAX_BYTES, max_bytes=ESTIMATE_MAX_BYTES
         )
+    else:
+        char_count, input_size_bytes = validate_text_size(text)
 
     # トークナイズ
-    encoding = tiktoken.get_encoding(encoding_name)
-    tokens = encoding.encode(text)
-    token_count = len(tokens)
+    try:
+        backend = tokenizer_registry.get(model)
+    except TokenizerUnavailable as exc:
+        raise UtcError(UtcErrorCode.TOKENIZER_UNAVAILABLE, str(exc)) from exc
+
+    # 同一トークナイザ・同一テキストの同時リクエストは 1 回の encode を共有する
+    offsets = None
+    estimate: Optional[Dict[str, Any]] = None
+    if estimating:
+        estimate, _ = token_count_flight.do(
+            ("estimate", spec.key, text),
+            lambda: estimate_token_count(backend, text, input_size_bytes),
+        )
+        token_count = estimate["estimate"]
+    elif spans is not None or return_offsets:
+        try:
+            (token_count, offsets), _ = token_count_flight.do(
+                ("offsets", spec.key, text),
+                lambda: _count_with_offsets(backend, text),
+            )
+        except NotImplementedError as exc:
+            raise UtcError(UtcErrorCode.UNSUPPORTED_OPTION, str(exc)) from exc
+    else:
+        token_count, _ = token_count_flight.do(
+            (spec.key, text),
+            lambda: backend.count(text),
+        )
 
     # 各種統計値
     token_per_char = token_count / char_count if char_count else 0.0
     token_density = token_count / input_size_bytes if input_size_bytes else 0.0
-    input_language = _detect_language(text)
-
-    processing_time_ms = (time.perf_counter() - started_at) * 1000.0
-    utc_timestamp = datetime.now(timezone.utc).isoformat()
+    skipped: List[str] = []
+    input_language: Optional[str] = None
+    if STAGE_LANGUAGE_DETECTION in skip_stages:
+        skipped.append(STAGE_LANGUAGE_DETECTION)
+    else:
+        input_language = _detect_language(text)
 
     result: Dict[str, Any] = {
         "model": model,
@@ -104,15 +262,43 @@ def count_tokens(model: str, text: str, *, version: str = "0.1.0") -> Dict[str,
         "token_per_char": token_per_char,
     }
 
-    meta: Dict[str, Any] = {
-        "input_language": input_language,
-        "input_size_bytes": input_size_bytes,
-        "token_density": token_density,
-        "model_family": "openai",
-        "processing_time_ms": processing_time_ms,
-        "utc_timestamp": utc_timestamp,
-        "version": version,
-    }
+    if spans is not None:
+        try:
+            result["span_token_counts"] = span_token_counts(offsets, spans, char_count)
+        except ValueError as exc:
+            raise UtcError(UtcErrorCode.INVALID_SPAN, str(exc)) from exc
+    if return_offsets:
+        result["token_offsets_delta"] = delta_encode(offsets)
+
+    verbose = STAGE_VERBOSE_META not in skip_stages
+    if not verbose:
+        skipped.append(STAGE_VERBOSE_META)
+
+    meta: Dict[str, Any] = {}
+    if input_language is not None:
+        meta["input_language"] = input_language
+    meta["input_size_bytes"] = input_size_bytes
+    if verbose:
+        meta["token_density"] = token_density
+    meta["model_family"] = spec.family
+    if verbose:
+        meta["processing_time_ms"] = (time.perf_counter() - started_at) * 1000.0
+        meta["utc_timestamp"] = datetime.now(timezone.utc).isoformat()
+    meta["version"] = version
+    if skipped:
+        meta["skipped_stages"] = skipped
+
+    if estimate is not None:
+        result["token_count_estimate"] = token_count
+        if not estimate["exact"]:
+            result["token_count"] = None
+        meta["accuracy"] = "exact" if estimate["exact"] else "estimate"
+        meta["confidence_interval"] = {
+            "low": estimate["ci_low"],
+            "high": estimate["ci_high"],
+            "level": 0.95,
+        }
+        meta["sampled_chars"] = estimate["sampled_chars"]
 
     return {"result": result, "meta": meta}
 
@@ -5,11 +5,24 @@ import json
 import logging
 import os
 import time
-from typing import Any, Dict
+from contextlib import ExitStack
+from typing import Any, Dict, Optional, Tuple
 
 from mangum import Mangum
+from mangum.protocols import LifespanCycle
+from backend.fastapi_app.handlers import build_error_response
 from backend.fastapi_app.main import app
 
+from lambda_http.streaming import (
+    MAX_BUFFERED_RESPONSE_BYTES,
+    STREAM_THRESHOLD_BYTES,
+    ResponseStream,
+    StreamingHTTPCycle,
+    buffered_response_bytes,
+    estimate_response_bytes,
+    write_buffered_response,
+)
+
 # ============================================================================
 # ロガー設定（Lambda エッジ用の構造化ログ）
 # ============================================================================
@@ -70,21 +83,18 @@ def _create_mangum_handler(event: Dict[str, Any]) -> Mangum:
 # AWS Lambda エントリポイント
 # ============================================================================
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    """
-    - リクエストごとに Mangum ハンドラを生成（ステージに応じた base path を設定）
-    - FastAPI を実行
-    - 結果を API Gateway / Lambda URL 形式で返却
-    - ついでに Lambda エッジの構造化ログを出力
-    """
-    start = time.perf_counter()
-
-    mangum_handler = _create_mangum_handler(event)
-    response = mangum_handler(event, context)
-
-    duration_ms = (time.perf_counter() - start) * 1000.0
-
-    # event からメタ情報を抽出
+def _log_invocation(
+    event: Dict[str, Any],
+    context: Any,
+    status_code: Optional[int],
+    duration_ms: float,
+    *,
+    response_mode: str,
+    response_bytes: Optional[int],
+    error_code: Optional[str] = None,
+    error_message: Optional[str] = None,
+) -> None:
+    """event からメタ情報を抽出して Lambda エッジのログを出力する（CloudWatch Logs 用）。"""
     request_context = event.get("requestContext", {}) or {}
     http_info = request_context.get("http", {}) or {}
 
@@ -93,14 +103,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     raw_path = event.get("rawPath") or http_info.get("path")
     source_ip = http_info.get("sourceIp") or request_context.get("identity", {}).get("sourceIp")
 
-    status_code = None
-    try:
-        status_code = int(response.get("statusCode"))  # type: ignore[arg-type]
-    except Exception:
-        # 念のため安全側に倒す
-        status_code = None
-
-    # ログ出力（CloudWatch Logs 用）
     _log_edge(
         {
             "request_id": getattr(context, "aws_request_id", None),
@@ -113,10 +115,122 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             "lambda_duration_ms": round(duration_ms, 3),
             "cold_start": getattr(context, "get_remaining_time_in_millis", None) is not None,
             "source_ip": source_ip,
-            "error_code": None,
-            "error_message": None,
+            "response_mode": response_mode,
+            "response_bytes": response_bytes,
+            "error_code": error_code,
+            "error_message": error_message,
         }
     )
 
+
+def _response_too_large(response: Dict[str, Any]) -> Dict[str, Any]:
+    """上限を超えた同期レスポンスを APIron 形式の RESPONSE_TOO_LARGE に差し替える。"""
+    error = build_error_response("RESPONSE_TOO_LARGE")
+    headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in error.raw_headers}
+    replaced: Dict[str, Any] = {
+        "statusCode": error.status_code,
+        "headers": headers,
+        "body": error.body.decode("utf-8"),
+        "isBase64Encoded": False,
+    }
+    if "multiValueHeaders" in response:
+        # REST API (v1) 形式では Mangum はヘッダを multiValueHeaders で返す
+        replaced["headers"] = {}
+        replaced["multiValueHeaders"] = {k: [v] for k, v in headers.items()}
+    return replaced
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    - リクエストごとに Mangum ハンドラを生成（ステージに応じた base path を設定）
+    - FastAPI を実行
+    - 結果を API Gateway / Lambda URL 形式で返却
+    - 結果が同期呼び出しの上限（6MB）を超える場合は RESPONSE_TOO_LARGE に差し替える
+      （Lambda 側で 502 になるのを防ぐ。大きな結果は stream_handler で返す）
+    - ついでに Lambda エッジの構造化ログを出力
+    """
+    start = time.perf_counter()
+
+    mangum_handler = _create_mangum_handler(event)
+    response = mangum_handler(event, context)
+
+    size = buffered_response_bytes(response)
+    error_code = None
+    if size > MAX_BUFFERED_RESPONSE_BYTES:
+        response = _response_too_large(response)
+        error_code = "RESPONSE_TOO_LARGE"
+
+    duration_ms = (time.perf_counter() - start) * 1000.0
+
+    status_code = None
+    try:
+        status_code = int(response.get("statusCode"))  # type: ignore[arg-type]
+    except Exception:
+        # 念のため安全側に倒す
+        status_code = None
+
+    _log_invocation(
+        event,
+        context,
+        status_code,
+        duration_ms,
+        response_mode="buffered",
+        response_bytes=size,
+        error_code=error_code,
+        error_message=f"response is {size} bytes" if error_code else None,
+    )
+
     return response
 
+
+def _run_streamed(
+    mangum_handler: Mangum,
+    event: Dict[str, Any],
+    context: Any,
+    stream: ResponseStream,
+) -> Tuple[int, int]:
+    """Mangum でイベントを ASGI の scope に変換し、アプリの出力をそのままストリームに流す。"""
+    lambda_handler = mangum_handler.infer(event, context)
+    scope = lambda_handler.scope
+    with ExitStack() as stack:
+        if mangum_handler.lifespan in ("auto", "on"):
+            lifespan_cycle = LifespanCycle(mangum_handler.app, mangum_handler.lifespan)
+            stack.enter_context(lifespan_cycle)
+            scope.update({"state": lifespan_cycle.lifespan_state.copy()})
+        cycle = StreamingHTTPCycle(scope, lambda_handler.body, stream)
+        status_code = cycle(mangum_handler.app)
+    return status_code, cycle.body_bytes
+
+
+def stream_handler(event: Dict[str, Any], response_stream: ResponseStream, context: Any) -> None:
+    """
+    レスポンスストリーミング（Function URL の InvokeMode=RESPONSE_STREAM）用のエントリポイント。
+
+    - レスポンスの見積もりサイズが STREAM_THRESHOLD_BYTES 未満なら handler と同じ経路で実行し、
+      結果をまとめて書き込む（buffered）
+    - それ以上なら アプリの出力を受け取った順にチャンクで書き込む（streamed）。
+      同期呼び出しの 6MB 上限を受けない
+    - Python のマネージドランタイムはストリームを渡さないため、lambda_http/runtime.py の
+      Runtime API ループから呼び出す。ローカルでは LocalResponseStream を渡して確認できる
+    """
+    start = time.perf_counter()
+
+    mangum_handler = _create_mangum_handler(event)
+    if estimate_response_bytes(event) < STREAM_THRESHOLD_BYTES:
+        response = mangum_handler(event, context)
+        response_mode = "buffered"
+        response_bytes = write_buffered_response(response, response_stream)
+        status_code: Optional[int] = int(response.get("statusCode", 500))
+    else:
+        response_mode = "streamed"
+        status_code, response_bytes = _run_streamed(mangum_handler, event, context, response_stream)
+
+    duration_ms = (time.perf_counter() - start) * 1000.0
+    _log_invocation(
+        event,
+        context,
+        status_code,
+        duration_ms,
+        response_mode=response_mode,
+        response_bytes=response_bytes,
+    )
@@ -0,0 +1,234 @@
+# lambda_http/runtime.py
+"""
+Lambda Runtime API を直接呼び出すランタイムループ（レスポンスストリーミング用）。
+
+Python のマネージドランタイムはハンドラの戻り値をまとめて返すだけで、レスポンスストリームを渡さない。
+stream_handler を Function URL（InvokeMode=RESPONSE_STREAM）で使うには、このループをランタイムとして起動する。
+
+    # python3.x マネージドランタイム（ZIP）: ランタイムの代わりにこのループを起動する
+    AWS_LAMBDA_EXEC_WRAPPER=/var/task/stream_bootstrap
+
+    # コンテナイメージ
+    ENTRYPOINT ["python3", "-m", "lambda_http.runtime"]
+
+呼び出すハンドラは UTC_LAMBDA_STREAM_HANDLER（"モジュール.関数"）で指定する。
+ZIP では main.py がルートに置かれるため、既定値は "main.stream_handler"。
+
+1 回の呼び出しの流れ:
+- GET  /2018-06-01/runtime/invocation/next            でイベントを受け取る
+- POST /2018-06-01/runtime/invocation/{id}/response   に chunked で書き込む
+  （Lambda-Runtime-Function-Response-Mode: streaming）
+- 書き込み前に失敗したら /invocation/{id}/error、書き込み後に失敗したら
+  trailer（Lambda-Runtime-Function-Error-Type / -Body）でエラーを伝える
+"""
+from __future__ import annotations
+
+import base64
+import http.client
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("utc_lambda")
+
+RUNTIME_API_VERSION = "2018-06-01"
+
+STREAM_HANDLER = os.getenv("UTC_LAMBDA_STREAM_HANDLER", "main.stream_handler")
+
+StreamHandler = Callable[[Dict[str, Any], Any, Any], None]
+
+
+class LambdaContext:
+    """マネージドランタイムが渡す context と同じ属性を持つ呼び出しコンテキスト。"""
+
+    def __init__(self, request_id: str, deadline_ms: int, invoked_function_arn: Optional[str]) -> None:
+        self.aws_request_id = request_id
+        self.invoked_function_arn = invoked_function_arn
+        self.function_name = os.getenv("AWS_LAMBDA_FUNCTION_NAME")
+        self.function_version = os.getenv("AWS_LAMBDA_FUNCTION_VERSION")
+        self.memory_limit_in_mb = os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+        self.log_group_name = os.getenv("AWS_LAMBDA_LOG_GROUP_NAME")
+        self.log_stream_name = os.getenv("AWS_LAMBDA_LOG_STREAM_NAME")
+        self._deadline_ms = deadline_ms
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, self._deadline_ms - int(time.time() * 1000))
+
+
+def _error_payload(exc: BaseException) -> Dict[str, Any]:
+    return {
+        "errorMessage": str(exc),
+        "errorType": type(exc).__name__,
+        "stackTrace": traceback.format_exception(type(exc), exc, exc.__traceback__),
+    }
+
+
+class RuntimeResponseStream:
+    """
+    /invocation/{id}/response への chunked ストリーム（lambda_http.streaming.ResponseStream の実装）。
+    ヘッダは最初の書き込み（または close）で送るため、set_content_type はそれより前に呼ぶ。
+    """
+
+    def __init__(self, conn: http.client.HTTPConnection, request_id: str) -> None:
+        self._conn = conn
+        self._path = f"/{RUNTIME_API_VERSION}/runtime/invocation/{request_id}/response"
+        self.content_type = "application/octet-stream"
+        self.started = False
+        self.closed = False
+
+    def set_content_type(self, content_type: str) -> None:
+        if self.started:
+            raise RuntimeError("content type must be set before the first write")
+        self.content_type = content_type
+
+    def _start(self) -> None:
+        self.started = True
+        self._conn.putrequest("POST", self._path, skip_accept_encoding=True)
+        self._conn.putheader("Content-Type", self.content_type)
+        self._conn.putheader("Lambda-Runtime-Function-Response-Mode", "streaming")
+        self._conn.putheader("Transfer-Encoding", "chunked")
+        self._conn.putheader(
+            "Trailer", "Lambda-Runtime-Function-Error-Type, Lambda-Runtime-Function-Error-Body"
+        )
+        self._conn.endheaders()
+
+    def write(self, data: bytes) -> None:
+        if self.closed:
+            raise RuntimeError("write to a closed response stream")
+        if not self.started:
+            self._start()
+        if data:
+            self._conn.send(b"%x\r\n%s\r\n" % (len(data), bytes(data)))
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        """終端チャンクを送る。error があれば trailer に載せ、Lambda に失敗として記録させる。"""
+        if self.closed:
+            return
+        if not self.started:
+            self._start()
+        self.closed = True
+        trailers = b""
+        if error is not None:
+            body = base64.b64encode(json.dumps(_error_payload(error)).encode("utf-8"))
+            trailers = (
+                b"Lambda-Runtime-Function-Error-Type: "
+                + f"Runtime.{type(error).__name__}".encode("latin-1", "replace")
+                + b"\r\nLambda-Runtime-Function-Error-Body: "
+                + body
+                + b"\r\n"
+            )
+        self._conn.send(b"0\r\n" + trailers + b"\r\n")
+        response = self._conn.getresponse()
+        response.read()
+        if response.status >= 300:
+            logger.error("runtime API rejected the streamed response: %d", response.status)
+
+
+class RuntimeClient:
+    """Runtime API（AWS_LAMBDA_RUNTIME_API）の薄いクライアント。呼び出しごとに接続を張り直す。"""
+
+    def __init__(self, address: str) -> None:
+        host, _, port = address.rpartition(":")
+        self.host = host or address
+        self.port = int(port) if host else 80
+
+    def _connect(self, timeout: Optional[float] = None) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def next_invocation(self) -> Tuple[Dict[str, Any], LambdaContext]:
+        # 次の呼び出しが来るまで待つため、タイムアウトは付けない
+        conn = self._connect()
+        try:
+            conn.request("GET", f"/{RUNTIME_API_VERSION}/runtime/invocation/next")
+            response = conn.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise RuntimeError(f"runtime API returned {response.status} for the next invocation")
+            trace_id = response.getheader("Lambda-Runtime-Trace-Id")
+            if trace_id:
+                os.environ["_X_AMZN_TRACE_ID"] = trace_id
+            context = LambdaContext(
+                response.getheader("Lambda-Runtime-Aws-Request-Id", ""),
+                int(response.getheader("Lambda-Runtime-Deadline-Ms", "0")),
+                response.getheader("Lambda-Runtime-Invoked-Function-Arn"),
+            )
+        finally:
+            conn.close()
+        return json.loads(body), context
+
+    def response_stream(self, request_id: str) -> Tuple[http.client.HTTPConnection, RuntimeResponseStream]:
+        conn = self._connect()
+        return conn, RuntimeResponseStream(conn, request_id)
+
+    def post_error(self, path: str, exc: BaseException) -> None:
+        conn = self._connect(timeout=10)
+        try:
+            conn.request(
+                "POST",
+                f"/{RUNTIME_API_VERSION}/runtime/{path}",
+                body=json.dumps(_error_payload(exc)),
+                headers={
+                    "Content-Type": "application/json",
+                    "Lambda-Runtime-Function-Error-Type": f"Runtime.{type(exc).__name__}",
+                },
+            )
+            conn.getresponse().read()
+        finally:
+            conn.close()
+
+
+def load_handler(spec: str) -> StreamHandler:
+    module_name, _, attr = spec.rpartition(".")
+    if not module_name:
+        raise ValueError(f"handler must be 'module.function': {spec!r}")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def handle_one(client: RuntimeClient, handler: StreamHandler) -> None:
+    """呼び出しを 1 件受け取り、ハンドラに Runtime API へのストリームを渡して実行する。"""
+    event, context = client.next_invocation()
+    request_id = context.aws_request_id
+    conn, stream = client.response_stream(request_id)
+    try:
+        try:
+            handler(event, stream, context)
+        except Exception as exc:
+            logger.exception("stream handler failed")
+            if not stream.started:
+                client.post_error(f"invocation/{request_id}/error", exc)
+            elif not stream.closed:
+                # ステータスは prelude で送り済みのため、trailer で失敗を伝えて打ち切る
+                stream.close(error=exc)
+            return
+        if not stream.closed:
+            stream.close()
+    finally:
+        conn.close()
+
+
+def main(argv: Optional[list] = None) -> int:
+    address = os.environ["AWS_LAMBDA_RUNTIME_API"]
+    client = RuntimeClient(address)
+    spec = (argv or sys.argv[1:] or [STREAM_HANDLER])[0]
+
+    task_root = os.getenv("LAMBDA_TASK_ROOT")
+    if task_root and task_root not in sys.path:
+        sys.path.insert(0, task_root)
+    try:
+        handler = load_handler(spec)
+    except Exception as exc:
+        logger.exception("failed to import %s", spec)
+        client.post_error("init/error", exc)
+        return 1
+
+    while True:
+        handle_one(client, handler)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,266 @@
+# lambda_http/streaming.py
+"""
+Lambda のレスポンスストリーミング（Function URL の InvokeMode=RESPONSE_STREAM）用の部品。
+
+ストリーミング呼び出しでは、ハンドラは戻り値ではなくレスポンスストリームに書き込む。
+HTTP として返す場合の形式は
+
+    Content-Type: application/vnd.awslambda.http-integration-response
+    {"statusCode": 200, "headers": {...}, "cookies": [...]}   ← JSON の prelude
+    \\x00 * 8                                                  ← 区切り
+    <レスポンス本文>
+
+- ResponseStream: ランタイムが渡すストリームに求めるインタフェース
+- LocalResponseStream: テスト・ローカル実行用の代替（書き込みを記録し、prelude と本文に分解できる）
+- StreamingHTTPCycle: ASGI アプリの http.response.* をそのままストリームに流す
+  （Mangum の HTTPCycle は本文を最後までバッファするため、ストリーミング経路ではこちらを使う）
+- estimate_response_bytes: リクエストからレスポンスサイズの上限を見積もる（経路の選択に使う）
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Protocol, Tuple
+
+from mangum.types import ASGI, Message, Scope
+
+logger = logging.getLogger("utc_lambda")
+
+# === 設定値（環境変数で上書き可能） ==========================================
+
+# 見積もりサイズがこれ以上ならストリーミング経路で返す。
+# 現在の入力上限（10 万文字）では offsets を付けても結果は数百 KB のため、それに合わせた値にしている
+STREAM_THRESHOLD_BYTES = int(os.getenv("UTC_LAMBDA_STREAM_THRESHOLD_BYTES", str(256 * 1024)))
+
+# ストリーミング経路で 1 回に書き込む本文の大きさ
+STREAM_CHUNK_BYTES = int(os.getenv("UTC_LAMBDA_STREAM_CHUNK_BYTES", str(64 * 1024)))
+
+# 同期（バッファ）呼び出しのレスポンス上限。Lambda の制限は JSON にした呼び出し結果全体で 6MB
+MAX_BUFFERED_RESPONSE_BYTES = int(
+    os.getenv("UTC_LAMBDA_MAX_RESPONSE_BYTES", str(6 * 1024 * 1024))
+)
+
+HTTP_INTEGRATION_CONTENT_TYPE = "application/vnd.awslambda.http-integration-response"
+PRELUDE_DELIMITER = b"\x00" * 8
+
+# レスポンス本文の見積もり（バイト）。
+# 通常の結果は数百バイト程度で、入力に比例して大きくなるのは token_offsets_delta と
+# span_token_counts だけ。offsets は 1 トークンあたり "n," の数バイトで、
+# 最悪でも入力 1 バイトあたり 2 バイト程度に収まる
+_BASE_RESPONSE_BYTES = 4 * 1024
+_OFFSETS_BYTES_PER_BODY_BYTE = 2
+# 圧縮された本文は中身を見ずに、展開後をこの倍率で見込む
+_COMPRESSED_BODY_RATIO = 8
+
+_RETURN_OFFSETS = re.compile(rb'"return_offsets"\s*:\s*true')
+_SPANS = re.compile(rb'"spans"\s*:\s*\[')
+
+
+class ResponseStream(Protocol):
+    """ストリーミング呼び出しでランタイムが渡すレスポンスストリーム。"""
+
+    def set_content_type(self, content_type: str) -> None:
+        ...
+
+    def write(self, data: bytes) -> None:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class LocalResponseStream:
+    """
+    テスト・ローカル実行用の ResponseStream。
+    書き込みをチャンク単位で記録し、最初の書き込みまでの時間も残す。
+    """
+
+    def __init__(self) -> None:
+        self.content_type: Optional[str] = None
+        self.chunks: List[bytes] = []
+        self.closed = False
+        self._opened_at = time.perf_counter()
+        self.first_write_ms: Optional[float] = None
+
+    def set_content_type(self, content_type: str) -> None:
+        if self.chunks:
+            raise RuntimeError("content type must be set before the first write")
+        self.content_type = content_type
+
+    def write(self, data: bytes) -> None:
+        if self.closed:
+            raise RuntimeError("write to a closed response stream")
+        if self.first_write_ms is None:
+            self.first_write_ms = (time.perf_counter() - self._opened_at) * 1000.0
+        self.chunks.append(bytes(data))
+
+    def close(self) -> None:
+        self.closed = True
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.chunks)
+
+    def parse(self) -> Tuple[Dict[str, Any], bytes]:
+        """書き込まれた内容を (prelude, 本文) に分解する。"""
+        prelude, sep, body = self.getvalue().partition(PRELUDE_DELIMITER)
+        if not sep:
+            raise ValueError("prelude delimiter not found")
+        return json.loads(prelude), body
+
+
+def encode_prelude(status: int, headers: Dict[str, str], cookies: List[str]) -> bytes:
+    prelude: Dict[str, Any] = {"statusCode": status, "headers": headers}
+    if cookies:
+        prelude["cookies"] = cookies
+    return json.dumps(prelude).encode("utf-8") + PRELUDE_DELIMITER
+
+
+def split_asgi_headers(raw_headers: List[Tuple[bytes, bytes]]) -> Tuple[Dict[str, str], List[str]]:
+    """ASGI のヘッダを (ヘッダ dict, cookies) に分ける。同名ヘッダは "," で連結する。"""
+    headers: Dict[str, str] = {}
+    cookies: List[str] = []
+    for name, value in raw_headers:
+        key = name.decode("latin-1").lower()
+        text = value.decode("latin-1")
+        if key == "set-cookie":
+            cookies.append(text)
+        elif key in headers:
+            headers[key] = f"{headers[key]},{text}"
+        else:
+            headers[key] = text
+    return headers, cookies
+
+
+def write_buffered_response(response: Dict[str, Any], stream: ResponseStream) -> int:
+    """Mangum が返したレスポンス dict を prelude + 本文としてストリームに書き込み、本文のバイト数を返す。"""
+    headers = {k.lower(): str(v) for k, v in (response.get("headers") or {}).items()}
+    for key, values in (response.get("multiValueHeaders") or {}).items():
+        headers[key.lower()] = ",".join(str(v) for v in values)
+    cookies = list(response.get("cookies") or [])
+    if "set-cookie" in headers:
+        cookies.append(headers.pop("set-cookie"))
+
+    body = response.get("body") or ""
+    if response.get("isBase64Encoded"):
+        data = base64.b64decode(body)
+    else:
+        data = body.encode("utf-8") if isinstance(body, str) else bytes(body)
+
+    stream.set_content_type(HTTP_INTEGRATION_CONTENT_TYPE)
+    stream.write(encode_prelude(int(response.get("statusCode", 500)), headers, cookies))
+    if data:
+        stream.write(data)
+    stream.close()
+    return len(data)
+
+
+class StreamingHTTPCycle:
+    """
+    ASGI アプリを 1 リクエスト分実行し、レスポンスをストリームへ逐次書き込む。
+    http.response.start で prelude を書き、本文は STREAM_CHUNK_BYTES ごとに書く。
+    """
+
+    def __init__(
+        self,
+        scope: Scope,
+        body: bytes,
+        stream: ResponseStream,
+        chunk_bytes: int = STREAM_CHUNK_BYTES,
+    ) -> None:
+        self.scope = scope
+        self.stream = stream
+        self.chunk_bytes = max(1, chunk_bytes)
+        self.status: Optional[int] = None
+        self.body_bytes = 0
+        self.complete = False
+        self._app_queue: "asyncio.Queue[Message]" = asyncio.Queue()
+        self._app_queue.put_nowait({"type": "http.request", "body": body, "more_body": False})
+
+    def __call__(self, app: ASGI) -> int:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.run(app))
+        return self.status or 500
+
+    async def run(self, app: ASGI) -> None:
+        try:
+            await app(self.scope, self.receive, self.send)
+        except BaseException:
+            logger.exception("An error occurred running the application.")
+            if self.status is None:
+                await self.send(
+                    {
+                        "type": "http.response.start",
+                        "status": 500,
+                        "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+                    }
+                )
+                await self.send({"type": "http.response.body", "body": b"Internal Server Error"})
+            # prelude を書いた後はステータスを変えられないため、途中で打ち切る
+        finally:
+            self.stream.close()
+
+    async def receive(self) -> Message:
+        return await self._app_queue.get()
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start" and self.status is None:
+            self.status = int(message["status"])
+            headers, cookies = split_asgi_headers(list(message.get("headers", [])))
+            # 本文の長さは prelude の時点では確定させない（ストリームの終端で決まる）
+            headers.pop("content-length", None)
+            self.stream.set_content_type(HTTP_INTEGRATION_CONTENT_TYPE)
+            self.stream.write(encode_prelude(self.status, headers, cookies))
+        elif message["type"] == "http.response.body" and self.status is not None and not self.complete:
+            body = message.get("body", b"")
+            for start in range(0, len(body), self.chunk_bytes):
+                self.stream.write(body[start : start + self.chunk_bytes])
+            self.body_bytes += len(body)
+            if not message.get("more_body", False):
+                self.complete = True
+                await self._app_queue.put({"type": "http.disconnect"})
+        else:
+            raise RuntimeError(f"Unexpected {message['type']}")
+
+
+def _event_body(event: Dict[str, Any]) -> bytes:
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        try:
+            return base64.b64decode(body)
+        except ValueError:
+            return b""
+    return body.encode("utf-8") if isinstance(body, str) else bytes(body)
+
+
+def estimate_response_bytes(event: Dict[str, Any]) -> int:
+    """
+    レスポンス本文の大きさの上限を、リクエストを解析せずに見積もる。
+    offsets / spans を要求していなければ固定の小さな値、要求していればリクエスト本文に比例する。
+    """
+    body = _event_body(event)
+    headers = {str(k).lower(): v for k, v in (event.get("headers") or {}).items()}
+    encoding = str(headers.get("content-encoding", "")).strip().lower()
+
+    if encoding not in ("", "identity"):
+        # 圧縮本文は中を見られないので、offsets を要求しているものとして見込む
+        return _BASE_RESPONSE_BYTES + len(body) * _COMPRESSED_BODY_RATIO * _OFFSETS_BYTES_PER_BODY_BYTE
+    if _RETURN_OFFSETS.search(body):
+        return _BASE_RESPONSE_BYTES + len(body) * _OFFSETS_BYTES_PER_BODY_BYTE
+    if _SPANS.search(body):
+        # span ごとの件数は spans の指定そのものより短い
+        return _BASE_RESPONSE_BYTES + len(body)
+    return _BASE_RESPONSE_BYTES
+
+
+def buffered_response_bytes(response: Dict[str, Any]) -> int:
+    """同期呼び出しの結果として返す JSON の大きさ（本文が小さいときは直列化を省く）。"""
+    body = response.get("body") or ""
+    # 直列化で本文は最大 6 倍（非 ASCII 文字の \uXXXX）になり、本文以外は数 KB に収まる
+    if len(body) * 6 + 64 * 1024 < MAX_BUFFERED_RESPONSE_BYTES:
+        return len(body)
+    return len(json.dumps(response).encode("utf-8"))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+リクエスト圧縮（gzip / zstd）の効果を計測する。
+
+上限付近（約 512KB）の英語 / 日本語 / コードのペイロードについて、
+- 圧縮後サイズと圧縮率
+- クライアント側の圧縮時間、サーバ側（RequestDecompressionMiddleware）の展開時間
+- 帯域ごとの送信時間を足した、エンドツーエンドの推定時間
+を非圧縮と比較する。
+
+    python scripts/bench_compression.py --mbps 10 100 1000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.fastapi_app.compression import RequestDecompressionMiddleware  # noqa: E402
+from core.token_counter import MAX_CHAR_COUNT  # noqa: E402
+
+
+def _codecs() -> Dict[str, Callable[[bytes], bytes]]:
+    codecs: Dict[str, Callable[[bytes], bytes]] = {"gzip": lambda data: gzip.compress(data, 6)}
+    try:
+        from compression import zstd
+
+        codecs["zstd"] = lambda data: zstd.compress(data, 3)
+    except ImportError:
+        try:
+            import zstandard
+
+            codecs["zstd"] = zstandard.ZstdCompressor(level=3).compress
+        except ImportError:
+            pass
+    return codecs
+
+
+def _text(rng: random.Random, words: List[str], sep: str) -> str:
+    parts: List[str] = []
+    size = 0
+    while size < MAX_CHAR_COUNT:
+        word = rng.choice(words)
+        parts.append(word)
+        size += len(word) + len(sep)
+    return sep.join(parts)
+
+
+def _payloads() -> List[Tuple[str, bytes]]:
+    rng = random.Random(0)
+    english = _text(rng, ("token count prompt model budget context window request the a of to "
+                          "and in is for with that measure before sending document limit").split(), " ")
+    japanese = _text(rng, ["トークン", "数", "を", "事前", "に", "確認", "する", "ため", "の", "日本語",
+                           "文章", "です", "。", "モデル", "入力", "上限", "、"], "")
+    code = _text(rng, ["def ", "return ", "self.", "count", "(text)", ": ", "\n    ", "model",
+                       " = ", "encode", "[i]", "for ", "in ", "range(n)", "\n"], "")
+    return [
+        (name, json.dumps({"model": "gpt-4o", "text": text[:MAX_CHAR_COUNT]}).encode())
+        for name, text in (("english", english), ("japanese", japanese), ("code", code))
+    ]
+
+
+async def _server_decompress_ms(body: bytes, encoding: str, repeat: int = 20) -> float:
+    """middleware 単体で展開にかかる時間（後段アプリは本文を読むだけ）。"""
+
+    async def sink(scope, receive, send):
+        await receive()
+
+    middleware = RequestDecompressionMiddleware(sink)
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/utc/v0/token-count",
+        "query_string": b"",
+        "headers": [(b"content-encoding", encoding.encode())],
+    }
+    chunks = [body[i : i + 65536] for i in range(0, len(body), 65536)] or [b""]
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        queue = list(chunks)
+
+        async def receive():
+            chunk = queue.pop(0)
+            return {"type": "http.request", "body": chunk, "more_body": bool(queue)}
+
+        async def send(message):
+            pass
+
+        await middleware(scope, receive, send)
+    return (time.perf_counter() - started) / repeat * 1000.0
+
+
+def _time_ms(fn: Callable[[], bytes], repeat: int = 20) -> Tuple[bytes, float]:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return out, (time.perf_counter() - started) / repeat * 1000.0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mbps", type=float, nargs="+", default=[10.0, 100.0, 1000.0])
+    args = parser.parse_args()
+
+    codecs = _codecs()
+    header = f"{'payload':<10}{'codec':<6}{'bytes':>9}{'ratio':>7}{'comp_ms':>9}{'decomp_ms':>10}"
+    header += "".join(f"{f'e2e@{m:g}Mbps':>15}" for m in args.mbps)
+    print(header)
+
+    for name, raw in _payloads():
+        rows = [("none", raw, 0.0, 0.0)]
+        for codec, compress in codecs.items():
+            compressed, comp_ms = _time_ms(lambda: compress(raw))
+            decomp_ms = asyncio.run(_server_decompress_ms(compressed, codec))
+            rows.append((codec, compressed, comp_ms, decomp_ms))
+
+        for codec, body, comp_ms, decomp_ms in rows:
+            line = (
+                f"{name:<10}{codec:<6}{len(body):>9}{len(raw) / len(body):>7.1f}"
+                f"{comp_ms:>9.2f}{decomp_ms:>10.2f}"
+            )
+            for mbps in args.mbps:
+                transfer_ms = len(body) * 8 / (mbps * 1e6) * 1000.0
+                line += f"{comp_ms + transfer_ms + decomp_ms:>13.1f}ms"
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
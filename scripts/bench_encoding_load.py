@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+encoding の読み込みコストを計測する。
+
+- cold load: 新しいプロセスで SUPPORTED_MODELS の encoding を読み込むまでの時間と RSS 増分
+- workers:   親で読み込んだあと fork した N ワーカーの RSS / PSS / Private_Dirty
+
+tiktoken の通常経路（キャッシュ済み BPE ファイル）と、オフラインバンドル（.utcbpe）を比較する。
+
+    python scripts/bench_encoding_load.py --bundle-dir encodings --workers 4
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _proc_status_kb(pid: str, field: str) -> int:
+    with open(f"/proc/{pid}/status") as fp:
+        for line in fp:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _smaps_rollup_kb(pid: int) -> Dict[str, int]:
+    values: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as fp:
+            for line in fp:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].rstrip(":") in ("Rss", "Pss", "Private_Dirty"):
+                    values[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        pass
+    return values
+
+
+def _child(mode: str, names: List[str], workers: int) -> None:
+    """計測対象プロセス本体。結果を 1 行 JSON で標準出力に書く。"""
+    sys.path.insert(0, PROJECT_ROOT)
+    import tiktoken
+
+    from core import encoding_bundle
+
+    rss_before = _proc_status_kb("self", "VmRSS")
+    started = time.perf_counter()
+    for name in names:
+        if mode == "bundle":
+            if not os.path.exists(encoding_bundle.bundle_path(name)):
+                raise SystemExit(f"bundle not found: {encoding_bundle.bundle_path(name)}")
+            encoding_bundle.get_encoding(name)
+        else:
+            tiktoken.get_encoding(name)
+    load_ms = (time.perf_counter() - started) * 1000.0
+    rss_after = _proc_status_kb("self", "VmRSS")
+
+    # 親で読み込んだ状態を fork で引き継いだワーカーのメモリを計測する
+    import gc
+
+    gc.freeze()
+    pids = []
+    read_fds = []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            for name in names:
+                encoder = (
+                    encoding_bundle.get_encoding(name)
+                    if mode == "bundle"
+                    else tiktoken.get_encoding(name)
+                )
+                encoder.encode("warm up the worker " * 10)
+            os.write(write_fd, b"x")
+            time.sleep(2.0)
+            os._exit(0)
+        os.close(write_fd)
+        pids.append(pid)
+        read_fds.append(read_fd)
+
+    for fd in read_fds:
+        os.read(fd, 1)
+        os.close(fd)
+    worker_mem = [_smaps_rollup_kb(pid) for pid in pids]
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+    print(
+        json.dumps(
+            {
+                "mode": mode,
+                "cold_load_ms": round(load_ms, 1),
+                "rss_delta_kb": rss_after - rss_before,
+                "workers": worker_mem,
+            }
+        )
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--bundle-dir", default=os.path.join(PROJECT_ROOT, "encodings"))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--child", choices=["tiktoken", "bundle"], help=argparse.SUPPRESS)
+    parser.add_argument("encodings", nargs="*")
+    args = parser.parse_args()
+
+    sys.path.insert(0, PROJECT_ROOT)
+    if not args.encodings:
+        from core.token_counter import SUPPORTED_MODELS
+
+        args.encodings = sorted(set(SUPPORTED_MODELS.values()))
+
+    if args.child:
+        _child(args.child, args.encodings, args.workers)
+        return 0
+
+    env = dict(os.environ, UTC_ENCODING_BUNDLE_DIR=args.bundle_dir)
+    print(f"{'mode':<10}{'cold_load_ms':>14}{'rss_delta_MB':>14}{'worker_pss_MB':>15}{'worker_priv_MB':>16}")
+    for mode in ("tiktoken", "bundle"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", mode, "--workers", str(args.workers), *args.encodings],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        data = json.loads(out.strip().splitlines()[-1])
+        workers = data["workers"] or [{}]
+        pss = sum(w.get("Pss", 0) for w in workers) / len(workers) / 1024
+        priv = sum(w.get("Private_Dirty", 0) for w in workers) / len(workers) / 1024
+        print(
+            f"{mode:<10}{data['cold_load_ms']:>14}{data['rss_delta_kb'] / 1024:>14.1f}"
+            f"{pss:>15.1f}{priv:>16.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+accuracy="estimate" の精度と速度を計測する。
+
+英語 / 日本語 / 混在 / コード寄りのテキストを生成し、全文 encode と推定を比較する。
+encoding は core.encoding_bundle 経由で読み込む（バンドルが無ければ tiktoken の通常経路）。
+
+    python scripts/bench_estimate.py --chars 2000000 --trials 5 --model gpt-4o
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.estimate import estimate_token_count  # noqa: E402
+from core.token_counter import tokenizer_registry, utf8_length  # noqa: E402
+
+_EN = "the of and to in is that for it as was with be by on not he this are or his from".split()
+_JA = ["日本語", "の", "文章", "を", "処理", "する", "ため", "に", "テキスト", "は", "です", "。"]
+_CODE = ["def ", "return ", "self.", "(x)", ": ", "\n    ", "for i in range(n)", " = ", "# note\n"]
+
+
+def _generate(rng: random.Random, chars: int, weights: Dict[str, float]) -> str:
+    vocab = {"en": _EN, "ja": _JA, "code": _CODE}
+    kinds = list(weights)
+    parts: List[str] = []
+    size = 0
+    while size < chars:
+        kind = rng.choices(kinds, [weights[k] for k in kinds])[0]
+        sep = " " if kind == "en" else ""
+        paragraph = sep.join(rng.choice(vocab[kind]) for _ in range(rng.randint(20, 200))) + "\n"
+        parts.append(paragraph)
+        size += len(paragraph)
+    return "".join(parts)
+
+
+def _timed(fn: Callable[[], int]) -> tuple:
+    started = time.perf_counter()
+    value = fn()
+    return value, (time.perf_counter() - started) * 1000.0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--chars", type=int, default=2_000_000)
+    parser.add_argument("--trials", type=int, default=5)
+    args = parser.parse_args()
+
+    backend = tokenizer_registry.get(args.model)
+    rng = random.Random(0)
+    mixes = {
+        "en": {"en": 1.0},
+        "ja": {"ja": 1.0},
+        "mixed": {"en": 0.4, "ja": 0.4, "code": 0.2},
+        "code": {"code": 0.8, "en": 0.2},
+    }
+
+    print(f"{'text':<8}{'max_err_%':>10}{'ci_cover':>10}{'exact_ms':>10}{'est_ms':>9}{'speedup':>9}")
+    for name, weights in mixes.items():
+        errors, covered, exact_ms, est_ms = [], 0, 0.0, 0.0
+        for _ in range(args.trials):
+            text = _generate(rng, args.chars, weights)
+            exact, ms = _timed(lambda: backend.count(text))
+            exact_ms += ms
+            estimate, ms = _timed(lambda: estimate_token_count(backend, text, utf8_length(text)))
+            est_ms += ms
+            errors.append(abs(estimate["estimate"] - exact) / exact * 100)
+            covered += estimate["ci_low"] <= exact <= estimate["ci_high"]
+        print(
+            f"{name:<8}{max(errors):>10.2f}{covered:>7}/{args.trials:<2}"
+            f"{exact_ms / args.trials:>10.0f}{est_ms / args.trials:>9.1f}{exact_ms / est_ms:>9.1f}x"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
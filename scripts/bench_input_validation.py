@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+入力サイズ検証のマイクロベンチマーク。
+
+従来の `text.strip() == ""` + `len(text.encode("utf-8"))` と、
+core.token_counter の `_is_blank` + `validate_text_size` を、
+上限付近の ASCII / CJK / 混在テキストと、上限超過テキストで比較する。
+
+    python scripts/bench_input_validation.py
+"""
+from __future__ import annotations
+
+import os
+import sys
+import timeit
+import tracemalloc
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.token_counter import (  # noqa: E402
+    MAX_BYTES,
+    MAX_CHAR_COUNT,
+    UtcError,
+    _is_blank,
+    validate_text_size,
+)
+
+
+def legacy(text: str) -> None:
+    if text.strip() == "":
+        return
+    char_count = len(text)
+    input_size_bytes = len(text.encode("utf-8"))
+    if char_count > MAX_CHAR_COUNT or input_size_bytes > MAX_BYTES:
+        return
+
+
+def current(text: str) -> None:
+    if _is_blank(text):
+        return
+    try:
+        validate_text_size(text)
+    except UtcError:
+        return
+
+
+def _measure(fn: Callable[[str], None], text: str, number: int) -> Tuple[float, int]:
+    per_call_us = timeit.timeit(lambda: fn(text), number=number) / number * 1e6
+    tracemalloc.start()
+    fn(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return per_call_us, peak
+
+
+def main() -> int:
+    cases: List[Tuple[str, str]] = [
+        ("ascii 100k chars", "a" * MAX_CHAR_COUNT),
+        ("cjk 100k chars (300KB)", "あ" * MAX_CHAR_COUNT),
+        ("mixed 100k chars", ("hello 世界 " * MAX_CHAR_COUNT)[:MAX_CHAR_COUNT]),
+        # 上限超過（文字数で判定でき、バイト長を数える前に拒否される）
+        ("oversize emoji", "😀" * (MAX_BYTES // 4 + 1)),
+        ("trailing whitespace", "a" + " " * (MAX_CHAR_COUNT - 1)),
+    ]
+
+    print(f"{'case':<26}{'legacy_us':>12}{'new_us':>10}{'legacy_peak_B':>16}{'new_peak_B':>12}")
+    for name, text in cases:
+        legacy_us, legacy_peak = _measure(legacy, text, 200)
+        new_us, new_peak = _measure(current, text, 200)
+        print(f"{name:<26}{legacy_us:>12.1f}{new_us:>10.1f}{legacy_peak:>16}{new_peak:>12}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""
+tiktoken encoding のオフラインバンドル（.utcbpe）を書き出す。
+
+ビルド環境で一度だけ tiktoken から BPE ファイルを取得し、core.encoding_bundle の形式で保存する。
+（CLI を core パッケージの外に置くのは、python -m core.encoding_bundle だと
+core の import 時に同じモジュールが先に読み込まれ、runpy が RuntimeWarning を出すため）
+
+    python scripts/build_encoding_bundles.py                                 # SUPPORTED_MODELS の全 encoding → ./encodings/
+    python scripts/build_encoding_bundles.py --out /opt/enc cl100k_base o200k_base
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.encoding_bundle import BUNDLE_DIR, build_bundles, bundle_path  # noqa: E402
+from core.token_counter import SUPPORTED_MODELS  # noqa: E402
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build offline tiktoken encoding bundles.")
+    parser.add_argument("--out", default=BUNDLE_DIR, help="output directory")
+    parser.add_argument(
+        "encodings",
+        nargs="*",
+        help="encoding names (default: every encoding in SUPPORTED_MODELS)",
+    )
+
+    args = parser.parse_args(argv)
+    names = args.encodings or sorted(set(SUPPORTED_MODELS.values()))
+    for name, size in build_bundles(names, args.out).items():
+        print(f"{name}\t{size} bytes\t{bundle_path(name, args.out)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
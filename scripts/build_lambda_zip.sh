@@ -18,8 +18,19 @@ echo "[3] Copy source code"
 cp -r "${PROJECT_ROOT}/core" "${BUILD_DIR}/core"
 cp -r "${PROJECT_ROOT}/backend" "${BUILD_DIR}/backend"
 cp "${LAMBDA_DIR}/main.py" "${BUILD_DIR}/main.py"
-
-echo "[4] Create deployment ZIP"
+# main.py は lambda_http.streaming を import するため、パッケージとしても同梱する
+mkdir -p "${BUILD_DIR}/lambda_http"
+cp "${LAMBDA_DIR}/streaming.py" "${BUILD_DIR}/lambda_http/streaming.py"
+# ストリーミング用のランタイムループと、それを起動する AWS_LAMBDA_EXEC_WRAPPER
+cp "${LAMBDA_DIR}/runtime.py" "${BUILD_DIR}/lambda_http/runtime.py"
+cp "${LAMBDA_DIR}/stream_bootstrap" "${BUILD_DIR}/stream_bootstrap"
+chmod +x "${BUILD_DIR}/stream_bootstrap"
+
+echo "[4] Bundle tiktoken encodings for offline loading"
+# ビルド環境で一度だけ BPE ファイルを取得し、オフラインのバンドル形式で ZIP に同梱する
+PYTHONPATH="${BUILD_DIR}" python "${PROJECT_ROOT}/scripts/build_encoding_bundles.py" --out "${BUILD_DIR}/encodings"
+
+echo "[5] Create deployment ZIP"
 (
   cd "${BUILD_DIR}"
   zip -r ../deployment.zip .
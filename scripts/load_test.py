@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+POST /utc/v0/token-count の負荷試験。
+
+ワーカー数を変えてサーバを起動し、スループットとレイテンシがコア数に対して
+どこまで線形に伸びるかを確認する（負荷生成側も複数プロセスで動かす）。
+
+    python scripts/load_test.py --workers 1 2 4 --duration 10 --concurrency 64
+    python scripts/load_test.py --url http://127.0.0.1:8000 --duration 10   # 起動済みのサーバに対して
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_TEXT = (
+    "Universal Token Counter measures prompts before they are sent. "
+    "これはトークン数を数えるための日本語の文章です。 "
+) * 8
+
+
+async def _client(
+    url: str, concurrency: int, duration_s: float, model: str
+) -> Tuple[List[float], Dict[str, int]]:
+    """(200 のレイテンシ, 200 以外のステータス・例外ごとの件数) を返す。"""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    deadline = time.perf_counter() + duration_s
+    payload = {"model": model, "text": _TEXT}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0) as client:
+
+        async def loop() -> None:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    res = await client.post("/utc/v0/token-count", json=payload)
+                except httpx.HTTPError as exc:
+                    key = type(exc).__name__
+                else:
+                    if res.status_code == 200:
+                        latencies.append(time.perf_counter() - started)
+                        continue
+                    # admission control の 503 なども捨てずに数える
+                    key = str(res.status_code)
+                errors[key] = errors.get(key, 0) + 1
+
+        await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def _client_process(args: tuple) -> Tuple[List[float], Dict[str, int]]:
+    return asyncio.run(_client(*args))
+
+
+def run_load(url: str, *, clients: int, concurrency: int, duration_s: float, model: str) -> Dict[str, Any]:
+    per_client = max(1, concurrency // clients)
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(
+            _client_process, [(url, per_client, duration_s, model)] * clients
+        )
+    latencies = sorted(lat for result, _ in results for lat in result)
+    errors: Dict[str, int] = {}
+    for _, client_errors in results:
+        for key, count in client_errors.items():
+            errors[key] = errors.get(key, 0) + count
+    stats: Dict[str, Any] = {"rps": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "errors": errors}
+    if latencies:
+        stats.update(
+            rps=len(latencies) / duration_s,
+            p50_ms=latencies[len(latencies) // 2] * 1000.0,
+            p99_ms=latencies[int(len(latencies) * 0.99)] * 1000.0,
+        )
+    return stats
+
+
+def _format_errors(errors: Dict[str, int]) -> str:
+    return " ".join(f"{key}x{count}" for key, count in sorted(errors.items())) or "-"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(workers: int, port: int) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "backend.fastapi_app.server",
+            "--workers",
+            str(workers),
+            "--port",
+            str(port),
+        ],
+        cwd=PROJECT_ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1.0).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("server did not become healthy")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="target an already running server instead of starting one")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--model", default="gpt-4o")
+    args = parser.parse_args()
+
+    options = dict(
+        clients=args.clients, concurrency=args.concurrency, duration_s=args.duration, model=args.model
+    )
+
+    if args.url:
+        stats = run_load(args.url, **options)
+        print(
+            f"rps={stats['rps']:.0f} p50={stats['p50_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms "
+            f"errors={_format_errors(stats['errors'])}"
+        )
+        return 0
+
+    print(f"{'workers':>8}{'rps':>10}{'p50_ms':>10}{'p99_ms':>10}{'scaling':>10}  errors")
+    baseline: Optional[float] = None
+    for workers in args.workers:
+        port = _free_port()
+        proc = _start_server(workers, port)
+        try:
+            run_load(f"http://127.0.0.1:{port}", **dict(options, duration_s=1.0))  # ウォームアップ
+            stats = run_load(f"http://127.0.0.1:{port}", **options)
+        finally:
+            proc.terminate()
+            proc.wait()
+        if baseline is None:
+            baseline = stats["rps"] / workers
+        scaling = stats["rps"] / (baseline * workers) if baseline else 0.0
+        print(
+            f"{workers:>8}{stats['rps']:>10.0f}{stats['p50_ms']:>10.1f}"
+            f"{stats['p99_ms']:>10.1f}{scaling:>9.0%}  {_format_errors(stats['errors'])}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -10,3 +10,43 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
+
+
+import pytest
+import tiktoken
+
+# cl100k_base と同じ分割パターン
+_CL100K_PAT_STR = (
+    r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|\p{N}{1,3}+| ?[^\s\p{L}\p{N}]++[\r\n]*+|\s++$|\s*[\r\n]|\s+(?!\S)|\s"""
+)
+
+
+def build_offline_encoding(name: str = "cl100k_base") -> tiktoken.Encoding:
+    """
+    BPE ファイルをダウンロードせずに使える小さな encoding。
+    バイト単位の 256 トークンに数個のマージを足しただけなので、
+    トークン数の絶対値ではなく「実 encoding と同じ経路で数えられるか」の検証に使う。
+    """
+    ranks = {bytes([i]): i for i in range(256)}
+    for merged in (b"  ", b"th", b"the", b" t", b" the", b"\n\n", b"in", b"ing"):
+        ranks[merged] = len(ranks)
+    return tiktoken.Encoding(
+        name,
+        pat_str=_CL100K_PAT_STR,
+        mergeable_ranks=ranks,
+        special_tokens={"<|endoftext|>": len(ranks)},
+    )
+
+
+@pytest.fixture
+def offline_encoding(monkeypatch):
+    """tiktoken.get_encoding をオフライン encoding に差し替える。"""
+    encodings = {}
+
+    def fake_get_encoding(name: str) -> tiktoken.Encoding:
+        if name not in encodings:
+            encodings[name] = build_offline_encoding(name)
+        return encodings[name]
+
+    monkeypatch.setattr(tiktoken, "get_encoding", fake_get_encoding)
+    return fake_get_encoding
@@ -0,0 +1,150 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import backend.fastapi_app.admission as admission_mod
+import backend.fastapi_app.main as main_mod
+from backend.fastapi_app.admission import AdmissionController, AdmissionRejected
+
+
+def test_classify_small_and_large_lanes():
+    """Content-Length に応じてレーンと重みが決まる。"""
+    ctrl = AdmissionController(
+        small_max_bytes=1024, weight_unit_bytes=1024, small_capacity=4, large_capacity=8
+    )
+
+    lane, weight = ctrl.classify(100)
+    assert lane.name == "small" and weight == 1
+
+    lane, weight = ctrl.classify(4096)
+    assert lane.name == "large" and weight == 4
+
+    # 容量を超える重みはレーン容量で頭打ち
+    lane, weight = ctrl.classify(1024 * 1024)
+    assert lane.name == "large" and weight == 8
+
+    # Content-Length 不明は最悪ケース扱い
+    lane, weight = ctrl.classify(None)
+    assert lane.name == "large" and weight == 8
+
+
+def test_queue_budget_exceeded_is_rejected():
+    """容量が埋まっている間の待ちが予算を超えると AdmissionRejected。"""
+
+    async def scenario():
+        ctrl = AdmissionController(
+            small_max_bytes=10, weight_unit_bytes=10, large_capacity=2, queue_budget_ms=20
+        )
+        held = await ctrl.admit(20)  # 重み 2 で large レーンを占有
+        with pytest.raises(AdmissionRejected):
+            await ctrl.admit(20)
+        held.release()
+
+        # 解放後は即座に受け付けられる
+        ticket = await ctrl.admit(20)
+        assert ticket.lane.in_use == 2
+        ticket.release()
+        assert ctrl.large.in_use == 0
+        assert ctrl.large.queued_weight == 0
+
+    asyncio.run(scenario())
+
+
+def test_waiter_is_admitted_when_capacity_frees():
+    """待ち行列のリクエストは容量が空いた時点で FIFO で許可される。"""
+
+    async def scenario():
+        ctrl = AdmissionController(small_capacity=1, queue_budget_ms=1000)
+        first = await ctrl.admit(10)
+        waiter = asyncio.ensure_future(ctrl.admit(10))
+        await asyncio.sleep(0)
+        assert ctrl.small.queued_weight == 1
+
+        first.release()
+        second = await waiter
+        assert second.lane.name == "small"
+        assert ctrl.small.in_flight == 1
+        second.release()
+
+    asyncio.run(scenario())
+
+
+def test_overloaded_request_gets_503_with_retry_after(monkeypatch):
+    """予算超過時は本文をパースせず 503 + Retry-After を返す。"""
+
+    async def reject(_content_length):
+        raise AdmissionRejected("large", "queue wait budget exceeded")
+
+    monkeypatch.setattr(admission_mod.admission_controller, "admit", reject)
+
+    client = TestClient(main_mod.app)
+    resp = client.post("/utc/v0/token-count", json={"model": "gpt-4o", "text": "hello"})
+
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "1"
+    assert resp.json()["error"]["code"] == "SERVICE_OVERLOADED"
+
+    # GET /health は流量制御の対象外
+    assert client.get("/health").status_code == 200
+
+
+@pytest.fixture
+def admitted_sizes(monkeypatch):
+    """admit() に渡されたサイズを記録する。"""
+    sizes = []
+    admit = admission_mod.admission_controller.admit
+
+    async def recording_admit(content_length):
+        sizes.append(content_length)
+        return await admit(content_length)
+
+    monkeypatch.setattr(admission_mod.admission_controller, "admit", recording_admit)
+    return sizes
+
+
+def test_chunked_request_is_weighted_by_its_actual_length(admitted_sizes):
+    """Content-Length の無い本文は読み込んでから実際の長さで重みを決める（最大重みにしない）。"""
+    body = json.dumps({"model": "gpt-4o", "text": "   "}).encode("utf-8")
+    client = TestClient(main_mod.app)
+
+    resp = client.post(
+        "/utc/v0/token-count",
+        content=iter([body[:10], body[10:]]),
+        headers={"Content-Type": "application/json"},
+    )
+
+    assert "content-length" not in resp.request.headers
+    assert resp.status_code == 422
+    assert resp.json()["error"]["code"] == "EMPTY_TEXT"  # 読み込んだ本文がそのまま後段に渡る
+    assert admitted_sizes == [len(body)]
+
+
+def test_chunked_request_over_the_limit_is_rejected(admitted_sizes, monkeypatch):
+    monkeypatch.setattr(admission_mod, "request_body_limit", lambda _query: 16)
+    client = TestClient(main_mod.app)
+
+    resp = client.post("/utc/v0/token-count", content=iter([b"x" * 10, b"x" * 10]))
+
+    assert resp.status_code == 413
+    assert admitted_sizes == []
+
+
+def test_compressed_request_is_admitted_before_decompression(admitted_sizes):
+    """圧縮本文は展開前に、圧縮後の長さ × COMPRESSED_SIZE_RATIO の重みで受け付ける。"""
+    compressed = gzip.compress(b"not json")
+    client = TestClient(main_mod.app)
+
+    resp = client.post(
+        "/utc/v0/token-count", content=compressed, headers={"Content-Encoding": "gzip"}
+    )
+    assert resp.status_code == 422
+    assert admitted_sizes == [len(compressed) * admission_mod.COMPRESSED_SIZE_RATIO]
+
+    resp = client.post(
+        "/utc/v0/token-count", content=b"not gzip", headers={"Content-Encoding": "gzip"}
+    )
+    assert resp.status_code == 400
+    assert len(admitted_sizes) == 2
@@ -0,0 +1,158 @@
+import sqlite3
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import backend.fastapi_app.router as router_module
+import backend.observability as observability
+from backend.analytics import AnalyticsSink
+from backend.fastapi_app.main import app
+
+
+def _record(model, status="ok", size=100, tokens=10, processing_ms=2.0):
+    return {
+        "endpoint": "/utc/v0/token-count",
+        "model": model,
+        "status": status,
+        "http_status": 200 if status == "ok" else 422,
+        "error_code": None if status == "ok" else "EMPTY_TEXT",
+        "char_count": size,
+        "input_size_bytes": size,
+        "token_count": tokens if status == "ok" else None,
+        "processing_time_ms": processing_ms,
+    }
+
+
+@pytest.fixture
+def sink(tmp_path):
+    sink = AnalyticsSink(str(tmp_path / "analytics.db"), batch_size=3, flush_interval_s=0.05)
+    yield sink
+    sink.close()
+
+
+def test_rollups_aggregate_batches(sink):
+    """複数バッチにまたがっても、ロールアップは加算・最大値で更新される。"""
+    for _ in range(4):
+        sink.submit(_record("gpt-4o", size=500, processing_ms=5.0))
+    sink.submit(_record("gpt-4o", size=50_000, processing_ms=20.0))
+    sink.submit(_record("gpt-4o", status="error"))
+    sink.submit(_record("gpt-4"))
+    sink.flush()
+
+    for bucket in ("minute", "hour"):
+        rows = sink.query(bucket=bucket, model="gpt-4o")
+        assert len(rows) == 1
+        row = rows[0]
+        assert row["requests"] == 6
+        assert row["errors"] == 1
+        assert row["tokens"] == 50
+        assert row["max_processing_ms"] == 20.0
+        assert row["size_distribution"]["le_1k"] == 5
+        assert row["size_distribution"]["le_64k"] == 1
+        assert row["tokens_per_sec"] == pytest.approx(50 / 0.042)
+
+    with sqlite3.connect(sink.path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM requests").fetchone()[0] == 7
+    assert sink.stats()["analytics_written"] == 7
+
+
+def test_disabled_sink_is_a_no_op():
+    sink = AnalyticsSink("")
+    sink.submit(_record("gpt-4o"))
+    assert sink.stats()["analytics_queued"] == 0
+
+
+def test_unwritable_path_does_not_kill_the_writer_or_block_close(tmp_path):
+    """接続できない間も書き込みスレッドは再試行を続け、close() は待ち続けない。"""
+    sink = AnalyticsSink(str(tmp_path / "missing" / "analytics.db"), queue_max=2, flush_interval_s=0.01)
+    for _ in range(5):
+        sink.submit(_record("gpt-4o"))
+    time.sleep(0.1)
+
+    stats = sink.stats()
+    assert stats["analytics_writer_alive"] is True
+    assert stats["analytics_connect_errors"] >= 1
+    assert stats["analytics_last_error"].startswith("OperationalError")
+    assert stats["analytics_dropped"] == 3
+
+    started = time.monotonic()
+    sink.close()
+    assert time.monotonic() - started < 1.0
+    assert sink.stats()["analytics_dropped"] == 5
+
+
+def test_stats_route(sink, monkeypatch):
+    """UtcError もアクセスログ経由で分析ストアに入り、/stats で参照できる。"""
+    monkeypatch.setattr(observability, "analytics_sink", sink)
+    monkeypatch.setattr(router_module, "analytics_sink", sink)
+    client = TestClient(app)
+
+    res = client.post("/utc/v0/token-count", json={"model": "gpt-4o", "text": "   "})
+    assert res.status_code == 422
+    sink.flush()
+
+    res = client.get("/utc/v0/stats", params={"bucket": "hour"})
+    assert res.status_code == 200
+    buckets = res.json()["buckets"]
+    assert buckets[0]["model"] == "gpt-4o"
+    assert buckets[0]["errors"] == 1
+
+
+def _raw_rows(sink):
+    sink.flush()
+    with sqlite3.connect(sink.path) as conn:
+        return conn.execute(
+            "SELECT endpoint, status, http_status, error_code FROM requests ORDER BY ts"
+        ).fetchall()
+
+
+def test_session_routes_log_success_under_the_route_template(sink, monkeypatch, offline_encoding):
+    """セッション API は成功も記録し、endpoint はセッション ID を含まないルートのパスになる。"""
+    monkeypatch.setattr(observability, "analytics_sink", sink)
+    client = TestClient(app)
+
+    res = client.post("/utc/v0/token-count/sessions", json={"model": "gpt-4o", "text": "the thing"})
+    session_id = res.json()["session"]["session_id"]
+    client.post(f"/utc/v0/token-count/sessions/{session_id}/edits", json={"edits": [{"offset": 0, "insert": "x"}]})
+    client.delete(f"/utc/v0/token-count/sessions/{session_id}")
+    client.post(f"/utc/v0/token-count/sessions/{session_id}/edits", json={"edits": []})
+
+    edits = "/utc/v0/token-count/sessions/{session_id}/edits"
+    assert _raw_rows(sink) == [
+        ("/utc/v0/token-count/sessions", "ok", 201, None),
+        (edits, "ok", 200, None),
+        ("/utc/v0/token-count/sessions/{session_id}", "ok", 204, None),
+        (edits, "error", 404, "SESSION_NOT_FOUND"),
+    ]
+    rows = sink.query(bucket="hour", endpoint=edits)
+    assert sum(row["requests"] for row in rows) == 2
+    assert sum(row["errors"] for row in rows) == 1
+
+
+def test_requests_rejected_before_the_route_are_recorded(sink, monkeypatch):
+    """本文上限・Content-Encoding・バリデーションで返したエラーもエラー率に入る。"""
+    monkeypatch.setattr(observability, "analytics_sink", sink)
+    client = TestClient(app)
+    url = "/utc/v0/token-count"
+
+    assert client.post(url, content=b"{}", headers={"Content-Length": str(10**9)}).status_code == 413
+    assert client.post(url, content=b"x", headers={"Content-Encoding": "br"}).status_code == 415
+    assert client.post(url, content=b"not gzip", headers={"Content-Encoding": "gzip"}).status_code == 400
+    assert client.post(url, json={"model": "gpt-4o"}).status_code == 422
+    assert client.post("/no/such/path/abc123", content=b"x", headers={"Content-Encoding": "br"}).status_code == 415
+
+    assert _raw_rows(sink) == [
+        (url, "error", 413, "PAYLOAD_TOO_LARGE"),
+        (url, "error", 415, "UNSUPPORTED_ENCODING"),
+        (url, "error", 400, "INVALID_ENCODING"),
+        (url, "error", 422, "VALIDATION_ERROR"),
+        ("other", "error", 415, "UNSUPPORTED_ENCODING"),
+    ]
+
+
+def test_stats_route_when_disabled():
+    client = TestClient(app)
+    res = client.get("/utc/v0/stats")
+    assert res.status_code == 404
+    assert res.json()["error"]["code"] == "ANALYTICS_DISABLED"
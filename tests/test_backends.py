@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+import core.backends as backends
+from core.backends import (
+    TokenizerBackend,
+    TokenizerRegistry,
+    TokenizerSpec,
+    load_registry_config,
+)
+from core.token_counter import UtcError, UtcErrorCode, count_tokens, tokenizer_registry
+
+
+class FakeFileBackend(TokenizerBackend):
+    """ファイルから読み込む想定のバックエンド（1 文字 1 トークン）。"""
+
+    kind = "fake"
+    loads = 0
+
+    def __init__(self, encoding_name: str, family: str, path: str) -> None:
+        super().__init__(encoding_name, family)
+        FakeFileBackend.loads += 1
+        self.path = path
+
+    def encode(self, text):
+        return [ord(ch) for ch in text]
+
+    def memory_bytes(self) -> int:
+        return 100
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    monkeypatch.setitem(backends.BACKEND_CLASSES, FakeFileBackend.kind, FakeFileBackend)
+    FakeFileBackend.loads = 0
+    return FakeFileBackend
+
+
+def test_registry_loads_lazily_and_evicts_lru(fake_backend):
+    """読み込みは初回利用時のみ。予算を超えると最近使われていないものから解放する。"""
+    registry = TokenizerRegistry(memory_budget_bytes=250)
+    for name in ("a", "b", "c"):
+        registry.register(TokenizerSpec(name, "fake", f"fake-{name}", "test", path=f"/{name}"))
+
+    assert fake_backend.loads == 0
+
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")  # a を最近使ったことにする
+    assert fake_backend.loads == 2
+
+    registry.get("c")  # 300 > 250 → 最も古い b を解放
+    stats = registry.stats()
+    assert stats["loaded_tokenizers"] == 2
+    assert stats["evictions"] == 1
+
+    registry.get("a")
+    assert fake_backend.loads == 3
+    registry.get("b")  # 解放済みなので再読み込み
+    assert fake_backend.loads == 4
+
+
+def test_count_and_batch_defaults(fake_backend):
+    backend = FakeFileBackend("fake", "test", "/x")
+    assert backend.count("abc") == 3
+    assert backend.count_batch(["a", "bcd"]) == [1, 3]
+
+
+def test_count_tokens_uses_registered_backend(fake_backend, monkeypatch):
+    """レジストリに登録した非 OpenAI モデルでもカウントでき、model_family が反映される。"""
+    monkeypatch.setattr(tokenizer_registry, "_specs", dict(tokenizer_registry._specs))
+    tokenizer_registry.register(
+        TokenizerSpec("local-llm", "fake", "local-bpe", "meta", path="/models/local")
+    )
+
+    data = count_tokens("local-llm", "hello")
+
+    assert data["result"]["encoding"] == "local-bpe"
+    assert data["result"]["token_count"] == 5
+    assert data["meta"]["model_family"] == "meta"
+
+
+def test_unloadable_tokenizer_is_reported(monkeypatch, tmp_path):
+    """トークナイザが読み込めない場合は TOKENIZER_UNAVAILABLE。"""
+    monkeypatch.setattr(tokenizer_registry, "_specs", dict(tokenizer_registry._specs))
+    config = tmp_path / "tokenizers.json"
+    config.write_text(
+        json.dumps(
+            {"models": {"broken": {"backend": "sentencepiece", "path": "missing.model"}}}
+        )
+    )
+    load_registry_config(tokenizer_registry, str(config))
+
+    spec = tokenizer_registry.get_spec("broken")
+    assert spec.path == str(tmp_path / "missing.model")
+    assert spec.family == "custom"
+
+    with pytest.raises(UtcError) as exc:
+        count_tokens("broken", "hello")
+
+    assert exc.value.code == UtcErrorCode.TOKENIZER_UNAVAILABLE
@@ -0,0 +1,68 @@
+import gzip
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.fastapi_app.compression import ZSTD_AVAILABLE
+from backend.fastapi_app.limits import MAX_REQUEST_BODY_BYTES
+from backend.fastapi_app.main import app
+
+client = TestClient(app)
+
+
+def _post(body: bytes, encoding: str, **kwargs):
+    return client.post(
+        "/utc/v0/token-count",
+        content=body,
+        headers={"Content-Type": "application/json", "Content-Encoding": encoding},
+        **kwargs,
+    )
+
+
+def test_gzip_request_body_is_decompressed(offline_encoding):
+    payload = {"model": "gpt-4", "text": "the thing " * 1000}
+    res = _post(gzip.compress(json.dumps(payload).encode()), "gzip")
+
+    assert res.status_code == 200
+    assert res.json()["result"]["char_count"] == len(payload["text"])
+
+
+def test_decompression_bomb_is_rejected_incrementally():
+    """圧縮後は小さくても、展開後の上限を超えた時点で 413 を返す。"""
+    bomb = gzip.compress(b"a" * (MAX_REQUEST_BODY_BYTES * 4))
+    assert len(bomb) < MAX_REQUEST_BODY_BYTES // 100
+
+    res = _post(bomb, "gzip")
+    assert res.status_code == 413
+    assert res.json()["error"]["code"] == "PAYLOAD_TOO_LARGE"
+
+
+def test_invalid_and_unsupported_encodings():
+    assert _post(b"not gzip", "gzip").json()["error"]["code"] == "INVALID_ENCODING"
+    truncated = gzip.compress(b'{"model": "gpt-4", "text": "abc"}')[:-8]
+    assert _post(truncated, "gzip").status_code == 400
+    assert _post(b"{}", "br").status_code == 415
+
+
+@pytest.mark.skipif(not ZSTD_AVAILABLE, reason="zstd support is not installed")
+def test_zstd_request_body(offline_encoding):
+    try:
+        from compression import zstd
+
+        compress = zstd.compress
+    except ImportError:
+        import zstandard
+
+        compress = zstandard.ZstdCompressor().compress
+    payload = {"model": "gpt-4", "text": "the thing " * 1000}
+    assert _post(compress(json.dumps(payload).encode()), "zstd").status_code == 200
+
+
+def test_large_response_is_gzipped(offline_encoding):
+    payload = {"model": "gpt-4", "text": "the thing " * 2000, "return_offsets": True}
+    res = client.post("/utc/v0/token-count", json=payload, headers={"Accept-Encoding": "gzip"})
+
+    assert res.status_code == 200
+    assert res.headers["content-encoding"] == "gzip"
+    assert len(res.json()["result"]["token_offsets_delta"]) == res.json()["result"]["token_count"]
@@ -0,0 +1,120 @@
+from fastapi.testclient import TestClient
+
+import backend.fastapi_app.main as main_module
+import backend.observability as observability
+from backend.fastapi_app.degradation import (
+    STAGE_SUCCESS_LOGGING,
+    DegradationController,
+    samples_latency,
+)
+from backend.fastapi_app.main import app
+from core.token_counter import STAGE_LANGUAGE_DETECTION, STAGE_VERBOSE_META, count_tokens
+
+
+def test_levels_rise_with_pressure_and_fall_with_hysteresis():
+    controller = DegradationController(inflight_high=4, latency_high_ms=100)
+
+    assert controller.enter() == frozenset()  # 1/4 = 0.25
+    assert controller.enter() == {STAGE_SUCCESS_LOGGING}  # 0.5
+    assert controller.enter() == {STAGE_SUCCESS_LOGGING, STAGE_LANGUAGE_DETECTION}  # 0.75
+    assert len(controller.enter()) == 3  # 1.0
+    assert controller.level == 3
+
+    # 0.75 はレベル 3 のしきい値 1.0 - 0.1 を下回るので 1 つ下がる
+    controller.exit(1.0)
+    assert controller.level == 2
+    # 0.5 はレベル 2 のしきい値 0.75 - 0.1 を下回るが、レベル 1 の 0.5 - 0.1 は下回らない
+    controller.exit(1.0)
+    assert controller.level == 1
+
+
+def test_slow_request_alone_is_not_overload():
+    """同時実行が無いまま遅いリクエスト（コールドスタートなど）が来てもレベルは上がらない。"""
+    controller = DegradationController(inflight_high=100, latency_high_ms=100)
+    controller.enter()
+    controller.exit(300.0)
+    assert controller.ewma_latency_ms is None
+    assert controller.enter() == frozenset()
+    assert controller.level == 0
+
+
+def test_latency_counts_only_under_concurrency():
+    controller = DegradationController(inflight_high=100, latency_high_ms=100)
+    controller.enter()
+    controller.enter()
+    controller.exit(150.0)
+    # 重なっていたリクエストの遅さは記録するが、負荷率に効くのは同時実行中だけ
+    assert controller.ewma_latency_ms == 150.0
+    assert controller.level == 0
+    assert len(controller.enter()) == 3
+    # 意図的に遅いリクエストは記録しない
+    controller.exit(10_000.0, sample=False)
+    assert controller.ewma_latency_ms == 150.0
+
+
+def test_samples_latency_only_for_exact_token_counts():
+    assert samples_latency("/utc/v0/token-count", {}, {})
+    assert not samples_latency("/utc/v0/token-count", {"accuracy": "estimate"}, {})
+    assert not samples_latency("/utc/v0/token-count", {}, {"x-utc-profile": "t"})
+    assert not samples_latency("/utc/v0/stats", {}, {})
+
+
+def test_count_tokens_skips_optional_stages(offline_encoding):
+    data = count_tokens(
+        "gpt-4", "the thing", skip_stages={STAGE_LANGUAGE_DETECTION, STAGE_VERBOSE_META}
+    )
+    meta = data["meta"]
+    assert meta["skipped_stages"] == [STAGE_LANGUAGE_DETECTION, STAGE_VERBOSE_META]
+    assert "input_language" not in meta
+    assert "utc_timestamp" not in meta
+    assert data["result"]["token_count"] > 0
+
+
+def test_http_response_flags_skipped_stages(offline_encoding, monkeypatch):
+    """負荷が高いときはレスポンスの meta.skipped_stages に省略した段階が並ぶ。"""
+    controller = DegradationController(inflight_high=1, latency_high_ms=1000)
+    monkeypatch.setattr(main_module, "degradation_controller", controller)
+    client = TestClient(app)
+
+    res = client.post("/utc/v0/token-count", json={"model": "gpt-4", "text": "the thing"})
+    assert res.status_code == 200
+    meta = res.json()["meta"]
+    assert meta["skipped_stages"] == [
+        STAGE_SUCCESS_LOGGING,
+        STAGE_LANGUAGE_DETECTION,
+        STAGE_VERBOSE_META,
+    ]
+    assert "processing_time_ms" not in meta
+
+
+def test_skipped_success_logging_still_records_analytics(offline_encoding, monkeypatch):
+    """成功ログを省略しても分析ストアには記録する（高負荷時にエラー率が偏らないように）。"""
+    controller = DegradationController(inflight_high=2, latency_high_ms=1000)
+    monkeypatch.setattr(main_module, "degradation_controller", controller)
+    submitted = []
+    monkeypatch.setattr(observability.analytics_sink, "submit", submitted.append)
+    monkeypatch.setattr(observability, "_log_json", lambda *_args: submitted.append("log"))
+    client = TestClient(app)
+
+    res = client.post("/utc/v0/token-count", json={"model": "gpt-4", "text": "the thing"})
+    assert res.json()["meta"]["skipped_stages"] == [STAGE_SUCCESS_LOGGING]
+    assert [record["status"] for record in submitted] == ["ok"]
+
+
+def test_degraded_analytics_record_keeps_processing_time(offline_encoding, monkeypatch):
+    """verbose_meta を省略した縮退レベル 3 でも、分析ストアの processing_time_ms はルートで測った値になる。"""
+    controller = DegradationController(inflight_high=1, latency_high_ms=1000)
+    monkeypatch.setattr(main_module, "degradation_controller", controller)
+    submitted = []
+    monkeypatch.setattr(observability.analytics_sink, "submit", submitted.append)
+    client = TestClient(app)
+
+    res = client.post("/utc/v0/token-count", json={"model": "gpt-4", "text": "the thing"})
+    meta = res.json()["meta"]
+    assert STAGE_VERBOSE_META in meta["skipped_stages"]
+    assert "processing_time_ms" not in meta
+
+    (record,) = submitted
+    assert record["status"] == "ok"
+    assert record["processing_time_ms"] is not None
+    assert record["processing_time_ms"] > 0
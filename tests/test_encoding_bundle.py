@@ -0,0 +1,56 @@
+import pytest
+
+import core.encoding_bundle as eb
+from core.token_counter import count_tokens
+
+
+@pytest.fixture
+def bundle_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(eb, "BUNDLE_DIR", str(tmp_path))
+    monkeypatch.setattr(eb, "_loaded", {})
+    monkeypatch.setattr(eb, "_missing", set())
+    return tmp_path
+
+
+def test_bundle_roundtrip_preserves_encoding(offline_encoding, tmp_path):
+    """書き出したバンドルから同じ語彙・分割パターンの Encoding が復元される。"""
+    original = offline_encoding("cl100k_base")
+    path = str(tmp_path / "cl100k_base.utcbpe")
+
+    eb.write_bundle(original, path)
+    restored = eb.read_bundle(path)
+
+    text = "the thing is interesting\n\n  日本語テキスト"
+    assert restored.name == original.name
+    assert restored.encode(text) == original.encode(text)
+    assert restored.n_vocab == original.n_vocab
+
+
+def test_get_encoding_prefers_bundle(offline_encoding, bundle_dir, monkeypatch):
+    """バンドルがあれば tiktoken を経由せずに読み込み、以降はプロセス内で使い回す。"""
+    eb.build_bundles(["o200k_base"], str(bundle_dir))
+
+    def no_download(name):
+        raise AssertionError("tiktoken.get_encoding must not be called")
+
+    monkeypatch.setattr(eb.tiktoken, "get_encoding", no_download)
+
+    first = eb.get_encoding("o200k_base")
+    assert eb.get_encoding("o200k_base") is first
+
+    data = count_tokens("gpt-4o", "the thing")
+    assert data["result"]["token_count"] == len(first.encode("the thing"))
+
+
+def test_get_encoding_falls_back_to_tiktoken(offline_encoding, bundle_dir):
+    """バンドルが無い encoding は tiktoken の通常経路で読み込む。"""
+    assert eb.get_encoding("cl100k_base") is offline_encoding("cl100k_base")
+    assert "cl100k_base" in eb._missing
+
+
+def test_read_bundle_rejects_other_files(tmp_path):
+    path = tmp_path / "broken.utcbpe"
+    path.write_bytes(b"not a bundle at all")
+
+    with pytest.raises(ValueError):
+        eb.read_bundle(str(path))
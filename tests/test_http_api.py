@@ -54,3 +54,36 @@ def test_token_count_empty_text_error():
     assert isinstance(err["message"], str)
     assert isinstance(err["hint"], str)
 
+
+
+def test_oversized_body_rejected_before_parsing():
+    """Content-Length が上限を超える場合は本文をパースせずに 413 を返す。"""
+    from backend.fastapi_app.limits import MAX_REQUEST_BODY_BYTES
+
+    body = b"x" * (MAX_REQUEST_BODY_BYTES + 1)  # JSON として不正でも 422 ではなく 413
+    resp = client.post(
+        "/utc/v0/token-count",
+        content=body,
+        headers={"Content-Type": "application/json"},
+    )
+
+    assert resp.status_code == 413
+    assert resp.json()["error"]["code"] == "PAYLOAD_TOO_LARGE"
+
+
+def test_estimate_mode_accepts_large_body(offline_encoding):
+    """accuracy=estimate のときは通常の上限を超える本文も受け付け、推定値を返す。"""
+    from backend.fastapi_app.limits import MAX_REQUEST_BODY_BYTES
+
+    text = "the thing in testing " * (MAX_REQUEST_BODY_BYTES // 20)
+    payload = {"model": "gpt-4", "text": text}
+
+    assert client.post("/utc/v0/token-count", json=payload).status_code == 413
+
+    resp = client.post("/utc/v0/token-count", params={"accuracy": "estimate"}, json=payload)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert "token_count" not in data["result"]
+    assert data["result"]["token_count_estimate"] > 0
+    assert data["meta"]["accuracy"] == "estimate"
+    assert data["meta"]["confidence_interval"]["level"] == 0.95
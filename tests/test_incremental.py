@@ -0,0 +1,123 @@
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+
+import core.incremental as inc
+from backend.fastapi_app.main import app
+from core.incremental import IncrementalDocument, IncrementalSessionStore
+from core.token_counter import UtcError, UtcErrorCode
+
+ALPHABET = list("the Thing's  \n\n\t don't 123 4567 ,.!?()/ 日本語テキスト😀 ing in")
+
+
+@pytest.fixture
+def small_segments(monkeypatch):
+    """小さなテキストでも複数セグメントになるようにする。"""
+    monkeypatch.setattr(inc, "SEGMENT_TARGET_CHARS", 24)
+    monkeypatch.setattr(inc, "SEGMENT_MIN_CHARS", 6)
+
+
+def _random_text(rng: random.Random, low: int, high: int) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(low, high)))
+
+
+def test_incremental_count_matches_full_encode(offline_encoding, small_segments):
+    """ランダムな編集を繰り返しても、全文 encode と同じトークン数を保つ。"""
+    rng = random.Random(0)
+    encoding = offline_encoding("o200k_base")
+
+    for _ in range(20):
+        document = IncrementalDocument("gpt-4o", "x" + _random_text(rng, 50, 300))
+        assert document.segment_count > 1
+        assert document.token_count == len(encoding.encode(document.text))
+
+        for _ in range(15):
+            offset = rng.randint(0, document.char_count)
+            delete = rng.randint(0, min(8, document.char_count - offset))
+            document.apply_edits([(offset, delete, _random_text(rng, 0, 10))])
+            assert document.token_count == len(encoding.encode(document.text))
+
+
+def test_edit_reencodes_only_affected_segments(offline_encoding, small_segments):
+    text = "word " * 200
+    document = IncrementalDocument("gpt-4o", text)
+
+    reencoded = document.apply_edits([(500, 0, "inserted ")])
+
+    assert reencoded < len(text) // 4
+    assert document.revision == 1
+
+
+def test_invalid_edit_is_rejected_atomically(offline_encoding):
+    document = IncrementalDocument("gpt-4o", "hello world")
+
+    with pytest.raises(UtcError) as exc:
+        document.apply_edits([(0, 5, "HELLO"), (100, 1, "")])
+
+    assert exc.value.code == UtcErrorCode.INVALID_EDIT
+    assert document.text == "hello world"
+    assert document.revision == 0
+
+
+def test_sessions_are_evicted_by_idle_time_and_memory(offline_encoding):
+    now = [0.0]
+    store = IncrementalSessionStore(idle_ttl_s=10, memory_budget_bytes=10**9, clock=lambda: now[0])
+
+    old_id, _ = store.create("gpt-4o", "first document")
+    now[0] = 5
+    new_id, _ = store.create("gpt-4o", "second document")
+    now[0] = 12
+
+    store.get(new_id)  # old_id は 12 秒アクセスが無いので破棄される
+    with pytest.raises(UtcError) as exc:
+        store.get(old_id)
+    assert exc.value.code == UtcErrorCode.SESSION_NOT_FOUND
+
+    store.memory_budget_bytes = 1
+    latest_id, _ = store.create("gpt-4o", "third document")
+    assert store.stats()["sessions"] == 1
+    assert store.get(latest_id).text == "third document"
+
+
+def test_expired_session_is_not_revived_by_direct_access(offline_encoding):
+    """期限切れのセッションに直接アクセスしても復活させず SESSION_NOT_FOUND を返す。"""
+    now = [0.0]
+    store = IncrementalSessionStore(idle_ttl_s=10, memory_budget_bytes=10**9, clock=lambda: now[0])
+
+    session_id, _ = store.create("gpt-4o", "only document")
+    now[0] = 1000
+    with pytest.raises(UtcError) as exc:
+        store.get(session_id)
+    assert exc.value.code == UtcErrorCode.SESSION_NOT_FOUND
+    with pytest.raises(UtcError):
+        store.edit(session_id, [(0, 0, "x")])
+    assert store.stats()["sessions"] == 0
+
+
+def test_session_http_flow(offline_encoding):
+    client = TestClient(app)
+
+    resp = client.post(
+        "/utc/v0/token-count/sessions", json={"model": "gpt-4o", "text": "the thing"}
+    )
+    assert resp.status_code == 201
+    session_id = resp.json()["session"]["session_id"]
+
+    resp = client.post(
+        f"/utc/v0/token-count/sessions/{session_id}/edits",
+        json={"edits": [{"offset": 9, "insert": " is here"}]},
+    )
+    assert resp.status_code == 200
+    data = resp.json()
+    expected = len(offline_encoding("o200k_base").encode("the thing is here"))
+    assert data["result"]["token_count"] == expected
+    assert data["result"]["char_count"] == len("the thing is here")
+    assert data["session"]["revision"] == 1
+
+    assert client.delete(f"/utc/v0/token-count/sessions/{session_id}").status_code == 204
+    resp = client.post(
+        f"/utc/v0/token-count/sessions/{session_id}/edits", json={"edits": []}
+    )
+    assert resp.status_code == 404
+    assert resp.json()["error"]["code"] == "SESSION_NOT_FOUND"
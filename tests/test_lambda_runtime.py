@@ -0,0 +1,133 @@
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("mangum")
+
+from lambda_http import main as lambda_main  # noqa: E402
+from lambda_http.runtime import RuntimeClient, handle_one  # noqa: E402
+from lambda_http.streaming import HTTP_INTEGRATION_CONTENT_TYPE, PRELUDE_DELIMITER  # noqa: E402
+
+
+def _event(payload: dict) -> dict:
+    """Lambda Function URL（ペイロード v2.0）形式のイベント。"""
+    return {
+        "version": "2.0",
+        "rawPath": "/utc/v0/token-count",
+        "rawQueryString": "",
+        "headers": {"content-type": "application/json", "host": "example.lambda-url.aws"},
+        "requestContext": {"http": {"method": "POST", "path": "/utc/v0/token-count", "sourceIp": "127.0.0.1"}},
+        "body": json.dumps(payload),
+        "isBase64Encoded": False,
+    }
+
+
+class FakeRuntimeAPI:
+    """Runtime API の next / response / error だけを実装したローカルサーバ。"""
+
+    def __init__(self, event: dict) -> None:
+        self.event = event
+        self.posts = []
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *_args):
+                pass
+
+            def do_GET(self):
+                body = json.dumps(api.event).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Lambda-Runtime-Aws-Request-Id", "req-1")
+                self.send_header("Lambda-Runtime-Deadline-Ms", str(int(time.time() * 1000) + 30_000))
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                chunks, trailers = [], {}
+                if self.headers.get("Transfer-Encoding") == "chunked":
+                    while True:
+                        size = int(self.rfile.readline().strip(), 16)
+                        if size == 0:
+                            break
+                        chunks.append(self.rfile.read(size))
+                        self.rfile.readline()
+                    while True:
+                        line = self.rfile.readline().strip()
+                        if not line:
+                            break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        trailers[name.strip()] = value.strip()
+                else:
+                    chunks.append(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                api.posts.append(
+                    {"path": self.path, "headers": dict(self.headers), "chunks": chunks, "trailers": trailers}
+                )
+                self.send_response(202)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def client(self) -> RuntimeClient:
+        return RuntimeClient("127.0.0.1:%d" % self.server.server_address[1])
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_runtime_streams_the_handler_output(offline_encoding, monkeypatch):
+    monkeypatch.setattr(lambda_main, "STREAM_THRESHOLD_BYTES", 64 * 1024)
+    payload = {"model": "gpt-4", "text": "the thing, " * 9000, "return_offsets": True}
+
+    with FakeRuntimeAPI(_event(payload)) as api:
+        handle_one(api.client, lambda_main.stream_handler)
+
+    (post,) = api.posts
+    assert post["path"] == "/2018-06-01/runtime/invocation/req-1/response"
+    assert post["headers"]["Lambda-Runtime-Function-Response-Mode"] == "streaming"
+    assert post["headers"]["Content-Type"] == HTTP_INTEGRATION_CONTENT_TYPE
+    assert len(post["chunks"]) > 2
+    assert post["trailers"] == {}
+
+    prelude, _, body = b"".join(post["chunks"]).partition(PRELUDE_DELIMITER)
+    assert json.loads(prelude)["statusCode"] == 200
+    assert json.loads(body)["result"]["char_count"] == len(payload["text"])
+
+
+def test_runtime_reports_errors_before_and_after_the_first_write():
+    def fails_early(event, stream, context):
+        assert context.get_remaining_time_in_millis() > 0
+        raise ValueError("boom")
+
+    def fails_late(event, stream, context):
+        stream.set_content_type(HTTP_INTEGRATION_CONTENT_TYPE)
+        stream.write(b"partial")
+        raise ValueError("boom")
+
+    with FakeRuntimeAPI({}) as api:
+        handle_one(api.client, fails_early)
+        handle_one(api.client, fails_late)
+
+    early, late = api.posts
+    assert early["path"] == "/2018-06-01/runtime/invocation/req-1/error"
+    assert early["headers"]["Lambda-Runtime-Function-Error-Type"] == "Runtime.ValueError"
+    assert json.loads(early["chunks"][0])["errorMessage"] == "boom"
+
+    assert late["chunks"] == [b"partial"]
+    assert late["trailers"]["Lambda-Runtime-Function-Error-Type"] == "Runtime.ValueError"
+    error = json.loads(base64.b64decode(late["trailers"]["Lambda-Runtime-Function-Error-Body"]))
+    assert error["errorMessage"] == "boom"
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+pytest.importorskip("mangum")
+
+from lambda_http import main as lambda_main  # noqa: E402
+from lambda_http.streaming import (  # noqa: E402
+    HTTP_INTEGRATION_CONTENT_TYPE,
+    LocalResponseStream,
+    estimate_response_bytes,
+)
+
+
+def _event(payload: dict) -> dict:
+    """Lambda Function URL（ペイロード v2.0）形式のイベント。"""
+    return {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": "/utc/v0/token-count",
+        "rawQueryString": "",
+        "headers": {"content-type": "application/json", "host": "example.lambda-url.aws"},
+        "requestContext": {
+            "http": {"method": "POST", "path": "/utc/v0/token-count", "sourceIp": "127.0.0.1"},
+        },
+        "body": json.dumps(payload),
+        "isBase64Encoded": False,
+    }
+
+
+def test_small_response_is_written_buffered(offline_encoding):
+    stream = LocalResponseStream()
+    lambda_main.stream_handler(_event({"model": "gpt-4", "text": "hello"}), stream, None)
+
+    prelude, body = stream.parse()
+    assert stream.content_type == HTTP_INTEGRATION_CONTENT_TYPE
+    assert stream.closed
+    assert len(stream.chunks) == 2  # prelude + 本文
+    assert prelude["statusCode"] == 200
+    assert json.loads(body)["result"]["char_count"] == 5
+
+
+def test_large_response_is_streamed_in_chunks(offline_encoding, monkeypatch):
+    monkeypatch.setattr(lambda_main, "STREAM_THRESHOLD_BYTES", 64 * 1024)
+    payload = {"model": "gpt-4", "text": "the thing, " * 9000, "return_offsets": True}
+    event = _event(payload)
+    assert estimate_response_bytes(event) >= lambda_main.STREAM_THRESHOLD_BYTES
+
+    stream = LocalResponseStream()
+    lambda_main.stream_handler(event, stream, None)
+
+    prelude, body = stream.parse()
+    assert prelude["statusCode"] == 200
+    assert "content-length" not in prelude["headers"]
+    assert len(stream.chunks) > 2
+
+    buffered = lambda_main.handler(_event(payload), None)
+    assert json.loads(body)["result"] == json.loads(buffered["body"])["result"]
+
+
+def test_error_status_is_carried_in_prelude():
+    stream = LocalResponseStream()
+    lambda_main.stream_handler(_event({"model": "gpt-4", "text": "  "}), stream, None)
+
+    prelude, body = stream.parse()
+    assert prelude["statusCode"] == 422
+    assert json.loads(body)["error"]["code"] == "EMPTY_TEXT"
+
+
+def test_buffered_handler_rejects_oversized_response(offline_encoding, monkeypatch):
+    monkeypatch.setattr(lambda_main, "MAX_BUFFERED_RESPONSE_BYTES", 1024)
+    payload = {"model": "gpt-4", "text": "the thing, " * 1000, "return_offsets": True}
+
+    response = lambda_main.handler(_event(payload), None)
+
+    assert response["statusCode"] == 413
+    assert json.loads(response["body"])["error"]["code"] == "RESPONSE_TOO_LARGE"
+
+
+def test_estimate_grows_only_with_offsets_or_spans():
+    text = "x" * 100_000
+    plain = estimate_response_bytes(_event({"model": "gpt-4", "text": text}))
+    offsets = estimate_response_bytes(
+        _event({"model": "gpt-4", "text": text, "return_offsets": True})
+    )
+
+    assert plain < 10_000
+    assert offsets > 2 * len(text)
@@ -0,0 +1,52 @@
+import langdetect
+
+from core.language import LanguageDetector, normalize_prefix
+
+
+def test_detection_is_deterministic():
+    """シード固定のため、短く曖昧なテキストでも毎回同じ結果になる。"""
+    text = "ok si no"
+    results = set()
+    for _ in range(20):
+        results.add(LanguageDetector(maxsize=0).detect(text))
+    assert len(results) == 1
+
+
+def test_near_identical_inputs_hit_the_cache(monkeypatch):
+    calls = []
+
+    def fake_detect(text):
+        calls.append(text)
+        return "en"
+
+    monkeypatch.setattr(langdetect, "detect", fake_detect)
+    detector = LanguageDetector(maxsize=2)
+
+    base = "This is an English sentence. " * 100
+    assert detector.detect(base) == "en"
+    assert detector.detect("  " + base.replace(" ", "\n  ")) == "en"  # 空白の違いだけ
+    assert detector.detect(base + " different tail beyond the prefix") == "en"
+    assert len(calls) == 1
+    assert len(calls[0]) == len(normalize_prefix(base))
+
+    detector.detect("second text")
+    detector.detect("third text")  # maxsize=2 → base が追い出される
+    detector.detect(base)
+    assert len(calls) == 4
+    assert detector.stats()["language_cache_hits"] == 2
+
+
+def test_unexpected_failures_are_not_cached(monkeypatch):
+    def broken(_text):
+        raise RuntimeError("boom")
+
+    detector = LanguageDetector()
+    monkeypatch.setattr(langdetect, "detect", broken)
+    assert detector.detect("retry me later") == "unknown"
+
+    monkeypatch.setattr(langdetect, "detect", lambda _text: "en")
+    assert detector.detect("retry me later") == "en"
+
+    # 特徴が無い入力は決定的に unknown（キャッシュされる）
+    monkeypatch.undo()
+    assert detector.detect("12345 67890") == "unknown"
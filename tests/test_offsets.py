@@ -0,0 +1,59 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.fastapi_app.main import app
+from core.offsets import delta_decode, delta_encode, span_token_counts
+from core.token_counter import UtcError, UtcErrorCode, count_tokens
+
+TEXT = "the thing 日本語😀 testing\n\nin"
+
+
+def test_offsets_match_tiktoken_decode_with_offsets(offline_encoding):
+    """1 回の encode で求めたオフセットが tiktoken の decode_with_offsets と一致する。"""
+    encoding = offline_encoding("cl100k_base")
+    data = count_tokens("gpt-4", TEXT, return_offsets=True)
+
+    offsets = delta_decode(data["result"]["token_offsets_delta"])
+    _, expected = encoding.decode_with_offsets(encoding.encode(TEXT))
+
+    assert list(offsets) == expected
+    assert len(offsets) == data["result"]["token_count"]
+    assert "span_token_counts" not in data["result"]
+
+
+def test_span_counts_cover_the_whole_text(offline_encoding):
+    """隣接する範囲のトークン数の合計は全体のトークン数に等しい。"""
+    data = count_tokens("gpt-4", TEXT, spans=[(0, 9), (9, 14), (14, len(TEXT))])
+
+    counts = data["result"]["span_token_counts"]
+    assert sum(counts) == data["result"]["token_count"]
+    assert "token_offsets_delta" not in data["result"]
+
+
+def test_delta_roundtrip_and_empty_span():
+    offsets = [0, 3, 4, 10]
+    assert delta_encode(offsets) == [0, 3, 1, 6]
+    assert list(delta_decode(delta_encode(offsets))) == offsets
+    assert span_token_counts(delta_decode([0, 3, 1, 6]), [(5, 5), (3, 10)], 12) == [0, 2]
+
+
+def test_invalid_span_is_rejected(offline_encoding):
+    with pytest.raises(UtcError) as exc:
+        count_tokens("gpt-4", TEXT, spans=[(5, 2)])
+    assert exc.value.code == UtcErrorCode.INVALID_SPAN
+
+
+def test_http_spans_and_offsets(offline_encoding):
+    client = TestClient(app)
+    res = client.post(
+        "/utc/v0/token-count",
+        json={"model": "gpt-4", "text": TEXT, "spans": [[0, 9]], "return_offsets": True},
+    )
+    assert res.status_code == 200
+    result = res.json()["result"]
+    assert len(result["span_token_counts"]) == 1
+    assert len(result["token_offsets_delta"]) == result["token_count"]
+
+    res = client.post("/utc/v0/token-count", json={"model": "gpt-4", "text": TEXT, "spans": [[0, 999]]})
+    assert res.status_code == 400
+    assert res.json()["error"]["code"] == "INVALID_SPAN"
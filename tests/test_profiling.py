@@ -0,0 +1,128 @@
+import pstats
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import backend.fastapi_app.profiling as profiling
+import backend.fastapi_app.router as router_module
+from backend.fastapi_app.main import app
+from backend.fastapi_app.profiling import ProfileStore
+
+
+def _slow(ms):
+    time.sleep(ms / 1000.0)
+    return ms
+
+
+def test_store_keeps_slowest_profiles(tmp_path):
+    """しきい値未満は捨て、上限を超えたら最も速いものから入れ替える。dump ファイルも追従する。"""
+    store = ProfileStore(keep=2, threshold_ms=10, dump_dir=str(tmp_path))
+
+    for ms in (5, 30, 20, 40):
+        value, stats = store.run(lambda: _slow(ms))
+        assert value == ms
+        store.offer(float(ms), stats, {"model": "gpt-4"})
+
+    assert [p["elapsed_ms"] for p in store.list()] == [40.0, 30.0]
+    dumps = sorted(path.name for path in tmp_path.iterdir())
+    assert len(dumps) == 2
+    # dump は pstats でそのまま読める
+    pstats.Stats(str(tmp_path / dumps[0]))
+
+    entry = store.get(store.list()[0]["profile_id"])
+    assert "_slow" in store.report(entry)
+
+
+def test_profiler_slot_in_use_skips_profiling(monkeypatch):
+    """他のツールがプロファイラ枠を使っている（3.12+ の ValueError）ときはプロファイルせずに実行する。"""
+
+    class BusyProfile:
+        def enable(self):
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(profiling.cProfile, "Profile", BusyProfile)
+    store = ProfileStore(threshold_ms=0)
+
+    assert store.run(lambda: 42) == (42, None)
+    assert store.stats()["profiles_skipped_tool_active"] == 1
+
+
+def test_errors_from_the_profiled_call_are_not_swallowed():
+    """fn 自身の ValueError はプロファイラ枠の競合と区別して送出する。"""
+    store = ProfileStore(threshold_ms=0)
+
+    def fails():
+        raise ValueError("bad input")
+
+    with pytest.raises(ValueError, match="bad input"):
+        store.run(fails)
+    assert store.stats()["profiles_skipped_tool_active"] == 0
+    # 例外の後も次のリクエストを計測できる
+    assert store.run(lambda: 1)[1] is not None
+
+
+def test_concurrent_requests_are_profiled_one_at_a_time():
+    """計測中に来た別リクエストはプロファイルせずに実行する（3.12+ は枠がプロセスで 1 つ）。"""
+    store = ProfileStore(threshold_ms=0)
+    inner = {}
+
+    def outer():
+        inner["result"] = store.run(lambda: "inner")
+        return "outer"
+
+    value, stats = store.run(outer)
+    assert (value, stats is not None) == ("outer", True)
+    assert inner["result"] == ("inner", None)
+    assert store.stats()["profiles_skipped_busy"] == 1
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "secret")
+    store = ProfileStore(keep=5, threshold_ms=0)
+    monkeypatch.setattr(router_module, "profile_store", store)
+    return store
+
+
+def test_profile_header_and_admin_routes(offline_encoding, admin):
+    client = TestClient(app)
+    payload = {"model": "gpt-4", "text": "the thing"}
+
+    # ヘッダ無し・トークン違いはプロファイルしない
+    assert "x-utc-profile-id" not in client.post("/utc/v0/token-count", json=payload).headers
+    res = client.post("/utc/v0/token-count", json=payload, headers={"X-UTC-Profile": "wrong"})
+    assert "x-utc-profile-id" not in res.headers
+
+    res = client.post("/utc/v0/token-count", json=payload, headers={"X-UTC-Profile": "secret"})
+    assert res.status_code == 200
+    profile_id = res.headers["x-utc-profile-id"]
+
+    assert client.get("/utc/v0/admin/profiles").status_code == 401
+
+    auth = {"X-UTC-Admin-Token": "secret"}
+    listing = client.get("/utc/v0/admin/profiles", headers=auth).json()
+    assert listing["profiles"][0]["profile_id"] == profile_id
+
+    report = client.get(f"/utc/v0/admin/profiles/{profile_id}", headers=auth)
+    assert "count_tokens" in report.text
+    raw = client.get(f"/utc/v0/admin/profiles/{profile_id}", params={"format": "pstats"}, headers=auth)
+    assert raw.headers["content-type"] == "application/octet-stream"
+
+    missing = client.get("/utc/v0/admin/profiles/nope", headers=auth)
+    assert missing.json()["error"]["code"] == "PROFILE_NOT_FOUND"
+
+
+def test_non_ascii_tokens_are_rejected_without_error(offline_encoding, admin):
+    """非 ASCII のヘッダ値は 500 にせず、認証失敗として扱う。"""
+    client = TestClient(app)
+    payload = {"model": "gpt-4", "text": "the thing"}
+    cafe = "café".encode("utf-8")
+
+    res = client.post("/utc/v0/token-count", json=payload, headers={"X-UTC-Profile": cafe})
+    assert res.status_code == 200
+    assert "x-utc-profile-id" not in res.headers
+
+    res = client.get("/utc/v0/admin/profiles", headers={"X-UTC-Admin-Token": cafe})
+    assert res.status_code == 401
+    assert not profiling.is_admin({"x-utc-admin-token": "caf€"})
@@ -0,0 +1,111 @@
+import http.client
+import json
+import os
+import signal
+import socket
+import time
+
+from langdetect import detector_factory
+
+import backend.fastapi_app.server as server_module
+from backend.fastapi_app.main import app
+from backend.fastapi_app.server import PreforkServer, preload
+
+
+def test_worker_config_applies_recycling_and_keep_alive():
+    server = PreforkServer(app, workers=2, keep_alive_s=75, max_requests=100, max_requests_jitter=10)
+    limits = {server._worker_config().limit_max_requests for _ in range(50)}
+    assert all(100 <= limit <= 110 for limit in limits)
+    assert len(limits) > 1  # ワーカーごとに入れ替えのタイミングがずれる
+
+    config = server._worker_config()
+    assert config.timeout_keep_alive == 75
+
+    assert PreforkServer(app, max_requests=0)._worker_config().limit_max_requests is None
+
+
+def test_preload_reads_encodings_before_fork(offline_encoding):
+    assert "gpt-4o" in preload()
+
+
+def test_worker_spawned_after_stop_is_signalled(monkeypatch):
+    """wait() と spawn の間に SIGTERM が来ても、新しいワーカーを止めて親が待ち続けないようにする。"""
+    killed = []
+    monkeypatch.setattr(server_module.os, "fork", lambda: 4242)
+    monkeypatch.setattr(server_module.os, "kill", lambda pid, sig: killed.append((pid, sig)))
+    server = PreforkServer(app, workers=1)
+
+    server._spawn()
+    assert killed == []
+
+    server._stop(signal.SIGTERM, None)
+    server._spawn()
+    assert killed == [(4242, signal.SIGTERM), (4242, signal.SIGTERM)]
+
+
+def test_preload_loads_langdetect_profiles(offline_encoding):
+    preload()
+    assert detector_factory._factory is not None
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _request(port: int, method: str, path: str, payload: dict) -> tuple:
+    """毎回新しい接続で送る（keep-alive で同じワーカーに固定されないようにする）。"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request(method, path, body=json.dumps(payload), headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+    finally:
+        conn.close()
+
+
+def test_session_survives_across_connections_with_default_workers(offline_encoding):
+    """既定のワーカー数ではセッションがどの接続からも見える（ストアはワーカーごとのため）。"""
+    assert PreforkServer(app).workers == server_module.WORKERS
+    if "UTC_WORKERS" not in os.environ:
+        assert server_module.WORKERS == 1
+
+    port = _free_port()
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            PreforkServer(app, port=port, max_requests=0).run()
+        except BaseException:
+            code = 1
+        finally:
+            os._exit(code)
+
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                status, body = _request(
+                    port, "POST", "/utc/v0/token-count/sessions", {"model": "gpt-4o", "text": "the thing"}
+                )
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        assert status == 201
+        session_id = body["session"]["session_id"]
+
+        for i in range(10):
+            status, body = _request(
+                port,
+                "POST",
+                f"/utc/v0/token-count/sessions/{session_id}/edits",
+                {"edits": [{"offset": 0, "insert": "x"}]},
+            )
+            assert status == 200, body
+            assert body["result"]["char_count"] == 10 + i
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+from core.singleflight import SingleFlight
+from core.token_counter import count_tokens, token_count_flight
+
+
+def test_concurrent_calls_share_one_computation():
+    """同じキーの同時呼び出しは 1 回だけ計算し、結果を共有する。"""
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return 42
+
+    results = []
+
+    def worker():
+        results.append(flight.do(("o200k_base", "same text"), compute))
+
+    leader = threading.Thread(target=worker)
+    leader.start()
+    started.wait(timeout=5)
+
+    followers = [threading.Thread(target=worker) for _ in range(3)]
+    for t in followers:
+        t.start()
+    # 後続 3 件が合流するまで待つ
+    while flight.coalesced < 3:
+        time.sleep(0.001)
+    release.set()
+    for t in [leader, *followers]:
+        t.join(timeout=5)
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(value == 42 for value, _ in results)
+    assert flight.stats() == {
+        "singleflight_leaders": 1,
+        "singleflight_coalesced": 3,
+        "singleflight_in_flight": 0,
+    }
+
+
+def test_error_is_propagated_and_key_is_released():
+    """計算が失敗した場合は例外を伝播し、次の呼び出しは再計算する。"""
+    flight = SingleFlight()
+
+    def boom():
+        raise RuntimeError("encode failed")
+
+    with pytest.raises(RuntimeError):
+        flight.do("key", boom)
+
+    assert flight.do("key", lambda: 1) == (1, False)
+
+
+def test_count_tokens_goes_through_singleflight(offline_encoding):
+    """count_tokens の encode は single-flight を経由する（逐次呼び出しでは合流しない）。"""
+    before = token_count_flight.stats()
+
+    first = count_tokens("gpt-4o", "the thing")
+    second = count_tokens("gpt-4.1", "the thing")
+
+    after = token_count_flight.stats()
+    assert after["singleflight_leaders"] == before["singleflight_leaders"] + 2
+    assert after["singleflight_coalesced"] == before["singleflight_coalesced"]
+    assert first["result"]["token_count"] == second["result"]["token_count"]
@@ -105,3 +105,67 @@ def test_invalid_type_raises_error():
         count_tokens("gpt-4o", None)  # text が None → INVALID_TYPE
 
     assert exc2.value.code == UtcErrorCode.INVALID_TYPE
+
+
+def test_utf8_length_matches_encode():
+    """utf8_length は encode した長さと一致する（ASCII / CJK / 絵文字 / チャンク境界）。"""
+    samples = [
+        "hello world",
+        "これはテストです",
+        "mixed テキスト with emoji 😀",
+        "あ" * (tc._UTF8_CHUNK_CHARS + 3),
+        "a" * (tc._UTF8_CHUNK_CHARS - 1) + "😀" + "b",
+    ]
+    for text in samples:
+        assert tc.utf8_length(text) == len(text.encode("utf-8"))
+
+    # 孤立サロゲートは例外にせず 3 バイトとして数える
+    assert tc.utf8_length("a\ud800") == 4
+
+
+def test_utf8_length_stops_at_limit():
+    """limit を超えた時点で打ち切り、limit より大きい値を返す。"""
+    text = "あ" * (tc._UTF8_CHUNK_CHARS * 4)
+    length = tc.utf8_length(text, limit=10)
+    assert 10 < length < len(text.encode("utf-8"))
+
+
+def test_whitespace_variants_are_empty():
+    """改行・全角スペースのみも EMPTY_TEXT。"""
+    for text in ("", "\n\t ", "　　"):
+        with pytest.raises(UtcError) as exc:
+            count_tokens("gpt-4o", text)
+        assert exc.value.code == UtcErrorCode.EMPTY_TEXT
+
+
+def test_estimate_mode_brackets_exact_count(offline_encoding):
+    """推定モードは MAX_CHAR_COUNT を超える入力を受け付け、信頼区間が正確な値を含む。"""
+    import random
+
+    rng = random.Random(0)
+    words = ["the", "thing", "in", "testing", "日本語", "テキスト", "123", "(x)", "\n\n"]
+    text = " ".join(rng.choice(words) for _ in range(120_000))
+    assert len(text) > tc.MAX_CHAR_COUNT
+
+    data = tc.count_tokens("gpt-4", text, accuracy="estimate")
+    exact = len(offline_encoding("cl100k_base").encode(text))
+
+    result, meta = data["result"], data["meta"]
+    assert result["token_count"] is None
+    assert meta["accuracy"] == "estimate"
+    assert meta["sampled_chars"] < len(text) // 4
+    ci = meta["confidence_interval"]
+    assert ci["low"] <= exact <= ci["high"]
+    assert abs(result["token_count_estimate"] - exact) / exact < 0.03
+
+
+def test_estimate_mode_counts_short_text_exactly(offline_encoding):
+    data = tc.count_tokens("gpt-4", "the thing", accuracy="estimate")
+    assert data["meta"]["accuracy"] == "exact"
+    assert data["result"]["token_count"] == data["result"]["token_count_estimate"]
+
+
+def test_estimate_mode_rejects_offsets():
+    with pytest.raises(tc.UtcError) as exc:
+        tc.count_tokens("gpt-4", "hello", accuracy="estimate", return_offsets=True)
+    assert exc.value.code == tc.UtcErrorCode.UNSUPPORTED_OPTION